@@ -0,0 +1,318 @@
+"""
+用 ffmpeg 的 testsrc2 / sine 源在本地生成确定性的合成视频，
+通过一个最小的 Dify 运行时依次调用三个工具，记录耗时、峰值内存、子进程数和磁盘写入量，
+并与 benchmarks/baseline.json 比较。
+
+    python benchmarks/run_benchmarks.py                    # 运行并与基线比较
+    python benchmarks/run_benchmarks.py --quick            # 只运行短视频
+    python benchmarks/run_benchmarks.py --update-baseline  # 用本次结果覆盖基线
+
+每个用例在独立的 Python 进程中运行，峰值内存和子进程统计互不影响；
+缓存在用例进程中被禁用，测量的是冷调用。
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+DEFAULT_CLIP_DIR = os.path.join(BENCHMARK_DIR, ".clips")
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, "baseline.json")
+
+# 合成视频：时长、分辨率、编码和 moov 位置（faststart 在文件开头，默认在文件末尾）
+CLIPS = [
+    {"name": "5s_360p_h264_faststart", "duration": 5, "size": "640x360", "codec": "h264", "container": "mp4", "faststart": True},
+    {"name": "5s_360p_h264_moov_end", "duration": 5, "size": "640x360", "codec": "h264", "container": "mp4", "faststart": False},
+    {"name": "5s_360p_mpeg4_mkv", "duration": 5, "size": "640x360", "codec": "mpeg4", "container": "mkv", "faststart": False},
+    {"name": "5s_1080p_h264_faststart", "duration": 5, "size": "1920x1080", "codec": "h264", "container": "mp4", "faststart": True},
+    {"name": "60s_360p_h264_moov_end", "duration": 60, "size": "640x360", "codec": "h264", "container": "mp4", "faststart": False},
+    {"name": "60s_720p_mpeg4_mkv", "duration": 60, "size": "1280x720", "codec": "mpeg4", "container": "mkv", "faststart": False},
+    {"name": "60s_1080p_h264_faststart", "duration": 60, "size": "1920x1080", "codec": "h264", "container": "mp4", "faststart": True},
+]
+QUICK_MAX_DURATION = 5
+
+_VIDEO_ENCODERS = {
+    "h264": ["-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p", "-x264-params", "threads=1"],
+    "mpeg4": ["-c:v", "mpeg4", "-q:v", "5", "-threads", "1"],
+}
+
+# 工具用例：(名称, 工具, 参数)，参数中的 "{half}" / "{tenth}" 按视频时长替换
+CASES = [
+    ("info", "get_video_info", {}),
+    ("frame_start", "get_video_frame", {"type": "start"}),
+    ("frame_middle", "get_video_frame", {"type": "time", "time": "{half}"}),
+    ("frame_end", "get_video_frame", {"type": "end"}),
+    ("frame_list_interval", "get_video_frame_list", {"gap_time": "{tenth}", "count": 10}),
+    ("frame_list_keyframes", "get_video_frame_list", {"selection_mode": "keyframes", "max_count": 10}),
+    ("frame_list_contact_sheet", "get_video_frame_list", {"gap_time": "{tenth}", "count": 16, "output_mode": "contact_sheet"}),
+]
+
+# 基线比较的容差：相对增幅和绝对增量都超过时才算回退
+TOLERANCES = {
+    "wall_ms": (0.25, 50),
+    "peak_rss_bytes": (0.15, 8 * 1024 * 1024),
+    "subprocess_count": (0, 0),
+    "disk_write_bytes": (0.10, 1024 * 1024),
+}
+
+
+def generate_clip(clip: dict, clip_dir: str) -> str:
+    """生成合成视频，已存在时直接复用"""
+    path = os.path.join(clip_dir, f"{clip['name']}.{clip['container']}")
+    if os.path.exists(path):
+        return path
+    os.makedirs(clip_dir, exist_ok=True)
+
+    duration = clip["duration"]
+    command = [
+        'ffmpeg', '-hide_banner', '-v', 'error', '-y',
+        '-f', 'lavfi', '-i', f"testsrc2=size={clip['size']}:rate=25:duration={duration}",
+        '-f', 'lavfi', '-i', f"sine=frequency=440:sample_rate=44100:duration={duration}",
+        *_VIDEO_ENCODERS[clip["codec"]],
+        '-g', '50',
+        '-c:a', 'aac', '-b:a', '64k',
+        '-map_metadata', '-1',
+        '-fflags', '+bitexact', '-flags:v', '+bitexact', '-flags:a', '+bitexact',
+    ]
+    if clip["faststart"]:
+        command += ['-movflags', '+faststart']
+    # 先写临时文件，中断时不会留下不完整的视频
+    temp_path = f"{path}.partial.{clip['container']}"
+    command.append(temp_path)
+    result = subprocess.run(command, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to generate {clip['name']}: {result.stderr.decode('utf-8', errors='replace')}")
+    os.replace(temp_path, path)
+    return path
+
+
+def resolve_parameters(parameters: dict, duration: float) -> dict:
+    placeholders = {"{half}": round(duration / 2, 3), "{tenth}": round(duration / 10, 3)}
+    return {key: placeholders.get(value, value) if isinstance(value, str) else value for key, value in parameters.items()}
+
+
+def _read_disk_writes() -> int:
+    """本进程和已回收子进程写入存储层的字节数（ru_oublock 以 512 字节为单位）"""
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_oublock + resource.getrusage(resource.RUSAGE_CHILDREN).ru_oublock) * 512
+
+
+def run_case(clip_path: str, duration: float, case_name: str) -> dict:
+    """在当前进程中运行一个用例，由 --worker 调用"""
+    sys.path.insert(0, REPO_DIR)
+    from types import SimpleNamespace
+
+    from dify_plugin.entities.tool import ToolRuntime
+    from tools.get_video_frame import GetVideoFrame
+    from tools.get_video_frame_list import GetVideoFrameList
+    from tools.get_video_info import GetVideoInfo
+    from utils.capabilities import warm_capabilities
+
+    tool_classes = {
+        "get_video_info": GetVideoInfo,
+        "get_video_frame": GetVideoFrame,
+        "get_video_frame_list": GetVideoFrameList,
+    }
+    _, tool_name, parameters = next(case for case in CASES if case[0] == case_name)
+
+    # 与插件启动时一样先探测 ffmpeg 能力，不计入用例
+    warm_capabilities()
+
+    # 统计工具启动的子进程；utils 在调用时才查找 subprocess.Popen，替换模块属性即可
+    spawned = []
+    original_popen = subprocess.Popen
+
+    class CountingPopen(original_popen):
+        def __init__(self, args, *popen_args, **popen_kwargs):
+            spawned.append(os.path.basename(args[0]) if isinstance(args, (list, tuple)) else str(args))
+            super().__init__(args, *popen_args, **popen_kwargs)
+
+    with open(clip_path, 'rb') as clip_file:
+        blob = clip_file.read()
+    extension = os.path.splitext(clip_path)[1]
+    video_file = SimpleNamespace(blob=blob, filename=os.path.basename(clip_path), extension=extension, mime_type=None)
+
+    tool = tool_classes[tool_name](runtime=ToolRuntime(credentials={}, user_id="benchmark", session_id=None), session=None)
+    tool_parameters = {"video": video_file, **resolve_parameters(parameters, duration)}
+
+    subprocess.Popen = CountingPopen
+    disk_writes_before = _read_disk_writes()
+    started_at = time.perf_counter()
+    blob_count = 0
+    output_bytes = 0
+    result_json = None
+    try:
+        for message in tool._invoke(tool_parameters):
+            if message.type == message.MessageType.BLOB:
+                blob_count += 1
+                output_bytes += len(message.message.blob)
+            elif message.type == message.MessageType.JSON:
+                result_json = message.message.json_object
+    finally:
+        wall_seconds = time.perf_counter() - started_at
+        subprocess.Popen = original_popen
+
+    # Linux 下 ru_maxrss 以 KB 为单位；子进程由 fork 产生，其 ru_maxrss 包含 fork 时继承的父进程内存，不单独统计
+    return {
+        "status": (result_json or {}).get("status", "unknown"),
+        "wall_ms": round(wall_seconds * 1000, 3),
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "subprocess_count": len(spawned),
+        "subprocesses": spawned,
+        "disk_write_bytes": _read_disk_writes() - disk_writes_before,
+        "blobs": blob_count,
+        "output_bytes": output_bytes,
+        "stages": {name: stage["total_ms"] for name, stage in ((result_json or {}).get("timings") or {}).get("stages", {}).items()},
+    }
+
+
+def _worker_environment() -> dict:
+    environment = dict(os.environ)
+    # 关闭所有缓存层，每次测量的都是冷调用；也不写指标文件
+    environment.update({
+        "FFMPEG_TOOLS_CACHE_DIR": "",
+        "FFMPEG_TOOLS_PROBE_CACHE_ENTRIES": "0",
+        "FFMPEG_TOOLS_FRAME_CACHE_ENTRIES": "0",
+        "FFMPEG_TOOLS_METRICS_FILE": "",
+    })
+    environment["PYTHONPATH"] = os.pathsep.join(filter(None, [REPO_DIR, environment.get("PYTHONPATH")]))
+    return environment
+
+
+def spawn_case(clip_path: str, duration: float, case_name: str) -> dict:
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--worker', clip_path, str(duration), case_name],
+        capture_output=True,
+        env=_worker_environment(),
+        cwd=REPO_DIR,
+    )
+    # 用例进程只在最后一行输出结果，其余输出（如 gevent 的警告）忽略
+    lines = result.stdout.decode('utf-8', errors='replace').strip().splitlines()
+    if result.returncode != 0 or not lines:
+        raise RuntimeError(f"Benchmark {case_name} on {os.path.basename(clip_path)} failed: {result.stderr.decode('utf-8', errors='replace')[-2000:]}")
+    return json.loads(lines[-1])
+
+
+def summarize(runs: list[dict]) -> dict:
+    """多次运行取耗时中位数，内存和磁盘写入取最大值"""
+    last = runs[-1]
+    return {
+        "status": last["status"],
+        "wall_ms": round(statistics.median(run["wall_ms"] for run in runs), 3),
+        "wall_ms_min": min(run["wall_ms"] for run in runs),
+        "peak_rss_bytes": max(run["peak_rss_bytes"] for run in runs),
+        "subprocess_count": max(run["subprocess_count"] for run in runs),
+        "subprocesses": last["subprocesses"],
+        "disk_write_bytes": max(run["disk_write_bytes"] for run in runs),
+        "blobs": last["blobs"],
+        "output_bytes": last["output_bytes"],
+        "stages": last["stages"],
+    }
+
+
+def compare(results: dict, baseline: dict) -> list[str]:
+    """返回超出容差的指标描述，基线中没有的用例不比较"""
+    regressions = []
+    for key, result in results.items():
+        expected = baseline.get(key)
+        if expected is None:
+            continue
+        if expected.get("status") == "success" and result["status"] != "success":
+            regressions.append(f"{key}: status {expected['status']} -> {result['status']}")
+        for metric, (relative, absolute) in TOLERANCES.items():
+            before, after = expected.get(metric), result.get(metric)
+            if before is None or after is None:
+                continue
+            if after - before > absolute and after > before * (1 + relative):
+                regressions.append(f"{key}: {metric} {before} -> {after}")
+    return regressions
+
+
+def environment_info() -> dict:
+    ffmpeg_version = subprocess.run(['ffmpeg', '-version'], capture_output=True).stdout.decode('utf-8', errors='replace').splitlines()
+    return {
+        "ffmpeg": ffmpeg_version[0] if ffmpeg_version else "",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def _format_bytes(value: int) -> str:
+    return f"{value / (1024 * 1024):.1f}M"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the ffmpeg tools on synthetic videos.")
+    parser.add_argument('--clip-dir', default=DEFAULT_CLIP_DIR, help="Where generated clips are kept between runs")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="Baseline JSON to compare against")
+    parser.add_argument('--update-baseline', action='store_true', help="Overwrite the baseline with this run")
+    parser.add_argument('--output', help="Also write this run's results to a JSON file")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per case, wall time is the median")
+    parser.add_argument('--quick', action='store_true', help=f"Only clips up to {QUICK_MAX_DURATION}s")
+    parser.add_argument('--filter', default="", help="Only run cases whose '<clip>/<case>' key contains this text")
+    parser.add_argument('--worker', nargs=3, metavar=('CLIP', 'DURATION', 'CASE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        clip_path, duration, case_name = args.worker
+        print(json.dumps(run_case(clip_path, float(duration), case_name)))
+        return 0
+
+    clips = [clip for clip in CLIPS if not args.quick or clip["duration"] <= QUICK_MAX_DURATION]
+    results = {}
+    for clip in clips:
+        clip_path = generate_clip(clip, args.clip_dir)
+        for case_name, _, _ in CASES:
+            key = f"{clip['name']}/{case_name}"
+            if args.filter not in key:
+                continue
+            results[key] = summarize([spawn_case(clip_path, clip["duration"], case_name) for _ in range(max(1, args.repeat))])
+            result = results[key]
+            print(
+                f"{key:<52} {result['status']:<8} {result['wall_ms']:>9.1f}ms "
+                f"rss {_format_bytes(result['peak_rss_bytes']):>7} "
+                f"procs {result['subprocess_count']:>3} "
+                f"disk {_format_bytes(result['disk_write_bytes']):>7}",
+                flush=True,
+            )
+
+    report = {"environment": environment_info(), "results": results}
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2, sort_keys=True)
+
+    if args.update_baseline:
+        # 只覆盖本次运行过的用例，--quick / --filter 不会删掉其余基线
+        baseline = {"environment": report["environment"], "results": {}}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as baseline_file:
+                baseline["results"] = json.load(baseline_file).get("results", {})
+        baseline["results"].update(results)
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --update-baseline to create one")
+        return 0
+    with open(args.baseline) as baseline_file:
+        regressions = compare(results, json.load(baseline_file).get("results", {}))
+    if regressions:
+        print("Regressions against the baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print("No regressions against the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
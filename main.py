@@ -1,6 +1,10 @@
 from dify_plugin import Plugin, DifyPluginEnv
 
+from utils.capabilities import warm_capabilities
+
 plugin = Plugin(DifyPluginEnv(MAX_REQUEST_TIMEOUT=120))
 
 if __name__ == '__main__':
+    # 启动时探测 ffmpeg 支持的滤镜和编解码器，工具调用直接使用缓存结果
+    warm_capabilities()
     plugin.run()
@@ -1,17 +1,22 @@
 from typing import Any
-import subprocess
+import shutil
 
 from dify_plugin import ToolProvider
 from dify_plugin.errors.tool import ToolProviderCredentialValidationError
 
+from utils.capabilities import get_capabilities, CapabilityError
+
 
 class FfmpegToolsDifyProvider(ToolProvider):
     
     def _validate_credentials(self, credentials: dict[str, Any]) -> None:
         try:
-            result = subprocess.run(["ffmpeg", "-version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, capture_output=True, text=True)
-            if result.returncode != 0:
-                raise ToolProviderCredentialValidationError("FFmpeg is not installed")
+            # 探测结果按二进制文件缓存在进程内和磁盘上，工具复用同一份结果
+            get_capabilities('ffmpeg')
+            if shutil.which('ffprobe') is None:
+                raise ToolProviderCredentialValidationError("FFprobe is not installed")
+        except CapabilityError as e:
+            raise ToolProviderCredentialValidationError(f"FFmpeg is not available: {str(e)}")
         except Exception as e:
             raise ToolProviderCredentialValidationError(str(e))
 
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 测试直接导入插件目录下的 utils / tools
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,32 @@
+from array import array
+
+from utils.frame_cache import frame_cache_key, keyframe_cache_time
+from utils.keyframe_index import KeyframeIndex
+
+
+def keyframe_index(times: list[float]) -> KeyframeIndex:
+    return KeyframeIndex(0, array('d', times), array('q', range(len(times))), [])
+
+
+def test_selected_time_snaps_to_indexed_keyframe():
+    index = keyframe_index([0.0, 10.0, 15.0, 25.0])
+    # showinfo 只有 6 位有效数字，容器起始时间偏移也会带来小的差异
+    assert keyframe_cache_time(25.023, index) == 25.0
+    assert keyframe_cache_time(14.98, index) == 15.0
+
+
+def test_selected_time_far_from_index_is_kept():
+    index = keyframe_index([0.0, 10.0])
+    assert keyframe_cache_time(4.0000001, index) == 4.0
+    assert keyframe_cache_time(4.0000001) == 4.0
+    assert keyframe_cache_time(12.0234, keyframe_index([])) == 12.023
+
+
+def test_frame_list_and_single_frame_share_entries_by_selected_keyframe():
+    # 抽取多帧时 18s 实际选出的是 25s 的关键帧，按 25s 保存；
+    # 单帧工具在 16s 处定位到 15s 的关键帧，查找 15s 的条目，不会取到 25s 的画面
+    index = keyframe_index([0.0, 10.0, 15.0, 25.0])
+    encode_params = {"format": "jpeg", "quality": 2}
+    stored_key = frame_cache_key("hash", keyframe_cache_time(25.0, index), "fast", encode_params)
+    assert stored_key == frame_cache_key("hash", index.nearest_keyframe(24.0), "fast", encode_params)
+    assert stored_key != frame_cache_key("hash", index.keyframe_before(16.0), "fast", encode_params)
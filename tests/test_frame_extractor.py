@@ -0,0 +1,294 @@
+import subprocess
+from types import SimpleNamespace
+
+import pytest
+
+from utils import frame_extractor
+from utils.frame_extractor import (
+    SEEK_MODE_ACCURATE, SEEK_MODE_FAST, SEEK_MODE_LEGACY, FrameExtractionError,
+    build_interval_selection, build_select_expression, iter_extract_frames, iter_frames,
+    map_seek_times, map_stream_frames, parse_selected_times
+)
+
+
+def showinfo_line(n: int, pts_time: float) -> str:
+    pts = int(pts_time * 12800)
+    return (
+        f"[Parsed_showinfo_1 @ 0x55d5c8a0c0c0] n:{n:4d} pts:{pts:7d} pts_time:{pts_time:g} duration:    512 "
+        f"duration_time:0.04 fmt:yuv420p cl:left sar:1/1 s:640x360 i:P iskey:0 type:P checksum:1A2B3C4D\n"
+    )
+
+
+def jpeg(index: int) -> bytes:
+    # 最小的 JPEG 结构：SOI、空的 SOS 段、熵编码数据、EOI
+    return b'\xff\xd8\xff\xda\x00\x02' + bytes([index, 0]) + b'\xff\xd9'
+
+
+def video_input():
+    return SimpleNamespace(path="/proc/self/fd/3", run_kwargs=lambda: {})
+
+
+class FakeStream:
+    """按预设的 stdout / stderr 模拟 ProcessStream，stdout 按不整齐的块到达"""
+
+    def __init__(self, command, stderr_lines, stdout, returncode=0):
+        self.command = command
+        self.stderr_lines = stderr_lines
+        self._stdout = stdout
+        self._returncode = returncode
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.closed = True
+
+    def chunks(self):
+        for offset in range(0, len(self._stdout), 7):
+            yield self._stdout[offset:offset + 7]
+
+    def wait_for_stderr(self, predicate):
+        return predicate(self.stderr_lines)
+
+    def finish(self):
+        return subprocess.CompletedProcess(self.command, self._returncode, None, b'decode error' if self._returncode else b'')
+
+
+@pytest.fixture
+def fake_ffmpeg(monkeypatch):
+    """让 iter_extract_frames 读取预设的帧时间点，而不是启动 ffmpeg"""
+    streams = []
+
+    def install(selected_times, returncode=0):
+        def create(command, **kwargs):
+            stderr_lines = [showinfo_line(index, selected_time) for index, selected_time in enumerate(selected_times)]
+            stdout = b''.join(jpeg(index) for index in range(len(selected_times)))
+            stream = FakeStream(command, stderr_lines, stdout, returncode)
+            streams.append(stream)
+            return stream
+        monkeypatch.setattr(frame_extractor, "ProcessStream", create)
+        return streams
+
+    return install
+
+
+# ---------------------------------------------------------------- select 表达式
+
+def test_select_expression_sorts_and_deduplicates():
+    expression = build_select_expression([2.0, 1.0, 2.0])
+    assert expression == (
+        "gt(gte(t,1.000000)*(isnan(prev_pts)+lt(prev_pts*TB,1.000000))"
+        "+gte(t,2.000000)*(isnan(prev_pts)+lt(prev_pts*TB,2.000000)),0)"
+    )
+
+
+def test_select_expression_include_first():
+    assert build_select_expression([0.5], include_first=True).endswith("+isnan(prev_pts),0)")
+
+
+def test_legacy_selection_uses_absolute_times():
+    input_args, expression, start_time = build_interval_selection(video_input(), [5.0, 7.5], SEEK_MODE_LEGACY)
+    assert start_time == 0
+    assert input_args == ['-i', "/proc/self/fd/3"]
+    assert "gte(t,5.000000)" in expression and "gte(t,7.500000)" in expression
+
+
+def test_accurate_selection_seeks_to_first_time():
+    input_args, expression, start_time = build_interval_selection(video_input(), [7.5, 5.0], SEEK_MODE_ACCURATE)
+    assert start_time == 5.0
+    assert input_args == ['-ss', '5.0', '-i', "/proc/self/fd/3"]
+    # 输入端定位后时间戳从 0 开始，表达式中的时间相应平移
+    assert "gte(t,0.000000)" in expression and "gte(t,2.500000)" in expression
+    assert "isnan(prev_pts)," not in expression
+
+
+def test_fast_selection_decodes_keyframes_only():
+    input_args, expression, start_time = build_interval_selection(video_input(), [3.0, 9.0], SEEK_MODE_FAST)
+    assert input_args[:2] == ['-skip_frame', 'nokey']
+    assert '-noaccurate_seek' in input_args
+    assert expression.endswith("+isnan(prev_pts),0)")
+
+
+# ---------------------------------------------------------------- showinfo
+
+def test_parse_selected_times_from_showinfo():
+    stderr = "".join([
+        "Input #0, mov,mp4,m4a,3gp,3g2,mj2, from 'pipe:':\n",
+        "  Stream #0:0(und): Video: h264 (High) (avc1 / 0x31637661), yuv420p, 640x360, 25 fps\n",
+        showinfo_line(0, 0),
+        "[Parsed_showinfo_1 @ 0x55d5c8a0c0c0] color_range:tv color_space:bt709\n",
+        showinfo_line(1, 2.04),
+        showinfo_line(2, -0.04),
+        "frame=    3 fps=0.0 q=-0.0 Lsize=N/A time=00:00:02.08 bitrate=N/A speed=  25x\n",
+    ])
+    assert parse_selected_times(stderr) == [0.0, 2.04, -0.04]
+
+
+# ---------------------------------------------------------------- 时间点映射
+
+def test_map_seek_times_duplicates_and_eof():
+    # 重复的时间点对应同一帧，超出视频结尾的时间点为 None
+    assert map_seek_times([1.0, 1.0, 2.0, 99.0], [1.0, 2.04]) == [0, 0, 1, None]
+
+
+def test_map_seek_times_float_tolerance():
+    assert map_seek_times([1.0], [0.9995, 1.04]) == [0]
+
+
+def test_map_seek_times_nearest():
+    assert map_seek_times([1.0, 6.0, 99.0], [0.0, 4.0, 8.0], nearest=True) == [0, 1, 2]
+    assert map_seek_times([1.0], [], nearest=True) == [None]
+
+
+@pytest.mark.parametrize("nearest", [False, True])
+@pytest.mark.parametrize("seek_times, selected_times", [
+    ([0.0, 1.0, 2.0], [0.0, 1.0, 2.0]),
+    ([1.0, 1.0, 2.0, 2.0], [1.0, 2.0]),
+    ([0.5, 1.5, 30.0, 40.0], [0.52, 1.52, 9.96]),
+    ([1.0, 6.0, 7.0], [0.0, 4.0, 8.0]),
+    ([3.0], []),
+])
+def test_map_stream_frames_matches_map_seek_times(seek_times, selected_times, nearest):
+    frames = [(selected_time, jpeg(index)) for index, selected_time in enumerate(selected_times)]
+    expected = [
+        frames[frame_index] if frame_index is not None else None
+        for frame_index in map_seek_times(seek_times, selected_times, nearest=nearest)
+    ]
+    assert list(map_stream_frames(seek_times, iter(frames), nearest=nearest)) == expected
+
+
+def test_map_stream_frames_yields_before_the_stream_ends():
+    def frames():
+        yield 0.0, b'first'
+        yield 1.0, b'second'
+        raise AssertionError("read past the frames needed so far")
+
+    produced = map_stream_frames([0.0, 0.5, 2.0], frames())
+    assert next(produced) == (0.0, b'first')
+    assert next(produced) == (1.0, b'second')
+
+
+# ---------------------------------------------------------------- 单次解码
+
+def test_iter_extract_frames_accurate_maps_relative_times(fake_ffmpeg):
+    # 定位到 5s 之后 showinfo 的时间从 0 开始，产出的时间换算回请求的时间轴
+    streams = fake_ffmpeg([0.0, 1.0, 2.0])
+    frames = list(iter_extract_frames(video_input(), [5.0, 6.0, 6.0, 7.0, 120.0], SEEK_MODE_ACCURATE))
+    assert frames == [(5.0, jpeg(0)), (6.0, jpeg(1)), (6.0, jpeg(1)), (7.0, jpeg(2)), None]
+    assert streams[0].command[streams[0].command.index('-ss') + 1] == '5.0'
+    # 去重后的 4 个时间点各选一帧，选够后 ffmpeg 不再解码到文件结尾
+    assert streams[0].command[streams[0].command.index('-frames:v') + 1] == '4'
+    assert streams[0].closed
+
+
+def test_iter_extract_frames_legacy_maps_absolute_times(fake_ffmpeg):
+    fake_ffmpeg([5.0, 6.0, 7.0])
+    frames = list(iter_extract_frames(video_input(), [5.0, 6.0, 7.0], SEEK_MODE_LEGACY))
+    assert frames == [(5.0, jpeg(0)), (6.0, jpeg(1)), (7.0, jpeg(2))]
+
+
+def test_iter_extract_frames_fast_uses_nearest_keyframe(fake_ffmpeg):
+    # fast 模式额外选出定位后的第一帧，按距离取最近的关键帧；视频结束后取最后一个关键帧
+    streams = fake_ffmpeg([0.0, 4.0, 8.0])
+    frames = list(iter_extract_frames(video_input(), [1.0, 8.0, 20.0], SEEK_MODE_FAST))
+    assert frames == [(1.0, jpeg(0)), (9.0, jpeg(2)), (9.0, jpeg(2))]
+    assert streams[0].command[streams[0].command.index('-frames:v') + 1] == '4'
+
+
+def test_iter_extract_frames_fast_reports_selected_keyframe(fake_ffmpeg):
+    # 关键帧 0/10/15/25，请求 [2, 18]：定位到 2s 前的关键帧 0，之后选出 10 和 25，
+    # 18s 对应的是选出的 25s 而不是最近的关键帧 15s，缓存须按 25s 保存
+    fake_ffmpeg([-2.0, 8.0, 23.0])
+    frames = list(iter_extract_frames(video_input(), [2.0, 18.0], SEEK_MODE_FAST))
+    assert frames == [(0.0, jpeg(0)), (25.0, jpeg(2))]
+
+
+def test_iter_extract_frames_raises_after_produced_frames(fake_ffmpeg):
+    fake_ffmpeg([0.0, 1.0], returncode=1)
+    produced = iter_extract_frames(video_input(), [0.0, 1.0, 2.0], SEEK_MODE_ACCURATE)
+    assert next(produced) == (0.0, jpeg(0))
+    assert next(produced) == (1.0, jpeg(1))
+    with pytest.raises(FrameExtractionError, match="decode error"):
+        next(produced)
+
+
+# ---------------------------------------------------------------- 提取策略
+
+@pytest.fixture
+def strategy(monkeypatch):
+    """记录 iter_frames 选择的提取方式，单次解码在产出 failing_after 帧之后失败"""
+    calls = []
+
+    def configure(name, workers=4, failing_after=None):
+        monkeypatch.setattr(frame_extractor, "EXTRACTION_STRATEGY", name)
+        monkeypatch.setattr(frame_extractor, "EXTRACTION_WORKERS", workers)
+
+        def single(video_input, seek_times, *args):
+            calls.append(("single", list(seek_times)))
+            for index, seek_time in enumerate(seek_times):
+                if failing_after is not None and index == failing_after:
+                    raise FrameExtractionError("select failed")
+                yield f"single {seek_time}".encode()
+
+        def parallel(video_input, seek_times, seek_mode, workers, *args):
+            calls.append(("parallel", list(seek_times)))
+            for seek_time in seek_times:
+                yield f"parallel {seek_time}".encode()
+
+        def whole(video_input, seek_times, *args):
+            calls.append(("whole", list(seek_times)))
+            return [f"whole {seek_time}".encode() for seek_time in seek_times]
+
+        monkeypatch.setattr(frame_extractor, "iter_extract_frames", single)
+        monkeypatch.setattr(frame_extractor, "extract_frames_parallel", parallel)
+        monkeypatch.setattr(frame_extractor, "extract_frames", whole)
+        return calls
+
+    return configure
+
+
+MP4_METADATA = {
+    "format": {"format_name": "mov,mp4,m4a,3gp,3g2,mj2"},
+    "streams": [{"codec_type": "video", "codec_name": "h264", "width": 640, "height": 360}],
+}
+
+
+def test_auto_falls_back_to_parallel_for_remaining_times(strategy):
+    calls = strategy("auto", failing_after=2)
+    frames = list(iter_frames(video_input(), [0.0, 1.0, 2.0, 3.0], SEEK_MODE_ACCURATE, MP4_METADATA, 1024))
+    assert frames == [b'single 0.0', b'single 1.0', b'parallel 2.0', b'parallel 3.0']
+    assert calls == [("single", [0.0, 1.0, 2.0, 3.0]), ("parallel", [2.0, 3.0])]
+
+
+def test_auto_without_failure_stays_single(strategy):
+    calls = strategy("auto")
+    assert list(iter_frames(video_input(), [0.0, 1.0], SEEK_MODE_ACCURATE, MP4_METADATA, 1024)) == [b'single 0.0', b'single 1.0']
+    assert [call[0] for call in calls] == ["single"]
+
+
+def test_single_strategy_does_not_fall_back(strategy):
+    strategy("single", failing_after=1)
+    produced = iter_frames(video_input(), [0.0, 1.0], SEEK_MODE_ACCURATE, MP4_METADATA, 1024)
+    assert next(produced) == b'single 0.0'
+    with pytest.raises(FrameExtractionError):
+        next(produced)
+
+
+def test_auto_with_one_worker_does_not_fall_back(strategy):
+    strategy("auto", workers=1, failing_after=0)
+    with pytest.raises(FrameExtractionError):
+        list(iter_frames(video_input(), [0.0, 1.0], SEEK_MODE_ACCURATE, MP4_METADATA, 1024))
+
+
+def test_auto_prefers_parallel_for_intra_only_codecs(strategy):
+    calls = strategy("auto")
+    metadata = {"format": {"format_name": "mov,mp4,m4a,3gp,3g2,mj2"}, "streams": [{"codec_type": "video", "codec_name": "prores"}]}
+    list(iter_frames(video_input(), [0.0, 1.0], SEEK_MODE_ACCURATE, metadata, 1024))
+    assert [call[0] for call in calls] == ["parallel"]
+
+
+def test_unsorted_times_use_whole_decode(strategy):
+    calls = strategy("auto")
+    assert list(iter_frames(video_input(), [2.0, 1.0], SEEK_MODE_ACCURATE, MP4_METADATA, 1024)) == [b'whole 2.0', b'whole 1.0']
+    assert [call[0] for call in calls] == ["whole"]
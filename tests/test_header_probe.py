@@ -0,0 +1,256 @@
+import struct
+import time
+
+import pytest
+
+from utils.header_probe import MATROSKA_FORMAT_NAME, MP4_FORMAT_NAME, probe_header
+
+
+# ---------------------------------------------------------------- MP4 构造
+
+def box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def media_header(box_type: bytes, timescale: int, duration: int) -> bytes:
+    # mvhd / mdhd version 0：version/flags、创建和修改时间之后是 timescale 和 duration
+    return box(box_type, bytes(12) + struct.pack('>II', timescale, duration) + bytes(80 if box_type == b'mvhd' else 4))
+
+
+def tkhd(width: int, height: int) -> bytes:
+    return box(b'tkhd', bytes(76) + struct.pack('>II', width << 16, height << 16))
+
+
+def hdlr(handler_type: bytes) -> bytes:
+    return box(b'hdlr', bytes(8) + handler_type + bytes(13))
+
+
+def visual_sample_entry(entry_type: bytes, width: int, height: int, pixel_aspect: tuple[int, int] | None = None) -> bytes:
+    children = box(b'pasp', struct.pack('>II', *pixel_aspect)) if pixel_aspect else b''
+    return box(entry_type, bytes(8) + bytes(16) + struct.pack('>HH', width, height) + bytes(50) + children)
+
+
+def audio_sample_entry(channels: int, sample_rate: int, object_type: int) -> bytes:
+    # ES_Descriptor（ES_ID、无附加字段）-> DecoderConfigDescriptor（objectTypeIndication）
+    esds = box(b'esds', bytes(4) + bytes([0x03, 16, 0, 1, 0, 0x04, 11, object_type]) + bytes(10))
+    return box(b'mp4a', bytes(8) + struct.pack('>HHIHHHHI', 0, 0, 0, channels, 16, 0, 0, sample_rate << 16) + esds)
+
+
+def stsd(entry: bytes) -> bytes:
+    return box(b'stsd', bytes(4) + struct.pack('>I', 1) + entry)
+
+
+def stts(entries: list[tuple[int, int]]) -> bytes:
+    return box(b'stts', bytes(4) + struct.pack('>I', len(entries)) + b''.join(struct.pack('>II', *entry) for entry in entries))
+
+
+def trak(handler_type: bytes, timescale: int, duration: int, sample_entry: bytes, time_to_sample: bytes = b'', display_size: tuple[int, int] = (0, 0)) -> bytes:
+    stbl = box(b'stbl', stsd(sample_entry) + time_to_sample)
+    mdia = box(b'mdia', media_header(b'mdhd', timescale, duration) + hdlr(handler_type) + box(b'minf', stbl))
+    return box(b'trak', tkhd(*display_size) + mdia)
+
+
+def build_mp4(tracks: list[bytes], movie_timescale: int = 1000, movie_duration: int = 10000, mdat_size: int = 64) -> bytes:
+    ftyp = box(b'ftyp', b'isom' + struct.pack('>I', 512) + b'isomavc1')
+    moov = box(b'moov', media_header(b'mvhd', movie_timescale, movie_duration) + b''.join(tracks))
+    return ftyp + moov + box(b'mdat', bytes(mdat_size))
+
+
+def h264_track(width: int = 1920, height: int = 1080, pixel_aspect: tuple[int, int] | None = None, time_to_sample: bytes | None = None) -> bytes:
+    # 12800 的时间刻度、每帧 512 即 25 fps，共 250 帧
+    return trak(
+        b'vide', 12800, 128000,
+        visual_sample_entry(b'avc1', width, height, pixel_aspect),
+        stts([(250, 512)]) if time_to_sample is None else time_to_sample,
+        (width, height)
+    )
+
+
+def aac_track() -> bytes:
+    return trak(b'soun', 48000, 480000, audio_sample_entry(2, 48000, 0x40))
+
+
+# ---------------------------------------------------------------- Matroska 构造
+
+def element(element_id: int, payload: bytes) -> bytes:
+    # 大小统一写成 8 字节的变长整数
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, 'big') + b'\x01' + len(payload).to_bytes(7, 'big') + payload
+
+
+def uint_element(element_id: int, value: int) -> bytes:
+    return element(element_id, value.to_bytes(max(1, (value.bit_length() + 7) // 8), 'big'))
+
+
+def build_mkv(width: int = 1280, height: int = 720, display_size: tuple[int, int] | None = None, duration_ms: float | None = 10000.0, doc_type: bytes = b'matroska') -> bytes:
+    ebml = element(0x1A45DFA3, element(0x4282, doc_type))
+    info = uint_element(0x2AD7B1, 1000000)
+    if duration_ms is not None:
+        info += element(0x4489, struct.pack('>d', duration_ms))
+    video = uint_element(0xB0, width) + uint_element(0xBA, height)
+    if display_size:
+        video += uint_element(0x54B0, display_size[0]) + uint_element(0x54BA, display_size[1])
+    video_track = element(0xAE, uint_element(0x83, 1) + element(0x86, b'V_MPEG4/ISO/AVC') + uint_element(0x23E383, 40000000) + element(0xE0, video))
+    audio_track = element(0xAE, uint_element(0x83, 2) + element(0x86, b'A_OPUS') + element(0xE1, element(0xB5, struct.pack('>d', 48000.0)) + uint_element(0x9F, 2)))
+    cluster = element(0x1F43B675, bytes(64))
+    return ebml + element(0x18538067, element(0x1549A966, info) + element(0x1654AE6B, video_track + audio_track) + cluster)
+
+
+# ---------------------------------------------------------------- MP4
+
+def test_mp4_video_and_audio():
+    metadata = probe_header(build_mp4([h264_track(), aac_track()]))
+
+    assert metadata["format"]["format_name"] == MP4_FORMAT_NAME
+    assert metadata["format"]["duration"] == "10.000000"
+    assert metadata["format"]["nb_streams"] == 2
+
+    video, audio = metadata["streams"]
+    assert video["codec_type"] == "video"
+    assert video["codec_name"] == "h264"
+    assert (video["width"], video["height"]) == (1920, 1080)
+    assert video["r_frame_rate"] == "25/1"
+    assert video["display_aspect_ratio"] == "16:9"
+    assert video["duration"] == "10.000000"
+
+    assert audio["codec_type"] == "audio"
+    assert audio["codec_name"] == "aac"
+    assert audio["sample_rate"] == "48000"
+    assert audio["channels"] == 2
+    assert audio["channel_layout"] == "stereo"
+
+
+def test_mp4_pixel_aspect_ratio():
+    # 720x576 的 PAL 画面，像素宽高比 16:15，显示为 4:3
+    metadata = probe_header(build_mp4([h264_track(720, 576, pixel_aspect=(16, 15))]))
+    assert metadata["streams"][0]["display_aspect_ratio"] == "4:3"
+
+
+def test_mp4_dominant_frame_rate():
+    # 可变帧率时取覆盖样本最多的帧间隔，与 ffprobe 的 r_frame_rate 一致
+    metadata = probe_header(build_mp4([h264_track(time_to_sample=stts([(10, 1001), (290, 1001), (5, 2002)]))], movie_duration=10010))
+    assert metadata["streams"][0]["r_frame_rate"] == "12800/1001"
+
+
+def test_mp4_without_video_is_rejected():
+    assert probe_header(build_mp4([aac_track()])) is None
+
+
+def test_mp4_unknown_video_codec_is_rejected():
+    track = trak(b'vide', 12800, 128000, visual_sample_entry(b'xxxx', 640, 360), stts([(250, 512)]), (640, 360))
+    assert probe_header(build_mp4([track])) is None
+
+
+def test_mp4_truncated_header_returns_none():
+    data = build_mp4([h264_track(), aac_track()])
+    moov_end = data.index(b'mdat') - 4
+    for length in range(moov_end):
+        assert probe_header(data[:length]) is None
+
+
+@pytest.mark.parametrize("size", [7, 0xFFFFFFFF])
+def test_mp4_invalid_moov_size_returns_none(size):
+    data = bytearray(build_mp4([h264_track()]))
+    moov_offset = data.index(b'moov') - 4
+    struct.pack_into('>I', data, moov_offset, size)
+    assert probe_header(bytes(data)) is None
+
+
+def test_mp4_oversized_nested_box_returns_none():
+    data = bytearray(build_mp4([h264_track()]))
+    trak_offset = data.index(b'trak') - 4
+    struct.pack_into('>I', data, trak_offset, 0x7FFFFFFF)
+    assert probe_header(bytes(data)) is None
+
+
+def test_mp4_oversized_largesize_returns_none():
+    data = bytearray(build_mp4([h264_track()]))
+    mvhd_offset = data.index(b'mvhd') - 4
+    # size 为 1 表示后面是 64 位的 largesize
+    data[mvhd_offset:mvhd_offset + 8] = struct.pack('>I4s', 1, b'mvhd')
+    data[mvhd_offset + 8:mvhd_offset + 8] = struct.pack('>Q', 1 << 62)
+    assert probe_header(bytes(data)) is None
+
+
+def test_mp4_oversized_table_count_returns_none_quickly():
+    # stts 的条目数远超 box 本身时不能按条目数遍历后面的整个 mdat
+    data = bytearray(build_mp4([h264_track()], mdat_size=16 * 1024 * 1024))
+    stts_offset = data.index(b'stts') - 4
+    struct.pack_into('>I', data, stts_offset + 12, 0xFFFFFFFF)
+    started_at = time.monotonic()
+    assert probe_header(bytes(data)) is None
+    assert time.monotonic() - started_at < 1
+
+
+def test_mp4_with_moov_after_mdat():
+    # 上传内容完整地在内存中，moov 位于 mdat 之后也可以读取
+    ftyp = box(b'ftyp', b'isom' + bytes(4))
+    data = build_mp4([h264_track()])
+    moov = data[data.index(b'moov') - 4:data.index(b'mdat') - 4]
+    metadata = probe_header(ftyp + box(b'mdat', bytes(64)) + moov)
+    assert metadata["streams"][0]["codec_name"] == "h264"
+
+
+# ---------------------------------------------------------------- Matroska
+
+def test_matroska_video_and_audio():
+    metadata = probe_header(build_mkv())
+
+    assert metadata["format"]["format_name"] == MATROSKA_FORMAT_NAME
+    assert metadata["format"]["duration"] == "10.000000"
+
+    video, audio = metadata["streams"]
+    assert video["codec_name"] == "h264"
+    assert (video["width"], video["height"]) == (1280, 720)
+    assert video["r_frame_rate"] == "25/1"
+    assert video["display_aspect_ratio"] == "16:9"
+
+    assert audio["codec_name"] == "opus"
+    assert audio["sample_rate"] == "48000"
+    assert audio["channels"] == 2
+
+
+def test_matroska_display_size():
+    # 1440x1080 的变形画面按 DisplayWidth / DisplayHeight 显示为 16:9
+    metadata = probe_header(build_mkv(1440, 1080, display_size=(16, 9)))
+    assert metadata["streams"][0]["display_aspect_ratio"] == "16:9"
+
+
+def test_webm_doc_type():
+    assert probe_header(build_mkv(doc_type=b'webm')) is not None
+
+
+def test_matroska_unknown_doc_type_returns_none():
+    assert probe_header(build_mkv(doc_type=b'other')) is None
+
+
+def test_matroska_without_duration_returns_none():
+    assert probe_header(build_mkv(duration_ms=None)) is None
+
+
+def test_matroska_truncated_header_returns_none():
+    data = build_mkv()
+    tracks_end = data.index(bytes.fromhex('1F43B675'))
+    # 截断在 Info / Tracks 中时不能使用截断的字段值，截断在 Cluster 中时头部仍然完整
+    for length in range(tracks_end - 1):
+        assert probe_header(data[:length]) is None
+
+
+def test_matroska_invalid_vint_returns_none():
+    data = bytearray(build_mkv())
+    tracks_offset = data.index(bytes.fromhex('1654AE6B'))
+    data[tracks_offset + 4] = 0
+    assert probe_header(bytes(data)) is None
+
+
+def test_matroska_oversized_element_is_clamped():
+    # 只下载了一部分的文件：Segment 声明的大小超出数据，按数据结尾截断
+    data = bytearray(build_mkv())
+    segment_offset = data.index(bytes.fromhex('18538067'))
+    data[segment_offset + 4:segment_offset + 12] = b'\x01' + (1 << 50).to_bytes(7, 'big')
+    metadata = probe_header(bytes(data))
+    assert metadata["streams"][0]["width"] == 1280
+
+
+def test_unknown_container_returns_none():
+    assert probe_header(b'') is None
+    assert probe_header(b'RIFF\x00\x00\x00\x00AVI LIST') is None
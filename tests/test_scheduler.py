@@ -0,0 +1,184 @@
+import threading
+import time
+
+from utils.scheduler import ProcessScheduler
+
+
+def wait_until(condition, timeout: float = 5) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.005)
+
+
+class Worker(threading.Thread):
+    """在独立线程中申请名额，放行后记录顺序，直到 finish 被设置再归还"""
+
+    def __init__(self, scheduler: ProcessScheduler, invocation: object, label: str, admitted: list, **acquire_kwargs):
+        super().__init__(daemon=True)
+        self.scheduler = scheduler
+        self.invocation = invocation
+        self.label = label
+        self.admitted = admitted
+        self.acquire_kwargs = acquire_kwargs
+        self.finish = threading.Event()
+        self.finish.set()
+        self.slot = None
+
+    def run(self):
+        self.slot = self.scheduler.acquire(self.invocation, **self.acquire_kwargs)
+        if self.slot is None:
+            return
+        self.admitted.append(self.label)
+        self.finish.wait(5)
+        self.slot.release()
+
+
+def queue_worker(scheduler: ProcessScheduler, invocation: object, label: str, admitted: list, **acquire_kwargs) -> Worker:
+    queued = scheduler.to_dict()["queued"]
+    worker = Worker(scheduler, invocation, label, admitted, **acquire_kwargs)
+    worker.start()
+    wait_until(lambda: scheduler.to_dict()["queued"] == queued + 1)
+    return worker
+
+
+def test_admits_up_to_max_processes():
+    scheduler = ProcessScheduler(2, threads=1)
+    admitted = []
+    holders = [Worker(scheduler, object(), f"holder {index}", admitted) for index in range(2)]
+    for holder in holders:
+        holder.finish.clear()
+        holder.start()
+    wait_until(lambda: len(admitted) == 2)
+    assert scheduler.to_dict()["running"] == 2
+
+    waiter = queue_worker(scheduler, object(), "waiter", admitted)
+    assert sorted(admitted) == ["holder 0", "holder 1"]
+
+    holders[0].finish.set()
+    waiter.join(5)
+    assert admitted[-1] == "waiter"
+    holders[1].finish.set()
+    holders[1].join(5)
+
+    stats = scheduler.to_dict()
+    assert stats["running"] == 0
+    assert stats["queued"] == 0
+    assert stats["admitted_total"] == 3
+    assert stats["queued_total"] == 1
+    assert stats["wait_max_ms"] > 0
+
+
+def test_queued_invocations_are_admitted_round_robin():
+    scheduler = ProcessScheduler(1, threads=1)
+    slot = scheduler.acquire(object())
+    admitted = []
+    large, small = object(), object()
+
+    # 一个调用先排了三个进程，另一个调用之后只排了一个
+    workers = [
+        queue_worker(scheduler, large, "large 1", admitted),
+        queue_worker(scheduler, large, "large 2", admitted),
+        queue_worker(scheduler, large, "large 3", admitted),
+        queue_worker(scheduler, small, "small 1", admitted),
+    ]
+    assert scheduler.to_dict()["queued_invocations"] == 2
+
+    slot.release()
+    for worker in workers:
+        worker.join(5)
+    assert admitted == ["large 1", "small 1", "large 2", "large 3"]
+
+
+def test_acquire_times_out():
+    scheduler = ProcessScheduler(1, threads=1)
+    slot = scheduler.acquire(object())
+    admitted = []
+
+    worker = Worker(scheduler, object(), "late", admitted, timeout=0.2)
+    started_at = time.monotonic()
+    worker.start()
+    worker.join(5)
+
+    assert worker.slot is None
+    assert time.monotonic() - started_at >= 0.2
+    # 超时的进程不再留在队列中，之后的名额不会被分给它
+    assert scheduler.to_dict()["queued"] == 0
+    slot.release()
+    assert scheduler.to_dict()["running"] == 0
+
+
+def test_acquire_stops_when_cancelled():
+    scheduler = ProcessScheduler(1, threads=1)
+    slot = scheduler.acquire(object())
+    admitted = []
+    cancelled = threading.Event()
+
+    worker = queue_worker(scheduler, object(), "cancelled", admitted, should_stop=cancelled.is_set)
+    cancelled.set()
+    worker.join(5)
+
+    assert worker.slot is None
+    assert scheduler.to_dict()["queued"] == 0
+    slot.release()
+    assert admitted == []
+    assert scheduler.to_dict()["running"] == 0
+
+
+def test_thread_holding_a_slot_is_admitted_immediately():
+    # 流式解码中重新编码图片：同一线程已持有名额时不排队，避免等待自己
+    scheduler = ProcessScheduler(1, threads=1)
+    outer = scheduler.acquire(object())
+    inner = scheduler.acquire(object(), timeout=0.1)
+    assert inner is not None
+    assert scheduler.to_dict()["running"] == 2
+
+    inner.release()
+    outer.release()
+    assert scheduler.to_dict()["running"] == 0
+
+    # 归还后不再视为持有名额
+    blocker = scheduler.acquire(object())
+    result = []
+    thread = threading.Thread(target=lambda: result.append(scheduler.acquire(object(), timeout=0.1)))
+    thread.start()
+    thread.join(5)
+    assert result == [None]
+    blocker.release()
+
+
+def test_release_is_idempotent():
+    scheduler = ProcessScheduler(2, threads=1)
+    slot = scheduler.acquire(object())
+    slot.release()
+    slot.release()
+    assert scheduler.to_dict()["running"] == 0
+
+
+def test_apply_limits_ffmpeg_threads():
+    scheduler = ProcessScheduler(2, threads=3)
+    slot = scheduler.acquire(object())
+    command = ['ffmpeg', '-hide_banner', '-ss', '1', '-i', 'pipe:', '-f', 'image2pipe', '-']
+    assert slot.apply(command) == [
+        'ffmpeg', '-filter_threads', '3', '-hide_banner', '-ss', '1', '-threads', '3', '-i', 'pipe:', '-f', 'image2pipe', '-'
+    ]
+    # ffprobe、已指定线程数和没有输入的命令保持不变
+    assert slot.apply(['ffprobe', '-i', 'pipe:']) == ['ffprobe', '-i', 'pipe:']
+    assert slot.apply(['ffmpeg', '-threads', '1', '-i', 'pipe:']) == ['ffmpeg', '-threads', '1', '-i', 'pipe:']
+    assert slot.apply(['ffmpeg', '-filters']) == ['ffmpeg', '-filters']
+    slot.release()
+
+
+def test_threads_split_available_cpus():
+    scheduler = ProcessScheduler(4)
+    scheduler._cpus = 8
+    first = scheduler.acquire(object())
+    assert first.threads == 8
+    second = Worker(scheduler, object(), "second", [])
+    second.finish.clear()
+    second.start()
+    wait_until(lambda: second.slot is not None)
+    assert second.slot.threads == 4
+    second.finish.set()
+    second.join(5)
+    first.release()
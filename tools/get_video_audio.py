@@ -0,0 +1,274 @@
+from dify_plugin import Tool
+from dify_plugin.entities.tool import ToolInvokeMessage
+from collections.abc import Generator
+from typing import Any
+import os
+
+from utils.cache import content_hash
+from utils.probe_cache import get_cached_probe, probe_video, probe_video_header, get_duration, ProbeError
+from utils.capabilities import check_support, CapabilityError
+from utils.video_input import open_video_input, estimate_input_memory, uses_memfd_output
+from utils.resources import plan_output_memory, estimate_decoder_memory, MemoryBudgetError
+from utils.process import Deadline, ProcessTimeoutError
+from utils.scheduler import get_scheduler
+from utils.timing import StageTimer, record_metrics
+from utils.batch import get_batch_files, invoke_batch
+from utils.single_flight import coalesce_invocation
+from utils.audio_analysis import (
+    SilenceDetector, extract_audio, estimate_audio_bytes, get_output_sample_rate, get_audio_extension, get_audio_mime_type, required_encoders, AudioExtractionError,
+    AUDIO_FORMATS, AUDIO_FORMAT_NONE, DEFAULT_AUDIO_FORMAT, AUDIO_MAX_BYTES,
+    DEFAULT_SAMPLE_RATE, DEFAULT_CHANNELS, MIN_SAMPLE_RATE, MAX_SAMPLE_RATE, DEFAULT_SILENCE_THRESHOLD_DB, DEFAULT_MIN_SILENCE_SECONDS
+)
+
+class GetVideoAudio(Tool):
+    def _invoke(self, tool_parameters: dict[str, Any]) -> Generator[ToolInvokeMessage, None, None]:
+        # 提供 videos 时批量处理，每个文件按单文件的流程处理
+        batch_files = get_batch_files(tool_parameters)
+        if batch_files is not None:
+            yield from invoke_batch(
+                self,
+                batch_files,
+                lambda video_file, deadline, video_hash: self._invoke_coalesced({**tool_parameters, 'video': video_file}, deadline, video_hash),
+                file_memory=estimate_decoder_memory(0, 0) + (AUDIO_MAX_BYTES if tool_parameters.get('output_format') != AUDIO_FORMAT_NONE else 0)
+            )
+            return
+        yield from self._invoke_coalesced(tool_parameters)
+
+    def _invoke_coalesced(self, tool_parameters: dict[str, Any], parent_deadline: Deadline | None = None, video_hash: str | None = None) -> Generator[ToolInvokeMessage, None, None]:
+        # 内容和参数都相同的并发调用只处理一次，其余调用等待并复用同一结果
+        yield from coalesce_invocation(
+            self,
+            "get_video_audio",
+            tool_parameters,
+            video_hash,
+            parent_deadline,
+            lambda video_hash, timer, deadline: self._invoke_video(tool_parameters, deadline, video_hash, timer)
+        )
+
+    def _invoke_video(self, tool_parameters: dict[str, Any], parent_deadline: Deadline | None = None, video_hash: str | None = None, timer: StageTimer | None = None) -> Generator[ToolInvokeMessage, None, None]:
+        video_file = tool_parameters.get('video')
+        audio_format = tool_parameters.get('output_format') or DEFAULT_AUDIO_FORMAT
+        sample_rate = tool_parameters.get('sample_rate', DEFAULT_SAMPLE_RATE)
+        channels = tool_parameters.get('channels', DEFAULT_CHANNELS)
+        silence_threshold = tool_parameters.get('silence_threshold', DEFAULT_SILENCE_THRESHOLD_DB)
+        min_silence_duration = tool_parameters.get('min_silence_duration', DEFAULT_MIN_SILENCE_SECONDS)
+
+        # 验证输入
+        if not video_file:
+            yield self.create_text_message("No video file provided")
+            yield self.create_json_message({
+                "status": "error",
+                "message": "No video file provided"
+            })
+            return
+
+        # 验证输出格式
+        if audio_format not in AUDIO_FORMATS:
+            yield self.create_text_message(f"Unsupported output format: {audio_format}. Supported formats are: {', '.join(AUDIO_FORMATS)}")
+            yield self.create_json_message({
+                "status": "error",
+                "message": f"Unsupported output format: {audio_format}. Supported formats are: {', '.join(AUDIO_FORMATS)}"
+            })
+            return
+
+        # 验证采样率和声道数
+        try:
+            sample_rate = int(sample_rate) if sample_rate not in (None, '') else DEFAULT_SAMPLE_RATE
+            channels = int(channels) if channels not in (None, '') else DEFAULT_CHANNELS
+            if not MIN_SAMPLE_RATE <= sample_rate <= MAX_SAMPLE_RATE or channels not in (1, 2):
+                raise ValueError
+        except (ValueError, TypeError):
+            error_msg = f"Invalid sample_rate or channels parameter. Sample rate must be {MIN_SAMPLE_RATE}-{MAX_SAMPLE_RATE} and channels 1 or 2"
+            yield self.create_text_message(error_msg)
+            yield self.create_json_message({
+                "status": "error",
+                "message": error_msg
+            })
+            return
+
+        # 验证静音检测参数
+        try:
+            silence_threshold = float(silence_threshold) if silence_threshold not in (None, '') else DEFAULT_SILENCE_THRESHOLD_DB
+            min_silence_duration = float(min_silence_duration) if min_silence_duration not in (None, '') else DEFAULT_MIN_SILENCE_SECONDS
+            if silence_threshold > 0 or min_silence_duration < 0:
+                raise ValueError
+        except (ValueError, TypeError):
+            error_msg = "Invalid silence parameters. silence_threshold must be a dBFS value <= 0 and min_silence_duration non-negative"
+            yield self.create_text_message(error_msg)
+            yield self.create_json_message({
+                "status": "error",
+                "message": error_msg
+            })
+            return
+
+        # 在解码之前确认已安装的 ffmpeg 支持所需的编码器
+        try:
+            check_support(encoders=required_encoders(audio_format))
+        except CapabilityError as capability_error:
+            yield self.create_text_message(str(capability_error))
+            yield self.create_json_message({
+                "status": "error",
+                "message": str(capability_error)
+            })
+            return
+
+        # 记录各阶段耗时，结果放在 JSON 的 timings 中
+        if timer is None:
+            timer = StageTimer()
+
+        try:
+            # 获取原始文件名（不带扩展名）
+            orig_filename = os.path.splitext(video_file.filename)[0]
+
+            # 批量调用时内容哈希已由 invoke_batch 计算
+            if video_hash is None:
+                with timer.stage("hash"):
+                    video_hash = content_hash(video_file.blob)
+            # 本次调用内所有 ffmpeg/ffprobe 进程共享的时间预算，批量调用时与其他文件共享同一预算
+            deadline = parent_deadline.child(timer) if parent_deadline is not None else Deadline(timer=timer)
+            # 音频按顺序解码一遍，不需要定位，可流式读取的容器直接通过管道传入
+            video_input = None
+
+            try:
+                # 先获取音频流信息：缓存、容器头部，最后回退到 ffprobe
+                video_metadata = get_cached_probe(video_hash)
+                if video_metadata is None:
+                    with timer.stage("header_probe"):
+                        video_metadata = probe_video_header(video_file.blob, video_hash)
+                if video_metadata is None:
+                    video_input = open_video_input(video_file, needs_seek=False, timer=timer)
+                    try:
+                        video_metadata = probe_video(video_input, video_hash, deadline)
+                    except ProbeError as probe_error:
+                        error_msg = f"Error analyzing video file: {str(probe_error)}"
+                        yield self.create_text_message(error_msg)
+                        yield self.create_json_message({
+                            "status": "error",
+                            "message": error_msg
+                        })
+                        return
+
+                audio_stream = next((stream for stream in video_metadata.get("streams", []) if stream.get("codec_type") == "audio"), None)
+                if audio_stream is None:
+                    error_msg = f"No audio streams found in {video_file.filename}"
+                    yield self.create_text_message(error_msg)
+                    yield self.create_json_message({
+                        "status": "error",
+                        "message": error_msg
+                    })
+                    return
+
+                # 按时长估计返回的音频大小，超出上限或插件内存时在启动 ffmpeg 之前拒绝
+                duration = get_duration(video_metadata)
+                audio_bytes = estimate_audio_bytes(audio_format, duration, sample_rate, channels)
+                if audio_bytes > AUDIO_MAX_BYTES:
+                    error_msg = f"Estimated audio size {audio_bytes / (1024 * 1024):.1f} MB exceeds the limit of {AUDIO_MAX_BYTES / (1024 * 1024):.1f} MB; use opus, a lower sample rate or output_format none"
+                    yield self.create_text_message(error_msg)
+                    yield self.create_json_message({
+                        "status": "error",
+                        "message": error_msg
+                    })
+                    return
+
+                try:
+                    memory_plan = plan_output_memory(
+                        len(video_file.blob),
+                        video_input.memory_bytes if video_input is not None else estimate_input_memory(len(video_file.blob)),
+                        estimate_decoder_memory(0, 0),
+                        audio_bytes,
+                        audio_bytes if uses_memfd_output(audio_bytes) else 0
+                    )
+                except MemoryBudgetError as memory_error:
+                    error_msg = str(memory_error)
+                    yield self.create_text_message(error_msg)
+                    yield self.create_json_message({
+                        "status": "error",
+                        "message": error_msg
+                    })
+                    return
+
+                yield self.create_text_message(f"Extracting and analyzing audio from video...")
+
+                if video_input is None:
+                    video_input = open_video_input(video_file, needs_seek=False, timer=timer)
+
+                # 解码一次：PCM 边读取边分析，同时写出可选的音频文件
+                detector = SilenceDetector(sample_rate, silence_threshold, min_silence_duration)
+                try:
+                    audio_data = extract_audio(video_input, detector, audio_format, channels, audio_bytes, deadline)
+                except AudioExtractionError as extraction_error:
+                    error_msg = f"Failed to extract audio: {str(extraction_error)}"
+                    yield self.create_text_message(error_msg)
+                    yield self.create_json_message({
+                        "status": "error",
+                        "message": error_msg
+                    })
+                    return
+
+                output_filename = None
+                if audio_data is not None:
+                    output_filename = f"{orig_filename}_audio.{get_audio_extension(audio_format)}"
+                    with timer.stage("message_yield"):
+                        yield self.create_blob_message(
+                            audio_data,
+                            meta={
+                                "filename": output_filename,
+                                "mime_type": get_audio_mime_type(audio_format),
+                            }
+                        )
+
+                silences = detector.silence_segments()
+                sound_segments = detector.sound_segments()
+                yield self.create_json_message({
+                    "status": "success",
+                    "message": f"Successfully analyzed audio from video",
+                    "original_filename": video_file.filename,
+                    "audio_filename": output_filename,
+                    "audio_stream": {
+                        "index": audio_stream.get("index"),
+                        "codec_name": audio_stream.get("codec_name"),
+                        "sample_rate": audio_stream.get("sample_rate"),
+                        "channels": audio_stream.get("channels"),
+                    },
+                    "output": {
+                        "format": audio_format,
+                        "sample_rate": get_output_sample_rate(audio_format, sample_rate),
+                        "channels": channels,
+                        "size": len(audio_data) if audio_data is not None else 0,
+                    },
+                    "analysis": detector.stats(),
+                    "silences": silences,
+                    # 静音之间的有声区间，可直接作为语音识别的切分点
+                    "segments": sound_segments,
+                    "memory": memory_plan.to_dict(),
+                    "scheduler": get_scheduler().to_dict(),
+                    "timings": timer.to_dict()
+                })
+
+                yield self.create_text_message(f"Successfully analyzed {detector.duration:.2f}s of audio from {video_file.filename}: {len(sound_segments)} segments, {len(silences)} silences.")
+
+            finally:
+                # 结束仍在运行的子进程（包括生成器被提前关闭的情况）并释放视频输入
+                deadline.cancel()
+                if video_input is not None:
+                    video_input.close()
+
+        except ProcessTimeoutError as timeout_error:
+            error_msg = f"Audio processing timed out: {str(timeout_error)}"
+            yield self.create_text_message(error_msg)
+            yield self.create_json_message({
+                "status": "error",
+                "message": error_msg,
+                "timeout": timeout_error.to_dict(),
+                "scheduler": get_scheduler().to_dict(),
+                "timings": timer.to_dict()
+            })
+        except Exception as e:
+            error_msg = f"Error processing video file: {str(e)}"
+            yield self.create_text_message(error_msg)
+            yield self.create_json_message({
+                "status": "error",
+                "message": error_msg
+            })
+        finally:
+            record_metrics("get_video_audio", timer)
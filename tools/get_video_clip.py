@@ -0,0 +1,308 @@
+from dify_plugin import Tool
+from dify_plugin.entities.tool import ToolInvokeMessage
+from collections.abc import Generator
+from typing import Any
+import os
+
+from utils.cache import content_hash
+from utils.probe_cache import get_cached_probe, probe_video, probe_video_header, get_duration, ProbeError
+from utils.keyframe_index import get_cached_keyframe_index
+from utils.capabilities import check_support, CapabilityError
+from utils.video_input import open_video_input, estimate_input_memory, uses_memfd_output
+from utils.resources import plan_output_memory, estimate_decoder_memory, MemoryBudgetError
+from utils.process import Deadline, ProcessTimeoutError
+from utils.scheduler import get_scheduler
+from utils.timing import StageTimer, record_metrics
+from utils.batch import get_batch_files, invoke_batch
+from utils.single_flight import coalesce_invocation
+from utils.frame_extractor import get_video_stream
+from utils.clip_extractor import (
+    extract_clip, find_keyframe_before, resolve_clip_format, get_clip_mime_type, select_video_encoder, required_encoders,
+    estimate_clip_bytes, ClipExtractionError,
+    CLIP_MODES, CLIP_MODE_COPY, DEFAULT_CLIP_MODE, CLIP_FORMATS, CLIP_FORMAT_AUTO, CLIP_MAX_BYTES
+)
+
+class GetVideoClip(Tool):
+    def _invoke(self, tool_parameters: dict[str, Any]) -> Generator[ToolInvokeMessage, None, None]:
+        # 提供 videos 时批量处理，每个文件按单文件的流程处理
+        batch_files = get_batch_files(tool_parameters)
+        if batch_files is not None:
+            # 复制时 ffmpeg 只需要解复用缓冲区，重新编码时按解码和编码各一份估计；返回的片段最多 CLIP_MAX_BYTES
+            if (tool_parameters.get('mode') or DEFAULT_CLIP_MODE) == CLIP_MODE_COPY:
+                process_memory = estimate_decoder_memory(0, 0)
+            else:
+                process_memory = estimate_decoder_memory(1920, 1080) * 2
+            yield from invoke_batch(
+                self,
+                batch_files,
+                lambda video_file, deadline, video_hash: self._invoke_coalesced({**tool_parameters, 'video': video_file}, deadline, video_hash),
+                file_memory=process_memory + CLIP_MAX_BYTES
+            )
+            return
+        yield from self._invoke_coalesced(tool_parameters)
+
+    def _invoke_coalesced(self, tool_parameters: dict[str, Any], parent_deadline: Deadline | None = None, video_hash: str | None = None) -> Generator[ToolInvokeMessage, None, None]:
+        # 内容和参数都相同的并发调用只处理一次，其余调用等待并复用同一结果
+        yield from coalesce_invocation(
+            self,
+            "get_video_clip",
+            tool_parameters,
+            video_hash,
+            parent_deadline,
+            lambda video_hash, timer, deadline: self._invoke_video(tool_parameters, deadline, video_hash, timer)
+        )
+
+    def _invoke_video(self, tool_parameters: dict[str, Any], parent_deadline: Deadline | None = None, video_hash: str | None = None, timer: StageTimer | None = None) -> Generator[ToolInvokeMessage, None, None]:
+        video_file = tool_parameters.get('video')
+        start_time = tool_parameters.get('start', 0)
+        end_time = tool_parameters.get('end')
+        clip_mode = tool_parameters.get('mode') or DEFAULT_CLIP_MODE
+        clip_format = tool_parameters.get('output_format') or CLIP_FORMAT_AUTO
+
+        # 验证输入
+        if not video_file:
+            yield self.create_text_message("No video file provided")
+            yield self.create_json_message({
+                "status": "error",
+                "message": "No video file provided"
+            })
+            return
+
+        # 验证剪辑模式和输出格式
+        if clip_mode not in CLIP_MODES:
+            yield self.create_text_message(f"Unsupported clip mode: {clip_mode}. Supported modes are: {', '.join(CLIP_MODES)}")
+            yield self.create_json_message({
+                "status": "error",
+                "message": f"Unsupported clip mode: {clip_mode}. Supported modes are: {', '.join(CLIP_MODES)}"
+            })
+            return
+
+        if clip_format not in CLIP_FORMATS:
+            yield self.create_text_message(f"Unsupported output format: {clip_format}. Supported formats are: {', '.join(CLIP_FORMATS)}")
+            yield self.create_json_message({
+                "status": "error",
+                "message": f"Unsupported output format: {clip_format}. Supported formats are: {', '.join(CLIP_FORMATS)}"
+            })
+            return
+
+        # 验证起止时间
+        try:
+            start_time = float(start_time) if start_time not in (None, '') else 0.0
+            end_time = float(end_time) if end_time not in (None, '') else None
+        except (ValueError, TypeError):
+            yield self.create_text_message("Invalid start or end parameter. Must be a number")
+            yield self.create_json_message({
+                "status": "error",
+                "message": "Invalid start or end parameter. Must be a number"
+            })
+            return
+
+        if start_time < 0 or (end_time is not None and end_time <= start_time):
+            yield self.create_text_message("Start must be non-negative and end must be greater than start")
+            yield self.create_json_message({
+                "status": "error",
+                "message": "Start must be non-negative and end must be greater than start"
+            })
+            return
+
+        # 重新编码时在启动 ffmpeg 之前确认编码器可用
+        try:
+            check_support(encoders=required_encoders(clip_mode))
+            if clip_mode != CLIP_MODE_COPY:
+                select_video_encoder()
+        except CapabilityError as capability_error:
+            yield self.create_text_message(str(capability_error))
+            yield self.create_json_message({
+                "status": "error",
+                "message": str(capability_error)
+            })
+            return
+
+        # 记录各阶段耗时，结果放在 JSON 的 timings 中
+        if timer is None:
+            timer = StageTimer()
+
+        try:
+            # 获取原始文件名（不带扩展名）
+            orig_filename = os.path.splitext(video_file.filename)[0]
+
+            # 批量调用时内容哈希已由 invoke_batch 计算
+            if video_hash is None:
+                with timer.stage("hash"):
+                    video_hash = content_hash(video_file.blob)
+            # 本次调用内所有 ffmpeg/ffprobe 进程共享的时间预算，批量调用时与其他文件共享同一预算
+            deadline = parent_deadline.child(timer) if parent_deadline is not None else Deadline(timer=timer)
+            # 起点不为 0 时在输入端定位，需要可随机访问的输入
+            needs_seek = start_time > 0
+            video_input = None
+
+            try:
+                # 先获取视频时长：缓存、容器头部，最后回退到 ffprobe
+                video_metadata = get_cached_probe(video_hash)
+                if video_metadata is None:
+                    with timer.stage("header_probe"):
+                        video_metadata = probe_video_header(video_file.blob, video_hash)
+                if video_metadata is None:
+                    video_input = open_video_input(video_file, needs_seek, timer)
+                    try:
+                        video_metadata = probe_video(video_input, video_hash, deadline)
+                    except ProbeError as probe_error:
+                        error_msg = f"Failed to get video duration: {str(probe_error)}"
+                        yield self.create_text_message(error_msg)
+                        yield self.create_json_message({
+                            "status": "error",
+                            "message": error_msg
+                        })
+                        return
+                duration = get_duration(video_metadata)
+
+                if duration <= 0:
+                    error_msg = "Invalid video duration"
+                    yield self.create_text_message(error_msg)
+                    yield self.create_json_message({
+                        "status": "error",
+                        "message": error_msg
+                    })
+                    return
+
+                if start_time >= duration:
+                    error_msg = f"Start {start_time:.2f}s is beyond the video duration of {duration:.2f}s"
+                    yield self.create_text_message(error_msg)
+                    yield self.create_json_message({
+                        "status": "error",
+                        "message": error_msg
+                    })
+                    return
+
+                # 未指定或超出时长时剪到结尾
+                clip_end = min(end_time, duration) if end_time is not None else duration
+
+                # copy 模式只能从关键帧开始，把起点对齐到不晚于 start 的关键帧：
+                # 优先使用缓存的关键帧索引（get_video_info 的 detail=keyframes），否则用 ffprobe 只读取一个包
+                clip_start = start_time
+                keyframe_aligned = False
+                if clip_mode == CLIP_MODE_COPY and start_time > 0:
+                    keyframe_time = None
+                    keyframe_index = get_cached_keyframe_index(video_hash)
+                    if keyframe_index is not None:
+                        keyframe_time = keyframe_index.keyframe_before(start_time)
+                    else:
+                        if video_input is None:
+                            video_input = open_video_input(video_file, needs_seek, timer)
+                        keyframe_time = find_keyframe_before(video_input, start_time, deadline)
+                    if keyframe_time is not None:
+                        clip_start = keyframe_time
+                        keyframe_aligned = True
+                elif clip_mode == CLIP_MODE_COPY:
+                    keyframe_aligned = True
+
+                clip_format = resolve_clip_format(clip_format, video_metadata)
+                output_filename = f"{orig_filename}_clip.{clip_format}"
+
+                # 按平均码率估计片段大小，超出上限或插件内存时在启动 ffmpeg 之前拒绝
+                clip_bytes = estimate_clip_bytes(len(video_file.blob), duration, clip_end - clip_start)
+                if clip_bytes > CLIP_MAX_BYTES:
+                    error_msg = f"Estimated clip size {clip_bytes / (1024 * 1024):.1f} MB exceeds the limit of {CLIP_MAX_BYTES / (1024 * 1024):.1f} MB; choose a shorter range"
+                    yield self.create_text_message(error_msg)
+                    yield self.create_json_message({
+                        "status": "error",
+                        "message": error_msg
+                    })
+                    return
+
+                video_stream = get_video_stream(video_metadata) or {}
+                try:
+                    # 复制时 ffmpeg 只需要解复用缓冲区，重新编码时按解码和编码各一份估计
+                    if clip_mode == CLIP_MODE_COPY:
+                        process_memory = estimate_decoder_memory(0, 0)
+                    else:
+                        process_memory = estimate_decoder_memory(video_stream.get("width") or 0, video_stream.get("height") or 0) * 2
+                    memory_plan = plan_output_memory(
+                        len(video_file.blob),
+                        video_input.memory_bytes if video_input is not None else estimate_input_memory(len(video_file.blob)),
+                        process_memory,
+                        clip_bytes,
+                        clip_bytes if uses_memfd_output(clip_bytes) else 0
+                    )
+                except MemoryBudgetError as memory_error:
+                    error_msg = str(memory_error)
+                    yield self.create_text_message(error_msg)
+                    yield self.create_json_message({
+                        "status": "error",
+                        "message": error_msg
+                    })
+                    return
+
+                yield self.create_text_message(f"Extracting clip {clip_start:.2f}s-{clip_end:.2f}s from video ({clip_mode})...")
+
+                if video_input is None:
+                    video_input = open_video_input(video_file, needs_seek, timer)
+
+                try:
+                    clip_data = extract_clip(video_input, clip_start, clip_end - clip_start, clip_mode, clip_format, clip_bytes, deadline)
+                except ClipExtractionError as extraction_error:
+                    error_msg = f"Failed to extract video clip: {str(extraction_error)}"
+                    yield self.create_text_message(error_msg)
+                    yield self.create_json_message({
+                        "status": "error",
+                        "message": error_msg
+                    })
+                    return
+
+                # 创建结果消息
+                with timer.stage("message_yield"):
+                    yield self.create_blob_message(
+                        clip_data,
+                        meta={
+                            "filename": output_filename,
+                            "mime_type": get_clip_mime_type(clip_format),
+                        }
+                    )
+
+                yield self.create_json_message({
+                    "status": "success",
+                    "message": f"Successfully extracted clip from video",
+                    "original_filename": video_file.filename,
+                    "clip_filename": output_filename,
+                    "mode": clip_mode,
+                    "output_format": clip_format,
+                    "requested_start": start_time,
+                    "requested_end": end_time,
+                    # copy 模式下实际起点为对齐后的关键帧
+                    "start": clip_start,
+                    "end": clip_end,
+                    "duration": clip_end - clip_start,
+                    "keyframe_aligned": keyframe_aligned,
+                    "clip_size": len(clip_data),
+                    "memory": memory_plan.to_dict(),
+                    "scheduler": get_scheduler().to_dict(),
+                    "timings": timer.to_dict()
+                })
+
+                yield self.create_text_message(f"Successfully extracted clip {clip_start:.2f}s-{clip_end:.2f}s from {video_file.filename}.")
+
+            finally:
+                # 结束仍在运行的子进程（包括生成器被提前关闭的情况）并释放视频输入
+                deadline.cancel()
+                if video_input is not None:
+                    video_input.close()
+
+        except ProcessTimeoutError as timeout_error:
+            error_msg = f"Video processing timed out: {str(timeout_error)}"
+            yield self.create_text_message(error_msg)
+            yield self.create_json_message({
+                "status": "error",
+                "message": error_msg,
+                "timeout": timeout_error.to_dict(),
+                "scheduler": get_scheduler().to_dict(),
+                "timings": timer.to_dict()
+            })
+        except Exception as e:
+            error_msg = f"Error processing video file: {str(e)}"
+            yield self.create_text_message(error_msg)
+            yield self.create_json_message({
+                "status": "error",
+                "message": error_msg
+            })
+        finally:
+            record_metrics("get_video_clip", timer)
@@ -2,17 +2,54 @@ from dify_plugin import Tool
 from dify_plugin.entities.tool import ToolInvokeMessage
 from collections.abc import Generator
 from typing import Any
-import tempfile
-import subprocess
-import json
 import os
 import time
 
+from utils.cache import content_hash
+from utils.probe_cache import get_cached_probe, probe_video, get_duration, ProbeError
+from utils.frame_cache import FrameCacheStats, frame_cache_key, keyframe_cache_time
+from utils.keyframe_index import get_cached_keyframe_index
+from utils.image_encoding import parse_encode_params, fit_byte_budget, get_encoder, get_mime_type, get_extension, build_scale_filter
+from utils.capabilities import check_support, CapabilityError
+from utils.video_input import open_video_input, estimate_input_memory
+from utils.resources import plan_memory, estimate_decoder_memory, MemoryBudgetError
+from utils.process import Deadline, ProcessTimeoutError
+from utils.scheduler import get_scheduler
+from utils.timing import StageTimer, record_metrics
+from utils.batch import get_batch_files, invoke_batch
+from utils.single_flight import coalesce_invocation
+from utils.frame_extractor import extract_single_frame, get_video_stream, FrameExtractionError, SEEK_MODES, DEFAULT_SEEK_MODE, SEEK_MODE_FAST, SEEK_MODE_LEGACY
+
 class GetVideoFrame(Tool):
     def _invoke(self, tool_parameters: dict[str, Any]) -> Generator[ToolInvokeMessage, None, None]:
+        # 提供 videos 时批量处理，每个文件按单文件的流程处理
+        batch_files = get_batch_files(tool_parameters)
+        if batch_files is not None:
+            yield from invoke_batch(
+                self,
+                batch_files,
+                lambda video_file, deadline, video_hash: self._invoke_coalesced({**tool_parameters, 'video': video_file}, deadline, video_hash),
+                file_memory=estimate_decoder_memory(1920, 1080)
+            )
+            return
+        yield from self._invoke_coalesced(tool_parameters)
+
+    def _invoke_coalesced(self, tool_parameters: dict[str, Any], parent_deadline: Deadline | None = None, video_hash: str | None = None) -> Generator[ToolInvokeMessage, None, None]:
+        # 内容和参数都相同的并发调用只处理一次，其余调用等待并复用同一结果
+        yield from coalesce_invocation(
+            self,
+            "get_video_frame",
+            tool_parameters,
+            video_hash,
+            parent_deadline,
+            lambda video_hash, timer, deadline: self._invoke_video(tool_parameters, deadline, video_hash, timer)
+        )
+
+    def _invoke_video(self, tool_parameters: dict[str, Any], parent_deadline: Deadline | None = None, video_hash: str | None = None, timer: StageTimer | None = None) -> Generator[ToolInvokeMessage, None, None]:
         video_file = tool_parameters.get('video')
         frame_type = tool_parameters.get('type', 'start')
         time_seconds = tool_parameters.get('time', 1)
+        seek_mode = tool_parameters.get('seek_mode') or DEFAULT_SEEK_MODE
         
         # 验证输入
         if not video_file:
@@ -41,6 +78,40 @@ class GetVideoFrame(Tool):
             })
             return
         
+        # 验证定位策略
+        if seek_mode not in SEEK_MODES:
+            yield self.create_text_message(f"Unsupported seek mode: {seek_mode}. Supported modes are: {', '.join(SEEK_MODES)}")
+            yield self.create_json_message({
+                "status": "error",
+                "message": f"Unsupported seek mode: {seek_mode}. Supported modes are: {', '.join(SEEK_MODES)}"
+            })
+            return
+        
+        # 验证输出格式、质量和尺寸参数
+        try:
+            encode_params, max_bytes = parse_encode_params(tool_parameters)
+        except ValueError as parameter_error:
+            yield self.create_text_message(str(parameter_error))
+            yield self.create_json_message({
+                "status": "error",
+                "message": str(parameter_error)
+            })
+            return
+        
+        # 在解码之前确认已安装的 ffmpeg 支持所需的滤镜和编码器，避免运行到一半才失败
+        try:
+            check_support(
+                filters=(['showinfo'] if seek_mode == SEEK_MODE_FAST else []) + (['scale'] if build_scale_filter(encode_params) else []),
+                encoders=[get_encoder(encode_params)]
+            )
+        except CapabilityError as capability_error:
+            yield self.create_text_message(str(capability_error))
+            yield self.create_json_message({
+                "status": "error",
+                "message": str(capability_error)
+            })
+            return
+        
         # 验证时间参数
         if frame_type == 'time':
             try:
@@ -60,139 +131,174 @@ class GetVideoFrame(Tool):
                 })
                 return
         
+        # 记录各阶段耗时，结果放在 JSON 的 timings 中
+        if timer is None:
+            timer = StageTimer()
+        
         try:
-            # 设置临时文件
-            input_file_extension = video_file.extension if video_file.extension else '.mp4'
-            
             # 获取原始文件名（不带扩展名）
             orig_filename = os.path.splitext(video_file.filename)[0]
-            output_filename = f"{orig_filename}_frame.jpg"
+            output_filename = f"{orig_filename}_frame.{get_extension(encode_params)}"
             
-            with tempfile.NamedTemporaryFile(delete=False, suffix=input_file_extension) as in_temp_file:
-                in_temp_file.write(video_file.blob)
-                in_temp_path = in_temp_file.name
-                
-            out_temp_path = os.path.join(tempfile.gettempdir(), output_filename)
+            # 批量调用时内容哈希已由 invoke_batch 计算
+            if video_hash is None:
+                with timer.stage("hash"):
+                    video_hash = content_hash(video_file.blob)
+            frame_cache = FrameCacheStats()
+            # 本次调用内所有 ffmpeg/ffprobe 进程共享的时间预算，批量调用时与其他文件共享同一预算
+            deadline = parent_deadline.child(timer) if parent_deadline is not None else Deadline(timer=timer)
+            # 视频输入按需创建，缓存全部命中时无需传给 ffmpeg
+            video_input = None
+            # 非 legacy 模式会在输入端定位，需要可随机访问的输入
+            needs_seek = seek_mode != SEEK_MODE_LEGACY and frame_type != 'start'
             
             try:
                 # 根据类型确定提取时间点
                 if frame_type == 'start':
                     seek_time = 0
                 elif frame_type == 'end':
-                    # 先获取视频时长
-                    duration_command = [
-                        'ffprobe', 
-                        '-v', 'quiet',
-                        '-print_format', 'json',
-                        '-show_format',
-                        in_temp_path
-                    ]
-                    duration_result = subprocess.run(duration_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-                    
-                    if duration_result.returncode != 0:
-                        error_msg = f"Failed to get video duration: {duration_result.stderr}"
-                        yield self.create_text_message(error_msg)
-                        yield self.create_json_message({
-                            "status": "error",
-                            "message": error_msg
-                        })
-                        return
-                    
-                    # 验证 ffprobe 输出是否为有效 JSON
-                    if not duration_result.stdout.strip():
-                        error_msg = "ffprobe returned empty output when getting duration"
-                        yield self.create_text_message(error_msg)
-                        yield self.create_json_message({
-                            "status": "error",
-                            "message": error_msg
-                        })
-                        return
-                    
-                    try:
-                        duration_info = json.loads(duration_result.stdout)
-                    except json.JSONDecodeError as json_error:
-                        error_msg = f"Failed to parse duration info as JSON: {str(json_error)}. Output: {duration_result.stdout[:200]}..."
-                        yield self.create_text_message(error_msg)
-                        yield self.create_json_message({
-                            "status": "error",
-                            "message": error_msg
-                        })
-                        return
-                    duration = float(duration_info.get("format", {}).get("duration", 0))
+                    # 先获取视频时长（与其他工具共享 ffprobe 缓存）
+                    video_metadata = get_cached_probe(video_hash)
+                    if video_metadata is None:
+                        video_input = open_video_input(video_file, needs_seek, timer)
+                        try:
+                            video_metadata = probe_video(video_input, video_hash, deadline)
+                        except ProbeError as probe_error:
+                            error_msg = f"Failed to get video duration: {str(probe_error)}"
+                            yield self.create_text_message(error_msg)
+                            yield self.create_json_message({
+                                "status": "error",
+                                "message": error_msg
+                            })
+                            return
+                    duration = get_duration(video_metadata)
                     seek_time = max(0, duration - 1)  # 结束前1秒
                 elif frame_type == 'time':
                     seek_time = float(time_seconds)
                 
-                # 执行帧提取
-                yield self.create_text_message(f"Extracting frame from video...")
-                
-                # 使用ffmpeg提取帧
-                command = [
-                    'ffmpeg',
-                    '-i', in_temp_path,
-                    '-ss', str(seek_time),
-                    '-vframes', '1',
-                    '-q:v', '2',  # 高质量
-                    '-y',  # 覆盖输出文件
-                    out_temp_path
-                ]
-                
-                result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-                
-                if result.returncode != 0:
-                    error_msg = f"Failed to extract video frame: {result.stderr}"
+                # 估计内存峰值，超出插件内存上限时降低分辨率，仍然超出时在启动 ffmpeg 之前拒绝
+                video_stream = get_video_stream(get_cached_probe(video_hash) or {}) or {}
+                try:
+                    memory_plan = plan_memory(
+                        len(video_file.blob),
+                        video_input.memory_bytes if video_input is not None else estimate_input_memory(len(video_file.blob)),
+                        video_stream.get("width") or 0,
+                        video_stream.get("height") or 0,
+                        1,
+                        1,
+                        encode_params,
+                        hold_all_frames=False
+                    )
+                except MemoryBudgetError as memory_error:
+                    error_msg = str(memory_error)
                     yield self.create_text_message(error_msg)
                     yield self.create_json_message({
                         "status": "error",
                         "message": error_msg
                     })
                     return
+                encode_params = memory_plan.encode_params
+                
+                # fast 模式的缓存条目按实际定位到的关键帧保存，落在同一个 GOP 内的时间点共用一个缓存条目。
+                # 只有已有关键帧索引（get_video_info 的 detail=keyframes）时才能在解码之前知道定位到哪个关键帧并查找缓存
+                keyframe_time = None
+                keyframe_index = None
+                cache_key = None
+                if seek_mode == SEEK_MODE_FAST:
+                    keyframe_index = get_cached_keyframe_index(video_hash)
+                    if keyframe_index is not None:
+                        keyframe_time = keyframe_index.keyframe_before(seek_time)
+                    if keyframe_time is not None:
+                        cache_key = frame_cache_key(video_hash, keyframe_time, seek_mode, {**encode_params, "max_bytes": max_bytes})
+                else:
+                    cache_key = frame_cache_key(video_hash, seek_time, seek_mode, {**encode_params, "max_bytes": max_bytes})
+                
+                # 先查找已编码帧缓存
+                frame_data = frame_cache.get(cache_key) if cache_key is not None else None
                 
-                # 读取提取的帧文件
-                if os.path.exists(out_temp_path):
-                    with open(out_temp_path, 'rb') as out_file:
-                        frame_data = out_file.read()
+                if frame_data is None:
+                    # 执行帧提取
+                    yield self.create_text_message(f"Extracting frame from video...")
                     
-                    # 创建结果消息
+                    if video_input is None:
+                        video_input = open_video_input(video_file, needs_seek, timer)
+                    
+                    # 使用ffmpeg提取帧，直接从 stdout 读取 JPEG 数据
+                    try:
+                        selected_time, frame_data = extract_single_frame(video_input, seek_time, seek_mode, encode_params, deadline)
+                    except FrameExtractionError as extraction_error:
+                        error_msg = f"Failed to extract video frame: {str(extraction_error)}"
+                        yield self.create_text_message(error_msg)
+                        yield self.create_json_message({
+                            "status": "error",
+                            "message": error_msg
+                        })
+                        return
+                    
+                    # 超出字节预算时降低质量或分辨率重新编码
+                    frame_data, _ = fit_byte_budget(frame_data, encode_params, max_bytes, deadline)
+                    if selected_time is not None:
+                        # 按实际定位到的关键帧保存，与抽取多帧时保存的条目一致
+                        keyframe_time = keyframe_cache_time(selected_time, keyframe_index)
+                        cache_key = frame_cache_key(video_hash, keyframe_time, seek_mode, {**encode_params, "max_bytes": max_bytes})
+                    if cache_key is not None:
+                        frame_cache.put(cache_key, frame_data)
+                
+                # 创建结果消息
+                with timer.stage("message_yield"):
                     yield self.create_blob_message(
                         frame_data,
                         meta={
                             "filename": output_filename,
-                            "mime_type": "image/jpeg",
+                            "mime_type": get_mime_type(encode_params),
                         }
                     )
-                    
-                    yield self.create_json_message({
-                        "status": "success",
-                        "message": f"Successfully extracted frame from video",
-                        "original_filename": video_file.filename,
-                        "frame_filename": output_filename,
-                        "frame_type": frame_type,
-                        "seek_time": seek_time,
-                        "frame_size": len(frame_data)
-                    })
-                    
-                    yield self.create_text_message(f"Successfully extracted frame from {video_file.filename} at {seek_time:.2f}s.")
-                    
-                else:
-                    error_msg = "Extracted frame file does not exist"
-                    yield self.create_text_message(error_msg)
-                    yield self.create_json_message({
-                        "status": "error",
-                        "message": error_msg
-                    })
+                
+                yield self.create_json_message({
+                    "status": "success",
+                    "message": f"Successfully extracted frame from video",
+                    "original_filename": video_file.filename,
+                    "frame_filename": output_filename,
+                    "frame_type": frame_type,
+                    "seek_time": seek_time,
+                    "seek_mode": seek_mode,
+                    "keyframe_time": keyframe_time,
+                    "frame_size": len(frame_data),
+                    "output": {
+                        **encode_params,
+                        "max_bytes": max_bytes,
+                        "within_budget": not max_bytes or len(frame_data) <= max_bytes
+                    },
+                    "frame_cache": frame_cache.to_dict(),
+                    "memory": memory_plan.to_dict(),
+                    "scheduler": get_scheduler().to_dict(),
+                    "timings": timer.to_dict()
+                })
+                
+                yield self.create_text_message(f"Successfully extracted frame from {video_file.filename} at {seek_time:.2f}s.")
                 
             finally:
-                # 清理临时文件
-                if os.path.exists(in_temp_path):
-                    os.unlink(in_temp_path)
-                if os.path.exists(out_temp_path):
-                    os.unlink(out_temp_path)
+                # 结束仍在运行的子进程（包括生成器被提前关闭的情况）并释放视频输入
+                deadline.cancel()
+                if video_input is not None:
+                    video_input.close()
                     
+        except ProcessTimeoutError as timeout_error:
+            error_msg = f"Video processing timed out: {str(timeout_error)}"
+            yield self.create_text_message(error_msg)
+            yield self.create_json_message({
+                "status": "error",
+                "message": error_msg,
+                "timeout": timeout_error.to_dict(),
+                "scheduler": get_scheduler().to_dict(),
+                "timings": timer.to_dict()
+            })
         except Exception as e:
             error_msg = f"Error processing video file: {str(e)}"
             yield self.create_text_message(error_msg)
             yield self.create_json_message({
                 "status": "error",
                 "message": error_msg
-            })
\ No newline at end of file
+            })
+        finally:
+            record_metrics("get_video_frame", timer)
\ No newline at end of file
@@ -2,17 +2,185 @@ from dify_plugin import Tool
 from dify_plugin.entities.tool import ToolInvokeMessage
 from collections.abc import Generator
 from typing import Any
-import tempfile
-import subprocess
-import json
 import os
 import time
 
+from utils.cache import content_hash
+from utils.probe_cache import get_cached_probe, probe_video, get_duration, ProbeError
+from utils.frame_cache import FrameCacheStats, frame_cache_key, keyframe_cache_time
+from utils.keyframe_index import get_cached_keyframe_index
+from utils.image_encoding import parse_encode_params, fit_byte_budget, get_encoder, get_mime_type, get_extension, get_pipe_format
+from utils.capabilities import check_support, CapabilityError
+from utils.video_input import open_video_input, estimate_input_memory
+from utils.resources import plan_memory, estimate_decoder_memory, MemoryBudgetError, FRAME_BUFFER_LIMIT_BYTES
+from utils.process import Deadline, ProcessTimeoutError
+from utils.scheduler import get_scheduler
+from utils.timing import StageTimer, record_metrics
+from utils.batch import get_batch_files, invoke_batch
+from utils.single_flight import coalesce_invocation
+from utils.frame_dedup import deduplicate_frames, FrameDedupError, HASH_METHOD
+from utils.frame_extractor import (
+    iter_frames, iter_selected_frames, extract_contact_sheets, build_interval_selection, interval_frame_limit, build_mode_selection, build_sheet_index,
+    get_video_stream, plan_worker_count, required_filters,
+    FrameExtractionError, OUTPUT_MODES, OUTPUT_MODE_FRAMES, OUTPUT_MODE_CONTACT_SHEET,
+    SEEK_MODES, DEFAULT_SEEK_MODE, SEEK_MODE_FAST, SEEK_MODE_LEGACY,
+    SELECTION_MODES, SELECTION_MODE_INTERVAL, DEFAULT_SCENE_THRESHOLD
+)
+
+# 流式产出帧时两次进度消息之间的最短间隔（秒）
+PROGRESS_INTERVAL_SECONDS = 2
+
+
+class FrameListParameters:
+    """validate_parameters() 的结果：校验并转换类型后的选帧、输出和编码参数"""
+
+    def __init__(self, gap_time: float, count: int, seek_mode: str, selection_mode: str, scene_threshold: float, max_count: int, dedup_threshold: int, output_mode: str, tile_columns: int, tile_rows: int, thumbnail_width: int, encode_params: dict, max_bytes: int | None):
+        self.gap_time = gap_time
+        self.count = count
+        self.seek_mode = seek_mode
+        self.selection_mode = selection_mode
+        self.scene_threshold = scene_threshold
+        self.max_count = max_count
+        self.dedup_threshold = dedup_threshold
+        self.output_mode = output_mode
+        self.tile_columns = tile_columns
+        self.tile_rows = tile_rows
+        self.thumbnail_width = thumbnail_width
+        self.encode_params = encode_params
+        self.max_bytes = max_bytes
+
+
+def validate_parameters(tool_parameters: dict[str, Any]) -> FrameListParameters:
+    """
+    校验选帧、输出和编码参数并转换类型，不读取视频。
+    参数无效时抛出 ValueError，已安装的 ffmpeg 缺少所需的滤镜或编码器时抛出 CapabilityError。
+    后台任务在排队之前调用，无效参数在提交时即返回错误。
+    """
+    gap_time = tool_parameters.get('gap_time', 1)
+    count = tool_parameters.get('count', 1)
+    seek_mode = tool_parameters.get('seek_mode') or DEFAULT_SEEK_MODE
+    selection_mode = tool_parameters.get('selection_mode') or SELECTION_MODE_INTERVAL
+    scene_threshold = tool_parameters.get('scene_threshold', DEFAULT_SCENE_THRESHOLD)
+    max_count = tool_parameters.get('max_count', 20)
+    dedup_threshold = tool_parameters.get('dedup_threshold', 0)
+    output_mode = tool_parameters.get('output_mode') or OUTPUT_MODE_FRAMES
+    tile_columns = tool_parameters.get('tile_columns', 4)
+    tile_rows = tool_parameters.get('tile_rows', 4)
+    thumbnail_width = tool_parameters.get('thumbnail_width', 320)
+
+    # 验证间隔时间参数
+    try:
+        gap_time = float(gap_time)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid gap time parameter. Must be a number")
+    if gap_time <= 0:
+        raise ValueError("Gap time must be positive")
+
+    # 验证数量参数
+    try:
+        count = int(count)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid count parameter. Must be an integer")
+    if count <= 0:
+        raise ValueError("Count must be positive")
+    if count > 100:  # 限制最大数量避免过多文件
+        raise ValueError("Count cannot exceed 100")
+
+    # 验证定位策略、选帧方式和输出方式
+    if seek_mode not in SEEK_MODES:
+        raise ValueError(f"Unsupported seek mode: {seek_mode}. Supported modes are: {', '.join(SEEK_MODES)}")
+    if selection_mode not in SELECTION_MODES:
+        raise ValueError(f"Unsupported selection mode: {selection_mode}. Supported modes are: {', '.join(SELECTION_MODES)}")
+    if output_mode not in OUTPUT_MODES:
+        raise ValueError(f"Unsupported output mode: {output_mode}. Supported modes are: {', '.join(OUTPUT_MODES)}")
+
+    if output_mode == OUTPUT_MODE_CONTACT_SHEET:
+        # 验证网格参数
+        try:
+            tile_columns = int(tile_columns or 4)
+            tile_rows = int(tile_rows or 4)
+            thumbnail_width = int(thumbnail_width or 320)
+        except (ValueError, TypeError):
+            raise ValueError("Invalid tile parameters. Must be integers")
+        if not (1 <= tile_columns <= 10 and 1 <= tile_rows <= 10):
+            raise ValueError("Tile columns and rows must be between 1 and 10")
+        if thumbnail_width < 16 or thumbnail_width > 1920:
+            raise ValueError("Thumbnail width must be between 16 and 1920")
+
+    # 验证输出格式、质量和尺寸参数
+    encode_params, max_bytes = parse_encode_params(tool_parameters)
+
+    # 验证去重阈值参数
+    try:
+        dedup_threshold = int(dedup_threshold or 0)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid dedup threshold parameter. Must be an integer")
+    if dedup_threshold < 0 or dedup_threshold > 64:
+        raise ValueError("Dedup threshold must be between 0 and 64")
+
+    if selection_mode != SELECTION_MODE_INTERVAL:
+        # 验证最大数量参数
+        try:
+            max_count = int(max_count if max_count is not None else 20)
+        except (ValueError, TypeError):
+            raise ValueError("Invalid max count parameter. Must be an integer")
+        if max_count <= 0 or max_count > 100:
+            raise ValueError("Max count must be between 1 and 100")
+
+        # 验证场景变化阈值
+        try:
+            scene_threshold = float(scene_threshold if scene_threshold is not None else DEFAULT_SCENE_THRESHOLD)
+        except (ValueError, TypeError):
+            raise ValueError("Invalid scene threshold parameter. Must be a number")
+        if scene_threshold <= 0 or scene_threshold > 1:
+            raise ValueError("Scene threshold must be between 0 and 1")
+
+    # 在解码之前确认已安装的 ffmpeg 支持所需的滤镜和编码器，避免运行到一半才失败
+    check_support(
+        filters=required_filters(selection_mode, output_mode, encode_params) + (['scale', 'format'] if dedup_threshold > 0 else []),
+        encoders=[get_encoder(encode_params)]
+    )
+
+    return FrameListParameters(
+        gap_time, count, seek_mode, selection_mode, scene_threshold, max_count, dedup_threshold,
+        output_mode, tile_columns, tile_rows, thumbnail_width, encode_params, max_bytes
+    )
+
+
 class GetVideoFrameList(Tool):
     def _invoke(self, tool_parameters: dict[str, Any]) -> Generator[ToolInvokeMessage, None, None]:
+        # 提供 videos 时批量处理，每个文件按单文件的流程处理
+        batch_files = get_batch_files(tool_parameters)
+        if batch_files is not None:
+            yield from invoke_batch(
+                self,
+                batch_files,
+                lambda video_file, deadline, video_hash: self._invoke_coalesced({**tool_parameters, 'video': video_file}, deadline, video_hash),
+                file_memory=estimate_decoder_memory(1920, 1080) + FRAME_BUFFER_LIMIT_BYTES
+            )
+            return
+        yield from self._invoke_coalesced(tool_parameters)
+
+    def _invoke_coalesced(self, tool_parameters: dict[str, Any], parent_deadline: Deadline | None = None, video_hash: str | None = None) -> Generator[ToolInvokeMessage, None, None]:
+        # 内容和参数都相同的并发调用只处理一次，其余调用等待并复用同一结果
+        yield from coalesce_invocation(
+            self,
+            "get_video_frame_list",
+            tool_parameters,
+            video_hash,
+            parent_deadline,
+            lambda video_hash, timer, deadline: self._invoke_video(tool_parameters, deadline, video_hash, timer)
+        )
+
+    def extract_frame_list(self, tool_parameters: dict[str, Any], deadline: Deadline) -> Generator[ToolInvokeMessage, None, None]:
+        """
+        不经过批量处理和调用合并，直接按 tool_parameters 中的单个 video 提取帧，所有进程使用调用方的时间预算。
+        供后台任务使用，参数应已通过 validate_parameters() 校验。
+        """
+        yield from self._invoke_video(tool_parameters, deadline)
+
+    def _invoke_video(self, tool_parameters: dict[str, Any], parent_deadline: Deadline | None = None, video_hash: str | None = None, timer: StageTimer | None = None) -> Generator[ToolInvokeMessage, None, None]:
         video_file = tool_parameters.get('video')
-        gap_time = tool_parameters.get('gap_time', 1)
-        count = tool_parameters.get('count', 1)
         
         # 验证输入
         if not video_file:
@@ -22,74 +190,70 @@ class GetVideoFrameList(Tool):
                 "message": "No video file provided"
             })
             return
-            
-        # 验证间隔时间参数
-        try:
-            gap_time = float(gap_time)
-            if gap_time <= 0:
-                yield self.create_text_message("Gap time must be positive")
-                yield self.create_json_message({
-                    "status": "error",
-                    "message": "Gap time must be positive"
-                })
-                return
-        except (ValueError, TypeError):
-            yield self.create_text_message("Invalid gap time parameter. Must be a number")
-            yield self.create_json_message({
-                "status": "error",
-                "message": "Invalid gap time parameter. Must be a number"
-            })
-            return
         
-        # 验证数量参数
+        # 验证选帧、输出和编码参数，确认 ffmpeg 支持所需的滤镜和编码器
         try:
-            count = int(count)
-            if count <= 0:
-                yield self.create_text_message("Count must be positive")
-                yield self.create_json_message({
-                    "status": "error",
-                    "message": "Count must be positive"
-                })
-                return
-            if count > 100:  # 限制最大数量避免过多文件
-                yield self.create_text_message("Count cannot exceed 100")
-                yield self.create_json_message({
-                    "status": "error",
-                    "message": "Count cannot exceed 100"
-                })
-                return
-        except (ValueError, TypeError):
-            yield self.create_text_message("Invalid count parameter. Must be an integer")
+            parameters = validate_parameters(tool_parameters)
+        except (ValueError, CapabilityError) as parameter_error:
+            yield self.create_text_message(str(parameter_error))
             yield self.create_json_message({
                 "status": "error",
-                "message": "Invalid count parameter. Must be an integer"
+                "message": str(parameter_error)
             })
             return
+        gap_time = parameters.gap_time
+        count = parameters.count
+        seek_mode = parameters.seek_mode
+        selection_mode = parameters.selection_mode
+        scene_threshold = parameters.scene_threshold
+        max_count = parameters.max_count
+        dedup_threshold = parameters.dedup_threshold
+        output_mode = parameters.output_mode
+        tile_columns = parameters.tile_columns
+        tile_rows = parameters.tile_rows
+        thumbnail_width = parameters.thumbnail_width
+        encode_params = parameters.encode_params
+        max_bytes = parameters.max_bytes
+        
+        # 记录各阶段耗时，结果放在 JSON 的 timings 中
+        if timer is None:
+            timer = StageTimer()
         
         try:
-            # 设置临时文件
-            input_file_extension = video_file.extension if video_file.extension else '.mp4'
-            
             # 获取原始文件名（不带扩展名）
             orig_filename = os.path.splitext(video_file.filename)[0]
             
-            with tempfile.NamedTemporaryFile(delete=False, suffix=input_file_extension) as in_temp_file:
-                in_temp_file.write(video_file.blob)
-                in_temp_path = in_temp_file.name
+            # 批量调用时内容哈希已由 invoke_batch 计算
+            if video_hash is None:
+                with timer.stage("hash"):
+                    video_hash = content_hash(video_file.blob)
+            frame_cache = FrameCacheStats()
+            # 本次调用内所有 ffmpeg/ffprobe 进程共享的时间预算，批量调用时与其他文件共享同一预算
+            deadline = parent_deadline.child(timer) if parent_deadline is not None else Deadline(timer=timer)
+            # 视频输入按需创建，缓存全部命中时无需传给 ffmpeg
+            video_input = None
+            # 非 legacy 模式会在输入端定位，需要可随机访问的输入；关键帧和场景模式只顺序读取一遍
+            needs_seek = seek_mode != SEEK_MODE_LEGACY and selection_mode == SELECTION_MODE_INTERVAL
                 
             try:
-                # 先获取视频时长
-                duration_command = [
-                    'ffprobe', 
-                    '-v', 'quiet',
-                    '-print_format', 'json',
-                    '-show_format',
-                    in_temp_path
-                ]
-                duration_result = subprocess.run(duration_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+                # 先获取视频时长（与其他工具共享 ffprobe 缓存）
+                video_metadata = get_cached_probe(video_hash)
+                if video_metadata is None:
+                    video_input = open_video_input(video_file, needs_seek, timer)
+                    try:
+                        video_metadata = probe_video(video_input, video_hash, deadline)
+                    except ProbeError as probe_error:
+                        error_msg = f"Failed to get video duration: {str(probe_error)}"
+                        yield self.create_text_message(error_msg)
+                        yield self.create_json_message({
+                            "status": "error",
+                            "message": error_msg
+                        })
+                        return
+                duration = get_duration(video_metadata)
                 
-                if duration_result.returncode != 0:
-                    error_msg = f"Failed to get video duration: {duration_result.stderr}"
+                if duration <= 0:
+                    error_msg = "Invalid video duration"
                     yield self.create_text_message(error_msg)
                     yield self.create_json_message({
                         "status": "error",
@@ -97,101 +261,289 @@ class GetVideoFrameList(Tool):
                     })
                     return
                 
-                # 验证 ffprobe 输出是否为有效 JSON
-                if not duration_result.stdout.strip():
-                    error_msg = "ffprobe returned empty output when getting duration"
-                    yield self.create_text_message(error_msg)
-                    yield self.create_json_message({
-                        "status": "error",
-                        "message": error_msg
-                    })
-                    return
+                if selection_mode == SELECTION_MODE_INTERVAL:
+                    # 计算提取时间点
+                    if count == 1:
+                        # 如果只要1帧，提取中间帧
+                        seek_times = [duration / 2]
+                    else:
+                        # 计算多个时间点
+                        if count * gap_time > duration:
+                            # 如果间隔时间太大，调整间隔时间
+                            gap_time = duration / count
+                    
+                        seek_times = []
+                        for i in range(count):
+                            seek_time = i * gap_time
+                            if seek_time < duration:
+                                seek_times.append(seek_time)
                 
+                # 估计内存峰值：超出插件内存上限时降低分辨率或减少帧数，仍然超出时在启动 ffmpeg 之前拒绝
+                video_stream = get_video_stream(video_metadata) or {}
+                if output_mode == OUTPUT_MODE_CONTACT_SHEET:
+                    planned_count, planned_workers = 0, 1
+                elif selection_mode == SELECTION_MODE_INTERVAL:
+                    planned_count = len(seek_times)
+                    planned_workers = plan_worker_count(video_metadata, planned_count, len(video_file.blob))
+                else:
+                    planned_count, planned_workers = max_count, 1
                 try:
-                    duration_info = json.loads(duration_result.stdout)
-                except json.JSONDecodeError as json_error:
-                    error_msg = f"Failed to parse duration info as JSON: {str(json_error)}. Output: {duration_result.stdout[:200]}..."
+                    memory_plan = plan_memory(
+                        len(video_file.blob),
+                        video_input.memory_bytes if video_input is not None else estimate_input_memory(len(video_file.blob)),
+                        video_stream.get("width") or 0,
+                        video_stream.get("height") or 0,
+                        planned_count,
+                        planned_workers,
+                        encode_params,
+                        hold_all_frames=dedup_threshold > 0
+                    )
+                except MemoryBudgetError as memory_error:
+                    error_msg = str(memory_error)
                     yield self.create_text_message(error_msg)
                     yield self.create_json_message({
                         "status": "error",
                         "message": error_msg
                     })
                     return
-                duration = float(duration_info.get("format", {}).get("duration", 0))
                 
-                if duration <= 0:
-                    error_msg = "Invalid video duration"
-                    yield self.create_text_message(error_msg)
+                encode_params = memory_plan.encode_params
+                if memory_plan.frame_count < planned_count:
+                    if selection_mode == SELECTION_MODE_INTERVAL:
+                        # 在原有时间点中均匀保留一部分
+                        step = (len(seek_times) - 1) / max(1, memory_plan.frame_count - 1)
+                        seek_times = [seek_times[round(i * step)] for i in range(memory_plan.frame_count)]
+                    else:
+                        max_count = memory_plan.frame_count
+                if memory_plan.degraded:
+                    yield self.create_text_message(f"Output degraded to fit the memory limit: {'; '.join(memory_plan.degraded)}")
+                
+                if output_mode == OUTPUT_MODE_CONTACT_SHEET:
+                    # 网格图模式：在同一次解码中缩小并拼接选中的帧
+                    if video_input is None:
+                        video_input = open_video_input(video_file, needs_seek, timer)
+                    
+                    if selection_mode == SELECTION_MODE_INTERVAL:
+                        input_args, select_expression, time_offset = build_interval_selection(video_input, seek_times, seek_mode)
+                        max_frames = interval_frame_limit(seek_times, seek_mode)
+                    else:
+                        input_args, select_expression = build_mode_selection(video_input, selection_mode, max_count, duration, scene_threshold)
+                        time_offset = 0
+                        max_frames = max_count
+                    
+                    yield self.create_text_message(f"Building contact sheets from video...")
+                    
+                    try:
+                        sheet_data_list, cell_times = extract_contact_sheets(
+                            video_input, input_args, select_expression, tile_columns, tile_rows, thumbnail_width, max_frames, encode_params, deadline
+                        )
+                    except FrameExtractionError as extraction_error:
+                        error_msg = f"Failed to build contact sheets: {str(extraction_error)}"
+                        yield self.create_text_message(error_msg)
+                        yield self.create_json_message({
+                            "status": "error",
+                            "message": error_msg
+                        })
+                        return
+                    
+                    contact_sheets = []
+                    for sheet_index, (sheet_data, cells) in enumerate(zip(sheet_data_list, build_sheet_index(cell_times, tile_columns, tile_rows, time_offset))):
+                        output_filename = f"{orig_filename}_sheet_{sheet_index+1:03d}.{get_extension(encode_params)}"
+                        
+                        with timer.stage("message_yield"):
+                            yield self.create_blob_message(
+                                sheet_data,
+                                meta={
+                                    "filename": output_filename,
+                                    "mime_type": get_mime_type(encode_params),
+                                }
+                            )
+                        
+                        contact_sheets.append({
+                            "sheet_number": sheet_index + 1,
+                            "filename": output_filename,
+                            "sheet_size": len(sheet_data),
+                            "cells": cells
+                        })
+                    
                     yield self.create_json_message({
-                        "status": "error",
-                        "message": error_msg
+                        "status": "success",
+                        "message": f"Successfully built {len(contact_sheets)} contact sheets from video",
+                        "original_filename": video_file.filename,
+                        "video_duration": duration,
+                        "seek_mode": seek_mode,
+                        "selection_mode": selection_mode,
+                        "output_mode": output_mode,
+                        "tile_layout": {
+                            "columns": tile_columns,
+                            "rows": tile_rows,
+                            "thumbnail_width": thumbnail_width
+                        },
+                        "extracted_count": len(cell_times),
+                        "output": {
+                            **encode_params,
+                            "total_bytes": sum(sheet["sheet_size"] for sheet in contact_sheets)
+                        },
+                        "contact_sheets": contact_sheets,
+                        "memory": memory_plan.to_dict(),
+                        "scheduler": get_scheduler().to_dict(),
+                        "timings": timer.to_dict()
                     })
+                    
+                    yield self.create_text_message(f"Successfully built {len(contact_sheets)} contact sheets with {len(cell_times)} frames from {video_file.filename}.")
                     return
                 
-                # 计算提取时间点
-                if count == 1:
-                    # 如果只要1帧，提取中间帧
-                    seek_times = [duration / 2]
-                else:
-                    # 计算多个时间点
-                    if count * gap_time > duration:
-                        # 如果间隔时间太大，调整间隔时间
-                        gap_time = duration / count
-                    
-                    seek_times = []
-                    for i in range(count):
-                        seek_time = i * gap_time
-                        if seek_time < duration:
-                            seek_times.append(seek_time)
+                # fast 模式下每个时间点实际使用的关键帧时间
+                keyframe_times = None
+                if selection_mode == SELECTION_MODE_INTERVAL:
+                    # 执行批量帧提取
+                    yield self.create_text_message(f"Extracting {len(seek_times)} frames from video...")
+                    
+                    cache_params = {**encode_params, "max_bytes": max_bytes}
+                    keyframe_index = None
+                    if seek_mode == SEEK_MODE_FAST:
+                        # fast 模式的缓存条目按实际选出的关键帧保存，对应同一关键帧的时间点共用一个缓存条目。
+                        # 只有已有关键帧索引（get_video_info 的 detail=keyframes）时才能在解码之前按最近的关键帧查找缓存
+                        keyframe_times = [None] * len(seek_times)
+                        keyframe_index = get_cached_keyframe_index(video_hash)
+                        if keyframe_index is not None and len(keyframe_index) > 0:
+                            keyframe_times = [keyframe_index.nearest_keyframe(seek_time) for seek_time in seek_times]
+                        cache_keys = [frame_cache_key(video_hash, keyframe_time, seek_mode, cache_params) if keyframe_time is not None else None for keyframe_time in keyframe_times]
+                    else:
+                        cache_keys = [frame_cache_key(video_hash, seek_time, seek_mode, cache_params) for seek_time in seek_times]
+                    
+                    # 先查找已编码帧缓存，只对未命中的时间点解码
+                    frame_data_list = [frame_cache.get(cache_key) if cache_key is not None else None for cache_key in cache_keys]
+                    missing_indexes = [i for i, frame_data in enumerate(frame_data_list) if frame_data is None]
                 
-                # 执行批量帧提取
-                yield self.create_text_message(f"Extracting {len(seek_times)} frames from video...")
+                else:
+                    # 关键帧 / 场景模式：一次遍历文件完成选帧和编码，选中的帧编码完成后即可产出
+                    yield self.create_text_message(f"Selecting {selection_mode} frames from video...")
+                    
+                    if video_input is None:
+                        video_input = open_video_input(video_file, needs_seek, timer)
+                    
+                    missing_indexes = []
                 
                 extracted_frames = []
-                temp_dir = tempfile.gettempdir()
+                extracted_frame_iterator = None
+                if selection_mode != SELECTION_MODE_INTERVAL:
+                    extracted_frame_iterator = iter_selected_frames(video_input, selection_mode, max_count, duration, scene_threshold, encode_params, deadline)
+                elif missing_indexes:
+                    if video_input is None:
+                        video_input = open_video_input(video_file, needs_seek, timer)
+                    
+                    # 默认在一次解码过程中提取所有时间点的帧，必要时分段并行提取；结果按时间点顺序产出
+                    extracted_frame_iterator = iter_frames(
+                        video_input,
+                        [seek_times[i] for i in missing_indexes],
+                        seek_mode,
+                        video_metadata,
+                        len(video_file.blob),
+                        encode_params,
+                        deadline
+                    )
                 
-                for i, seek_time in enumerate(seek_times):
-                    output_filename = f"{orig_filename}_frame_{i+1:03d}.jpg"
-                    out_temp_path = os.path.join(temp_dir, output_filename)
-                    
-                    # 使用ffmpeg提取帧
-                    command = [
-                        'ffmpeg',
-                        '-i', in_temp_path,
-                        '-ss', str(seek_time),
-                        '-vframes', '1',
-                        '-q:v', '2',  # 高质量
-                        '-y',  # 覆盖输出文件
-                        out_temp_path
-                    ]
-                    
-                    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-                    
-                    if result.returncode == 0 and os.path.exists(out_temp_path):
-                        with open(out_temp_path, 'rb') as out_file:
-                            frame_data = out_file.read()
+                def iter_frame_entries():
+                    # 按时间点顺序产出 (下标, 时间点, 帧数据)，每帧解码完成后立即产出
+                    if selection_mode != SELECTION_MODE_INTERVAL:
+                        for i, (selected_time, frame_data) in enumerate(extracted_frame_iterator):
+                            # 超出字节预算时降低质量或分辨率重新编码
+                            frame_data, _ = fit_byte_budget(frame_data, encode_params, max_bytes, deadline)
+                            yield i, selected_time, frame_data
+                        return
+                    
+                    # 缓存未命中的帧在提取完成后写入缓存
+                    missing_index_set = set(missing_indexes)
+                    for i, seek_time in enumerate(seek_times):
+                        frame_data = frame_data_list[i]
+                        if frame_data is None and i in missing_index_set:
+                            frame = next(extracted_frame_iterator, None)
+                            if frame is not None:
+                                selected_time, frame_data = frame
+                                # 超出字节预算时降低质量或分辨率重新编码
+                                frame_data, _ = fit_byte_budget(frame_data, encode_params, max_bytes, deadline)
+                                cache_key = cache_keys[i]
+                                if seek_mode == SEEK_MODE_FAST:
+                                    # 按实际选出的关键帧保存，而不是按预计的最近关键帧：两者在选出的帧中缺少最近关键帧时不同
+                                    keyframe_times[i] = keyframe_cache_time(selected_time, keyframe_index)
+                                    cache_key = frame_cache_key(video_hash, keyframe_times[i], seek_mode, cache_params)
+                                frame_cache.put(cache_key, frame_data)
+                        yield i, seek_time, frame_data
+                
+                removed_frames = []
+                try:
+                    frame_entries = iter_frame_entries()
+                    
+                    # 可选的感知哈希去重：需要先拿到全部帧再决定保留哪些
+                    if dedup_threshold > 0:
+                        frame_entries = list(frame_entries)
+                        valid_entries = [entry for entry in frame_entries if entry[2] is not None]
+                        try:
+                            kept_positions, removed_positions = deduplicate_frames([entry[2] for entry in valid_entries], dedup_threshold, get_pipe_format(encode_params), deadline)
+                            for removed_position, kept_position, distance in removed_positions:
+                                removed_frames.append({
+                                    "frame_number": valid_entries[removed_position][0] + 1,
+                                    "seek_time": valid_entries[removed_position][1],
+                                    "duplicate_of": valid_entries[kept_position][0] + 1,
+                                    "hamming_distance": distance,
+                                    "reason": f"{HASH_METHOD} Hamming distance {distance} <= threshold {dedup_threshold}"
+                                })
+                            removed_indexes = {valid_entries[position][0] for position, _, _ in removed_positions}
+                            frame_entries = [entry for entry in frame_entries if entry[0] not in removed_indexes]
+                        except (FrameDedupError, ProcessTimeoutError) as dedup_error:
+                            yield self.create_text_message(f"Frame deduplication skipped: {str(dedup_error)}")
+                    
+                    expected_count = len(seek_times) if selection_mode == SELECTION_MODE_INTERVAL else max_count
+                    last_progress_time = time.monotonic()
+                    for i, seek_time, frame_data in frame_entries:
+                        output_filename = f"{orig_filename}_frame_{i+1:03d}.{get_extension(encode_params)}"
                         
-                        # 创建帧消息
-                        yield self.create_blob_message(
-                            frame_data,
-                            meta={
-                                "filename": output_filename,
-                                "mime_type": "image/jpeg",
-                            }
-                        )
+                        if frame_data is None:
+                            error_msg = f"Failed to extract frame at {seek_time:.2f}s"
+                            yield self.create_text_message(error_msg)
+                            continue
                         
-                        extracted_frames.append({
+                        # 创建帧消息
+                        with timer.stage("message_yield"):
+                            yield self.create_blob_message(
+                                frame_data,
+                                meta={
+                                    "filename": output_filename,
+                                    "mime_type": get_mime_type(encode_params),
+                                    # 后台任务按这些字段记录进度和帧列表
+                                    "frame_number": i + 1,
+                                    "frame_count": expected_count,
+                                    "seek_time": seek_time,
+                                }
+                            )
+
+                        frame_entry = {
                             "frame_number": i + 1,
                             "filename": output_filename,
                             "seek_time": seek_time,
                             "frame_size": len(frame_data)
-                        })
+                        }
+                        if keyframe_times is not None:
+                            frame_entry["keyframe_time"] = keyframe_times[i]
+                        extracted_frames.append(frame_entry)
                         
-                        # 清理临时帧文件
-                        os.unlink(out_temp_path)
-                    else:
-                        error_msg = f"Failed to extract frame at {seek_time:.2f}s: {result.stderr}"
-                        yield self.create_text_message(error_msg)
+                        # 长时间任务定期报告进度
+                        if time.monotonic() - last_progress_time >= PROGRESS_INTERVAL_SECONDS:
+                            last_progress_time = time.monotonic()
+                            yield self.create_text_message(f"Extracted {len(extracted_frames)}/{expected_count} frames (at {seek_time:.2f}s)...")
+                except FrameExtractionError as extraction_error:
+                    error_msg = f"Failed to extract video frames: {str(extraction_error)}"
+                    yield self.create_text_message(error_msg)
+                    yield self.create_json_message({
+                        "status": "error",
+                        "message": error_msg
+                    })
+                    return
+                finally:
+                    # 提前结束时取消尚未开始的区间
+                    if extracted_frame_iterator is not None:
+                        extracted_frame_iterator.close()
                 
                 # 创建结果消息
                 yield self.create_json_message({
@@ -201,21 +553,52 @@ class GetVideoFrameList(Tool):
                     "video_duration": duration,
                     "gap_time": gap_time,
                     "requested_count": count,
+                    "seek_mode": seek_mode,
+                    "selection_mode": selection_mode,
                     "extracted_count": len(extracted_frames),
-                    "frames": extracted_frames
+                    "frames": extracted_frames,
+                    "output": {
+                        **encode_params,
+                        "max_bytes": max_bytes,
+                        "total_bytes": sum(frame["frame_size"] for frame in extracted_frames)
+                    },
+                    "frame_cache": frame_cache.to_dict(),
+                    "memory": memory_plan.to_dict(),
+                    "scheduler": get_scheduler().to_dict(),
+                    "timings": timer.to_dict(),
+                    "deduplication": {
+                        "enabled": dedup_threshold > 0,
+                        "method": HASH_METHOD,
+                        "threshold": dedup_threshold,
+                        "removed_count": len(removed_frames),
+                        "removed_frames": removed_frames
+                    }
                 })
                 
                 yield self.create_text_message(f"Successfully extracted {len(extracted_frames)} frames from {video_file.filename}.")
                 
             finally:
-                # 清理临时文件
-                if os.path.exists(in_temp_path):
-                    os.unlink(in_temp_path)
+                # 结束仍在运行的子进程（包括生成器被提前关闭的情况）并释放视频输入
+                deadline.cancel()
+                if video_input is not None:
+                    video_input.close()
                     
+        except ProcessTimeoutError as timeout_error:
+            error_msg = f"Video processing timed out: {str(timeout_error)}"
+            yield self.create_text_message(error_msg)
+            yield self.create_json_message({
+                "status": "error",
+                "message": error_msg,
+                "timeout": timeout_error.to_dict(),
+                "scheduler": get_scheduler().to_dict(),
+                "timings": timer.to_dict()
+            })
         except Exception as e:
             error_msg = f"Error processing video file: {str(e)}"
             yield self.create_text_message(error_msg)
             yield self.create_json_message({
                 "status": "error",
                 "message": error_msg
-            })
\ No newline at end of file
+            })
+        finally:
+            record_metrics("get_video_frame_list", timer)
\ No newline at end of file
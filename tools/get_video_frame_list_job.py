@@ -0,0 +1,100 @@
+from dify_plugin import Tool
+from dify_plugin.entities.tool import ToolInvokeMessage
+from collections.abc import Generator
+from typing import Any
+
+from utils.jobs import (
+    load_job, read_job_frame, cleanup_expired_jobs, job_summary, JobError,
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, JOB_STATUS_SUCCEEDED, JOB_STATUS_FAILED
+)
+
+class GetVideoFrameListJob(Tool):
+    def _invoke(self, tool_parameters: dict[str, Any]) -> Generator[ToolInvokeMessage, None, None]:
+        job_id = (tool_parameters.get('job_id') or '').strip()
+        page = tool_parameters.get('page', 1)
+        page_size = tool_parameters.get('page_size', DEFAULT_PAGE_SIZE)
+
+        # 验证输入
+        if not job_id:
+            yield self.create_text_message("No job id provided")
+            yield self.create_json_message({
+                "status": "error",
+                "message": "No job id provided"
+            })
+            return
+
+        # 验证分页参数
+        try:
+            page = int(page) if page not in (None, '') else 1
+            page_size = int(page_size) if page_size not in (None, '') else DEFAULT_PAGE_SIZE
+            if page < 1 or not 1 <= page_size <= MAX_PAGE_SIZE:
+                raise ValueError
+        except (ValueError, TypeError):
+            error_msg = f"Invalid page or page_size parameter. Page must be at least 1 and page_size between 1 and {MAX_PAGE_SIZE}"
+            yield self.create_text_message(error_msg)
+            yield self.create_json_message({
+                "status": "error",
+                "message": error_msg
+            })
+            return
+
+        cleanup_expired_jobs()
+        try:
+            job_state = load_job(job_id)
+        except JobError as job_error:
+            yield self.create_text_message(str(job_error))
+            yield self.create_json_message({
+                "status": "error",
+                "message": str(job_error)
+            })
+            return
+
+        if job_state is None:
+            error_msg = f"Job not found or expired: {job_id}"
+            yield self.create_text_message(error_msg)
+            yield self.create_json_message({
+                "status": "error",
+                "message": error_msg
+            })
+            return
+
+        # 已完成的帧按帧序号分页返回，任务运行中也可以先取回前面的页
+        frames = sorted(job_state["frames"], key=lambda frame: frame["frame_number"])
+        page_frames = frames[(page - 1) * page_size:page * page_size]
+        has_more = page * page_size < len(frames)
+
+        returned_frames = []
+        for frame in page_frames:
+            frame_data = read_job_frame(job_id, frame)
+            if frame_data is None:
+                continue
+            yield self.create_blob_message(
+                frame_data,
+                meta={
+                    "filename": frame["filename"],
+                    "mime_type": frame["mime_type"],
+                }
+            )
+            returned_frames.append({key: value for key, value in frame.items() if key != "file"})
+
+        yield self.create_json_message({
+            "status": "success",
+            "message": f"Job is {job_state['status']}",
+            **job_summary(job_state),
+            "page": page,
+            "page_size": page_size,
+            "available_frames": len(frames),
+            "has_more": has_more,
+            "next_page": page + 1 if has_more else None,
+            "frames": returned_frames,
+            # 任务结束后附带 get_video_frame_list 的结果（不含帧列表）
+            "result": job_state["result"] if job_state["status"] in (JOB_STATUS_SUCCEEDED, JOB_STATUS_FAILED) else None
+        })
+
+        progress = job_state["progress"]
+        expected_frames = progress.get("expected_frames")
+        progress_text = f"{progress['completed_frames']}/{expected_frames}" if expected_frames else str(progress['completed_frames'])
+        if job_state["status"] == JOB_STATUS_FAILED:
+            yield self.create_text_message(f"Job {job_id} failed: {job_state['error']}")
+        else:
+            yield self.create_text_message(f"Job {job_id} is {job_state['status']}: {progress_text} frames extracted, returned {len(returned_frames)} frames on page {page}.")
@@ -3,14 +3,49 @@ from dify_plugin import Tool
 from dify_plugin.entities.tool import ToolInvokeMessage
 from collections.abc import Generator
 from typing import Any
-import tempfile
-import subprocess
-import json
-import os
+
+from utils.cache import content_hash
+from utils.probe_cache import get_cached_probe, probe_video, probe_video_header, ProbeError, PROBE_METHOD_CACHE, PROBE_METHOD_HEADER, PROBE_METHOD_FFPROBE
+from utils.keyframe_index import get_cached_keyframe_index, get_keyframe_index, KeyframeIndexError
+from utils.video_input import open_video_input
+from utils.process import Deadline, ProcessTimeoutError
+from utils.scheduler import get_scheduler
+from utils.resources import estimate_decoder_memory
+from utils.timing import StageTimer, record_metrics
+from utils.batch import get_batch_files, invoke_batch
+from utils.single_flight import coalesce_invocation
+
+# 信息详细程度: basic 只读取容器和流信息；keyframes 额外读取所有包，构建关键帧索引和每个流的统计
+DETAIL_BASIC = "basic"
+DETAIL_KEYFRAMES = "keyframes"
 
 class GetVideoInfo(Tool):
     
     def _invoke(self, tool_parameters: dict[str, Any]) -> Generator[ToolInvokeMessage, None, None]:
+        # 提供 videos 时批量处理，每个文件按单文件的流程处理
+        batch_files = get_batch_files(tool_parameters)
+        if batch_files is not None:
+            yield from invoke_batch(
+                self,
+                batch_files,
+                lambda video_file, deadline, video_hash: self._invoke_coalesced({**tool_parameters, 'video': video_file}, deadline, video_hash),
+                file_memory=estimate_decoder_memory(0, 0)
+            )
+            return
+        yield from self._invoke_coalesced(tool_parameters)
+
+    def _invoke_coalesced(self, tool_parameters: dict[str, Any], parent_deadline: Deadline | None = None, video_hash: str | None = None) -> Generator[ToolInvokeMessage, None, None]:
+        # 内容和参数都相同的并发调用只处理一次，其余调用等待并复用同一结果
+        yield from coalesce_invocation(
+            self,
+            "get_video_info",
+            tool_parameters,
+            video_hash,
+            parent_deadline,
+            lambda video_hash, timer, deadline: self._invoke_video(tool_parameters, deadline, video_hash, timer)
+        )
+
+    def _invoke_video(self, tool_parameters: dict[str, Any], parent_deadline: Deadline | None = None, video_hash: str | None = None, timer: StageTimer | None = None) -> Generator[ToolInvokeMessage, None, None]:
         uploaded_video_file = tool_parameters.get('video')
         
         if not uploaded_video_file:
@@ -21,165 +56,198 @@ class GetVideoInfo(Tool):
             })
             return
         
+        detail = tool_parameters.get('detail') or DETAIL_BASIC
+        if detail not in (DETAIL_BASIC, DETAIL_KEYFRAMES):
+            error_msg = f"Invalid detail: {detail}. Must be one of: {DETAIL_BASIC}, {DETAIL_KEYFRAMES}"
+            yield self.create_text_message(error_msg)
+            yield self.create_json_message({
+                "status": "error",
+                "message": error_msg
+            })
+            return
+        
+        # 记录各阶段耗时，结果放在 JSON 的 timings 中
+        if timer is None:
+            timer = StageTimer()
+        deadline = parent_deadline.child(timer) if parent_deadline is not None else Deadline(timer=timer)
+        
         try:
-            # 创建临时文件
-            video_file_extension = uploaded_video_file.extension if uploaded_video_file.extension else '.mp4'
+            # 按内容哈希查找缓存的 ffprobe 结果，命中时无需写入临时文件
+            # 批量调用时内容哈希已由 invoke_batch 计算
+            if video_hash is None:
+                with timer.stage("hash"):
+                    video_hash = content_hash(uploaded_video_file.blob)
+            video_metadata = get_cached_probe(video_hash)
+            probe_method = PROBE_METHOD_CACHE
             
-            with tempfile.NamedTemporaryFile(delete=False, suffix=video_file_extension) as temp_video_file:
-                temp_video_file.write(uploaded_video_file.blob)
-                temporary_video_path = temp_video_file.name
+            if video_metadata is None:
+                # 先直接解析内存中的 MP4 / Matroska 头部，不写磁盘也不启动 ffprobe
+                with timer.stage("header_probe"):
+                    video_metadata = probe_video_header(uploaded_video_file.blob, video_hash)
+                probe_method = PROBE_METHOD_HEADER
             
-            try:
-                # 获取视频信息
-                ffprobe_command = [
-                    'ffprobe', 
-                    '-v', 'error',  # 显示错误信息
-                    '-print_format', 'json',
-                    '-show_format',
-                    '-show_streams',
-                    temporary_video_path
-                ]
+            if video_metadata is None:
+                # 头部无法解析时回退到 ffprobe，由共享的输入层决定通过管道、memfd 还是临时文件传入
+                probe_method = PROBE_METHOD_FFPROBE
+                video_input = open_video_input(uploaded_video_file, needs_seek=False, timer=timer)
                 
-                ffprobe_result = subprocess.run(
-                    ffprobe_command, 
-                    stdout=subprocess.PIPE, 
-                    stderr=subprocess.PIPE, 
-                    text=True
-                )
-                
-                if ffprobe_result.returncode != 0:
-                    analysis_error_message = f"Error analyzing video file: {ffprobe_result.stderr}"
+                try:
+                    # 获取视频信息
+                    video_metadata = probe_video(video_input, video_hash, deadline)
+                except ProbeError as probe_error:
+                    analysis_error_message = f"Error analyzing video file: {str(probe_error)}"
                     yield self.create_text_message(analysis_error_message)
                     yield self.create_json_message({
                         "status": "error",
                         "message": analysis_error_message
                     })
                     return
+                finally:
+                    video_input.close()
+            
+            # 提取关键信息并构建结构化响应
+            video_info_response = {
+                "status": "success",
+                "filename": uploaded_video_file.filename,
+                "format": {
+                    "format_name": video_metadata.get("format", {}).get("format_name", "unknown"),
+                    "duration": float(video_metadata.get("format", {}).get("duration", 0)),
+                    # 通过管道读取时 ffprobe 无法得到文件大小和码率，使用上传内容计算
+                    "size": int(video_metadata.get("format", {}).get("size", len(uploaded_video_file.blob))),
+                    "bit_rate": int(video_metadata.get("format", {}).get("bit_rate", 0)),
+                },
+                "resolution": {
+                    "width": 0,
+                    "height": 0,
+                },
+                "streams": [],
+                # 信息来源: header（容器头部）、ffprobe 或 cache
+                "probe_method": probe_method
+            }
+            
+            video_format_info = video_info_response["format"]
+            if not video_format_info["bit_rate"] and video_format_info["duration"] > 0:
+                video_format_info["bit_rate"] = int(video_format_info["size"] * 8 / video_format_info["duration"])
+            
+            # 处理流信息
+            for stream_metadata in video_metadata.get("streams", []):
+                stream_info = {
+                    "index": stream_metadata.get("index"),
+                    "codec_type": stream_metadata.get("codec_type"),
+                    "codec_name": stream_metadata.get("codec_name")
+                }
                 
-                # 验证 ffprobe 输出是否为有效 JSON
-                if not ffprobe_result.stdout.strip():
-                    analysis_error_message = "ffprobe returned empty output"
-                    yield self.create_text_message(analysis_error_message)
-                    yield self.create_json_message({
-                        "status": "error",
-                        "message": analysis_error_message
+                # 处理视频流特有信息
+                if stream_metadata.get("codec_type") == "video":
+                    stream_info.update({
+                        "width": stream_metadata.get("width"),
+                        "height": stream_metadata.get("height"),
+                        "r_frame_rate": stream_metadata.get("r_frame_rate"),
+                        "display_aspect_ratio": stream_metadata.get("display_aspect_ratio", "unknown")
                     })
-                    return
                 
-                try:
-                    video_metadata = json.loads(ffprobe_result.stdout)
-                except json.JSONDecodeError as json_error:
-                    # 提供详细的调试信息
-                    debug_info = f"JSON解析错误: {str(json_error)}\n"
-                    debug_info += f"ffprobe返回码: {ffprobe_result.returncode}\n"
-                    debug_info += f"标准输出前500字符: {ffprobe_result.stdout[:500]}\n"
-                    debug_info += f"标准错误: {ffprobe_result.stderr[:500]}"
-                    
-                    analysis_error_message = f"Failed to parse ffprobe output as JSON: {debug_info}"
-                    yield self.create_text_message(analysis_error_message)
-                    yield self.create_json_message({
-                        "status": "error",
-                        "message": analysis_error_message
+                # 处理音频流特有信息
+                elif stream_metadata.get("codec_type") == "audio":
+                    stream_info.update({
+                        "sample_rate": stream_metadata.get("sample_rate"),
+                        "channels": stream_metadata.get("channels"),
+                        "channel_layout": stream_metadata.get("channel_layout", "unknown")
                     })
-                    return
                 
-                # 提取关键信息并构建结构化响应
-                video_info_response = {
-                    "status": "success",
-                    "filename": uploaded_video_file.filename,
-                    "format": {
-                        "format_name": video_metadata.get("format", {}).get("format_name", "unknown"),
-                        "duration": float(video_metadata.get("format", {}).get("duration", 0)),
-                        "size": int(video_metadata.get("format", {}).get("size", 0)),
-                        "bit_rate": int(video_metadata.get("format", {}).get("bit_rate", 0)),
-                    },
-                    "resolution": {
-                        "width": 0,
-                        "height": 0,
-                    },
-                    "streams": []
-                }
-                
-                # 处理流信息
-                for stream_metadata in video_metadata.get("streams", []):
-                    stream_info = {
-                        "index": stream_metadata.get("index"),
-                        "codec_type": stream_metadata.get("codec_type"),
-                        "codec_name": stream_metadata.get("codec_name")
-                    }
-                    
-                    # 处理视频流特有信息
-                    if stream_metadata.get("codec_type") == "video":
-                        stream_info.update({
-                            "width": stream_metadata.get("width"),
-                            "height": stream_metadata.get("height"),
-                            "r_frame_rate": stream_metadata.get("r_frame_rate"),
-                            "display_aspect_ratio": stream_metadata.get("display_aspect_ratio", "unknown")
-                        })
-                    
-                    # 处理音频流特有信息
-                    elif stream_metadata.get("codec_type") == "audio":
-                        stream_info.update({
-                            "sample_rate": stream_metadata.get("sample_rate"),
-                            "channels": stream_metadata.get("channels"),
-                            "channel_layout": stream_metadata.get("channel_layout", "unknown")
+                video_info_response["streams"].append(stream_info)
+            
+            keyframe_index = None
+            if detail == DETAIL_KEYFRAMES:
+                # 索引按内容哈希缓存，之后抽帧工具在 fast 模式下可直接对齐到关键帧
+                keyframe_index = get_cached_keyframe_index(video_hash)
+                if keyframe_index is None:
+                    video_input = open_video_input(uploaded_video_file, needs_seek=False, timer=timer)
+                    try:
+                        keyframe_index = get_keyframe_index(video_input, video_hash, deadline)
+                    except KeyframeIndexError as index_error:
+                        index_error_message = f"Error building keyframe index: {str(index_error)}"
+                        yield self.create_text_message(index_error_message)
+                        yield self.create_json_message({
+                            "status": "error",
+                            "message": index_error_message
                         })
-                    
-                    video_info_response["streams"].append(stream_info)
+                        return
+                    finally:
+                        video_input.close()
+                video_info_response["keyframe_index"] = keyframe_index.to_dict()
+                video_info_response["stream_stats"] = keyframe_index.streams
+            
+            # 生成摘要信息
+            video_streams = [stream for stream in video_info_response["streams"] if stream["codec_type"] == "video"]
+            audio_streams = [stream for stream in video_info_response["streams"] if stream["codec_type"] == "audio"]
+            
+            if not video_streams:
+                summary_text = f"No video streams found in {uploaded_video_file.filename}"
+            else:
+                primary_video_stream = video_streams[0]
+                video_duration_seconds = video_info_response["format"]["duration"]
+                duration_minutes = int(video_duration_seconds // 60)
+                duration_seconds = int(video_duration_seconds % 60)
+                
+                summary_lines = [
+                    f"Video Information for {uploaded_video_file.filename}:",
+                    "",
+                    f"Format: {video_info_response['format']['format_name']}",
+                    f"Duration: {duration_minutes}m {duration_seconds}s",
+                    f"Size: {video_info_response['format']['size'] / (1024*1024):.2f} MB",
+                ]
                 
-                # 生成摘要信息
-                video_streams = [stream for stream in video_info_response["streams"] if stream["codec_type"] == "video"]
-                audio_streams = [stream for stream in video_info_response["streams"] if stream["codec_type"] == "audio"]
+                if "width" in primary_video_stream and "height" in primary_video_stream:
+                    summary_lines.append(f"Resolution: {primary_video_stream['width']}x{primary_video_stream['height']}")
+                    video_info_response["resolution"]["width"] = max(
+                        video_info_response["resolution"]["width"], 
+                        primary_video_stream["width"]
+                    )
+                    video_info_response["resolution"]["height"] = max(
+                        video_info_response["resolution"]["height"], 
+                        primary_video_stream["height"]
+                    )
                 
-                if not video_streams:
-                    summary_text = f"No video streams found in {uploaded_video_file.filename}"
-                else:
-                    primary_video_stream = video_streams[0]
-                    video_duration_seconds = video_info_response["format"]["duration"]
-                    duration_minutes = int(video_duration_seconds // 60)
-                    duration_seconds = int(video_duration_seconds % 60)
-                    
-                    summary_lines = [
-                        f"Video Information for {uploaded_video_file.filename}:",
-                        "",
-                        f"Format: {video_info_response['format']['format_name']}",
-                        f"Duration: {duration_minutes}m {duration_seconds}s",
-                        f"Size: {video_info_response['format']['size'] / (1024*1024):.2f} MB",
-                    ]
-                    
-                    if "width" in primary_video_stream and "height" in primary_video_stream:
-                        summary_lines.append(f"Resolution: {primary_video_stream['width']}x{primary_video_stream['height']}")
-                        video_info_response["resolution"]["width"] = max(
-                            video_info_response["resolution"]["width"], 
-                            primary_video_stream["width"]
-                        )
-                        video_info_response["resolution"]["height"] = max(
-                            video_info_response["resolution"]["height"], 
-                            primary_video_stream["height"]
-                        )
-                    
-                    summary_lines.append(f"Video Codec: {primary_video_stream.get('codec_name', 'Unknown')}")
-                    
-                    if audio_streams:
-                        summary_lines.append(f"Audio Codec: {audio_streams[0].get('codec_name', 'Unknown')}")
-                    
-                    summary_lines.append(f"Bitrate: {video_info_response['format']['bit_rate'] / 1000:.2f} kbps")
-                    
-                    summary_text = "\n".join(summary_lines)
+                summary_lines.append(f"Video Codec: {primary_video_stream.get('codec_name', 'Unknown')}")
                 
-                # 返回处理结果
-                yield self.create_text_message(summary_text)
-                yield self.create_json_message(video_info_response)
+                if audio_streams:
+                    summary_lines.append(f"Audio Codec: {audio_streams[0].get('codec_name', 'Unknown')}")
                 
-            finally:
-                # 清理临时文件
-                if os.path.exists(temporary_video_path):
-                    os.unlink(temporary_video_path)
-                    
+                summary_lines.append(f"Bitrate: {video_info_response['format']['bit_rate'] / 1000:.2f} kbps")
+                
+                if keyframe_index is not None:
+                    gop = keyframe_index.gop_stats()
+                    keyframe_line = f"Keyframes: {gop['keyframe_count']}"
+                    if gop["avg_seconds"] is not None:
+                        keyframe_line += f" (average GOP {gop['avg_seconds']:.2f}s, {gop['avg_frames']} frames)"
+                    summary_lines.append(keyframe_line)
+                
+                summary_text = "\n".join(summary_lines)
+            
+            # 返回处理结果
+            video_info_response["scheduler"] = get_scheduler().to_dict()
+            video_info_response["timings"] = timer.to_dict()
+            yield self.create_text_message(summary_text)
+            yield self.create_json_message(video_info_response)
+            
+        except ProcessTimeoutError as timeout_error:
+            timeout_error_message = f"Video analysis timed out: {str(timeout_error)}"
+            yield self.create_text_message(timeout_error_message)
+            yield self.create_json_message({
+                "status": "error",
+                "message": timeout_error_message,
+                "timeout": timeout_error.to_dict(),
+                "scheduler": get_scheduler().to_dict(),
+                "timings": timer.to_dict()
+            })
         except Exception as processing_error:
             processing_error_message = f"Error processing video file: {str(processing_error)}"
             yield self.create_text_message(processing_error_message)
             yield self.create_json_message({
                 "status": "error",
                 "message": processing_error_message
-            }) 
\ No newline at end of file
+            })
+        finally:
+            # 结束仍在运行的 ffprobe（包括生成器被提前关闭的情况）
+            deadline.cancel()
+            record_metrics("get_video_info", timer) 
\ No newline at end of file
@@ -0,0 +1,61 @@
+from dify_plugin import Tool
+from dify_plugin.entities.tool import ToolInvokeMessage
+from collections.abc import Generator
+from typing import Any
+
+# 导入模块而不是类：插件按每个文件中唯一的 Tool 子类加载工具
+from tools import get_video_frame_list
+from utils.capabilities import CapabilityError
+from utils.jobs import submit_job, job_summary, JobError, JOB_TIMEOUT
+
+class SubmitVideoFrameListJob(Tool):
+    def _invoke(self, tool_parameters: dict[str, Any]) -> Generator[ToolInvokeMessage, None, None]:
+        video_file = tool_parameters.get('video')
+
+        # 验证输入
+        if not video_file:
+            yield self.create_text_message("No video file provided")
+            yield self.create_json_message({
+                "status": "error",
+                "message": "No video file provided"
+            })
+            return
+
+        # 提交之前同步验证参数，无效的参数直接返回错误而不是在任务运行后才失败
+        try:
+            get_video_frame_list.validate_parameters(tool_parameters)
+        except (ValueError, CapabilityError) as parameter_error:
+            yield self.create_text_message(str(parameter_error))
+            yield self.create_json_message({
+                "status": "error",
+                "message": str(parameter_error)
+            })
+            return
+
+        # 任务参数中不保留上传的文件，排队期间视频只保存在任务目录中
+        job_parameters = {name: value for name, value in tool_parameters.items() if name not in ('video', 'videos')}
+        frame_list_tool = get_video_frame_list.GetVideoFrameList(runtime=self.runtime, session=self.session)
+
+        try:
+            job_state = submit_job(
+                "get_video_frame_list",
+                video_file,
+                job_parameters,
+                lambda stored_file, deadline: frame_list_tool.extract_frame_list({**job_parameters, 'video': stored_file}, deadline)
+            )
+        except JobError as job_error:
+            yield self.create_text_message(str(job_error))
+            yield self.create_json_message({
+                "status": "error",
+                "message": str(job_error)
+            })
+            return
+
+        yield self.create_json_message({
+            "status": "success",
+            "message": "Job submitted, poll it with get_video_frame_list_job",
+            **job_summary(job_state),
+            "timeout_seconds": JOB_TIMEOUT
+        })
+
+        yield self.create_text_message(f"Submitted frame extraction job {job_state['job_id']} for {video_file.filename}. Poll it with get_video_frame_list_job.")
@@ -0,0 +1,255 @@
+import numpy as np
+
+from utils.config import env_int
+from utils.process import Deadline, ProcessStream, deadline_stage
+from utils.video_input import VideoInput, OutputFile
+
+
+class AudioExtractionError(Exception):
+    pass
+
+
+# 返回的音频格式，none 表示只做分析
+AUDIO_FORMAT_WAV = "wav"
+AUDIO_FORMAT_OPUS = "opus"
+AUDIO_FORMAT_NONE = "none"
+AUDIO_FORMATS = [AUDIO_FORMAT_WAV, AUDIO_FORMAT_OPUS, AUDIO_FORMAT_NONE]
+DEFAULT_AUDIO_FORMAT = AUDIO_FORMAT_WAV
+
+_AUDIO_MUXERS = {AUDIO_FORMAT_WAV: "wav", AUDIO_FORMAT_OPUS: "ogg"}
+_AUDIO_CODEC_ARGS = {AUDIO_FORMAT_WAV: ['-c:a', 'pcm_s16le'], AUDIO_FORMAT_OPUS: ['-c:a', 'libopus', '-b:a', '32k']}
+_AUDIO_EXTENSIONS = {AUDIO_FORMAT_WAV: "wav", AUDIO_FORMAT_OPUS: "ogg"}
+_AUDIO_MIME_TYPES = {AUDIO_FORMAT_WAV: "audio/wav", AUDIO_FORMAT_OPUS: "audio/ogg"}
+# Opus 固定 32 kbps，用于估计输出大小
+_OPUS_BYTES_PER_SECOND = 32000 // 8
+# libopus 支持的采样率
+_OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+
+# 语音识别常用的 16 kHz 单声道
+DEFAULT_SAMPLE_RATE = 16000
+DEFAULT_CHANNELS = 1
+MIN_SAMPLE_RATE = 8000
+MAX_SAMPLE_RATE = 48000
+
+# 静音检测默认参数
+DEFAULT_SILENCE_THRESHOLD_DB = -40.0
+DEFAULT_MIN_SILENCE_SECONDS = 0.5
+# 计算 RMS 的窗口长度（秒）
+ANALYSIS_WINDOW_SECONDS = 0.05
+
+# 返回的音频文件最大字节数，超出时在启动 ffmpeg 之前拒绝；ffmpeg 也会在写到该大小时停止
+AUDIO_MAX_BYTES = env_int("FFMPEG_TOOLS_AUDIO_MAX_BYTES", 64 * 1024 * 1024)
+
+# 分析使用的 PCM 格式：单声道 16 位小端
+_PCM_SAMPLE_BYTES = 2
+# 避免 log10(0)
+_MIN_AMPLITUDE = 1e-10
+
+
+def required_encoders(audio_format: str) -> list[str]:
+    if audio_format == AUDIO_FORMAT_OPUS:
+        return ['libopus']
+    if audio_format == AUDIO_FORMAT_WAV:
+        return ['pcm_s16le']
+    return []
+
+
+def get_audio_extension(audio_format: str) -> str:
+    return _AUDIO_EXTENSIONS[audio_format]
+
+
+def get_audio_mime_type(audio_format: str) -> str:
+    return _AUDIO_MIME_TYPES[audio_format]
+
+
+def get_output_sample_rate(audio_format: str, sample_rate: int) -> int:
+    """返回的音频文件的采样率：libopus 不支持的采样率（如 22050、44100）按 48 kHz 编码 Opus，分析仍使用 sample_rate"""
+    if audio_format == AUDIO_FORMAT_OPUS and sample_rate not in _OPUS_SAMPLE_RATES:
+        return 48000
+    return sample_rate
+
+
+def estimate_audio_bytes(audio_format: str, duration: float, sample_rate: int, channels: int) -> int:
+    """返回的音频文件大小估计"""
+    if audio_format == AUDIO_FORMAT_WAV:
+        return int(duration * sample_rate * channels * _PCM_SAMPLE_BYTES) + 44
+    if audio_format == AUDIO_FORMAT_OPUS:
+        return int(duration * _OPUS_BYTES_PER_SECOND) + 64 * 1024
+    return 0
+
+
+def to_decibels(amplitude: np.ndarray | float) -> np.ndarray | float:
+    """振幅（满幅为 1）转换为 dBFS"""
+    return 20 * np.log10(np.maximum(amplitude, _MIN_AMPLITUDE))
+
+
+class SilenceDetector:
+    """
+    按固定窗口计算 RMS，流式检测静音区间。
+    每次 feed() 处理一块单声道 16 位 PCM，只保留不足一个窗口的剩余样本和当前静音区间的起点，内存占用与音频长度无关。
+    """
+
+    def __init__(self, sample_rate: int, threshold_db: float = DEFAULT_SILENCE_THRESHOLD_DB, min_silence_seconds: float = DEFAULT_MIN_SILENCE_SECONDS, window_seconds: float = ANALYSIS_WINDOW_SECONDS):
+        self.sample_rate = sample_rate
+        self.threshold_db = threshold_db
+        self.min_silence_seconds = min_silence_seconds
+        self.window_samples = max(1, int(sample_rate * window_seconds))
+        self.silences: list[tuple[int, int]] = []
+        self.total_samples = 0
+        self.silent_samples = 0
+        self._window_start = 0
+        self._silence_start = None
+        self._pending = np.empty(0, dtype=np.float32)
+        self._partial_sample = b''
+        self._sum_squares = 0.0
+        self._peak = 0.0
+
+    def feed(self, data: bytes) -> None:
+        data = self._partial_sample + data
+        usable = len(data) - len(data) % _PCM_SAMPLE_BYTES
+        self._partial_sample = data[usable:]
+        if not usable:
+            return
+
+        samples = np.frombuffer(data, dtype='<i2', count=usable // _PCM_SAMPLE_BYTES).astype(np.float32) / 32768.0
+        self.total_samples += len(samples)
+        self._sum_squares += float(np.dot(samples, samples))
+        self._peak = max(self._peak, float(np.abs(samples).max()))
+
+        if len(self._pending):
+            samples = np.concatenate([self._pending, samples])
+        full = len(samples) - len(samples) % self.window_samples
+        self._pending = samples[full:]
+        if full:
+            self._process_windows(samples[:full].reshape(-1, self.window_samples))
+
+    def finish(self) -> None:
+        """处理最后不足一个窗口的样本，结束仍未结束的静音区间"""
+        if len(self._pending):
+            self._process_windows(self._pending.reshape(1, -1))
+            self._pending = np.empty(0, dtype=np.float32)
+        if self._silence_start is not None:
+            self._close_silence(self.total_samples)
+
+    def _process_windows(self, windows: np.ndarray) -> None:
+        window_length = windows.shape[1]
+        silent = to_decibels(np.sqrt(np.mean(windows * windows, axis=1))) < self.threshold_db
+        self.silent_samples += int(silent.sum()) * window_length
+
+        # 只遍历状态变化的位置，连续的静音或非静音窗口一次处理
+        boundaries = np.concatenate(([0], np.flatnonzero(silent[1:] != silent[:-1]) + 1))
+        for boundary in boundaries:
+            position = self._window_start + int(boundary) * window_length
+            if silent[boundary]:
+                if self._silence_start is None:
+                    self._silence_start = position
+            elif self._silence_start is not None:
+                self._close_silence(position)
+        self._window_start += len(windows) * window_length
+
+    def _close_silence(self, end: int) -> None:
+        if (end - self._silence_start) / self.sample_rate >= self.min_silence_seconds:
+            self.silences.append((self._silence_start, end))
+        self._silence_start = None
+
+    @property
+    def duration(self) -> float:
+        return self.total_samples / self.sample_rate
+
+    def silence_segments(self) -> list[dict]:
+        return [self._segment(start, end) for start, end in self.silences]
+
+    def sound_segments(self) -> list[dict]:
+        """静音区间之间的有声区间，可直接作为语音识别的切分点"""
+        segments = []
+        position = 0
+        for start, end in self.silences:
+            if start > position:
+                segments.append(self._segment(position, start))
+            position = end
+        if self.total_samples > position:
+            segments.append(self._segment(position, self.total_samples))
+        return segments
+
+    def _segment(self, start: int, end: int) -> dict:
+        return {
+            "start": round(start / self.sample_rate, 3),
+            "end": round(end / self.sample_rate, 3),
+            "duration": round((end - start) / self.sample_rate, 3),
+        }
+
+    def stats(self) -> dict:
+        rms = (self._sum_squares / self.total_samples) ** 0.5 if self.total_samples else 0.0
+        return {
+            "duration": round(self.duration, 3),
+            "rms_db": round(float(to_decibels(rms)), 2),
+            "peak_db": round(float(to_decibels(self._peak)), 2),
+            "silence_ratio": round(self.silent_samples / self.total_samples, 4) if self.total_samples else 0.0,
+            "window_seconds": self.window_samples / self.sample_rate,
+            "silence_threshold_db": self.threshold_db,
+            "min_silence_duration": self.min_silence_seconds,
+        }
+
+
+def build_audio_command(input_path: str, sample_rate: int, channels: int, audio_format: str, output_path: str | None) -> list[str]:
+    """
+    一次解码同时产生两个输出：stdout 上供分析的单声道 PCM，以及可选的重采样 / 混音后的 WAV 或 Opus 文件，
+    文件的采样率见 get_output_sample_rate()。
+    """
+    command = [
+        'ffmpeg',
+        '-hide_banner',
+        '-v', 'error',
+        '-y',
+        '-i', input_path,
+        '-map', '0:a:0',
+        '-ac', '1',
+        '-ar', str(sample_rate),
+        '-f', 's16le',
+        'pipe:1'
+    ]
+    if output_path is not None:
+        command += [
+            '-map', '0:a:0',
+            '-ac', str(channels),
+            '-ar', str(get_output_sample_rate(audio_format, sample_rate)),
+            *_AUDIO_CODEC_ARGS[audio_format],
+            '-fs', str(AUDIO_MAX_BYTES),
+            '-f', _AUDIO_MUXERS[audio_format],
+            output_path
+        ]
+    return command
+
+
+def extract_audio(video_input: VideoInput, detector: SilenceDetector, audio_format: str, channels: int, estimated_bytes: int, deadline: Deadline | None = None) -> bytes | None:
+    """
+    解码第一个音频流：边读取 PCM 边交给 detector 分析，audio_format 不为 none 时返回编码后的音频文件。
+    失败时抛出 AudioExtractionError。
+    """
+    output = OutputFile(estimated_bytes, f".{_AUDIO_EXTENSIONS[audio_format]}", "ffmpeg_tools_audio") if audio_format != AUDIO_FORMAT_NONE else None
+    try:
+        command = build_audio_command(video_input.path, detector.sample_rate, channels, audio_format, output.path if output is not None else None)
+        run_kwargs = output.run_kwargs(video_input.run_kwargs()) if output is not None else video_input.run_kwargs()
+
+        with ProcessStream(command, deadline=deadline, stage="ffmpeg_audio", **run_kwargs) as stream:
+            for chunk in stream.chunks():
+                detector.feed(chunk)
+            result = stream.finish()
+        detector.finish()
+
+        if result.returncode != 0:
+            raise AudioExtractionError(result.stderr.decode('utf-8', errors='replace'))
+        if detector.total_samples == 0:
+            raise AudioExtractionError("ffmpeg produced no audio samples")
+
+        if output is None:
+            return None
+        with deadline_stage(deadline, "readback"):
+            audio_data = output.read()
+    finally:
+        if output is not None:
+            output.close()
+
+    if len(audio_data) >= AUDIO_MAX_BYTES:
+        raise AudioExtractionError(f"Audio reached the size limit of {AUDIO_MAX_BYTES / (1024 * 1024):.1f} MB; use opus or output_format none")
+    return audio_data
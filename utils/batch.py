@@ -0,0 +1,190 @@
+import queue
+import threading
+from collections import deque
+from collections.abc import Callable, Generator
+
+from dify_plugin.entities.tool import ToolInvokeMessage
+
+from utils.cache import content_hash
+from utils.config import env_int
+from utils.process import Deadline
+from utils.resources import BASE_MEMORY_BYTES, MEMORY_LIMIT_BYTES, available_cpus
+from utils.timing import StageTimer
+from utils.video_input import estimate_input_memory
+
+
+# 一次批量调用最多处理的文件数
+BATCH_MAX_FILES = env_int("FFMPEG_TOOLS_BATCH_MAX_FILES", 50)
+# 同时处理的文件数，0 表示按可用 CPU 和插件内存上限计算
+BATCH_CONCURRENCY = env_int("FFMPEG_TOOLS_BATCH_CONCURRENCY", 0)
+
+# 工作线程结束一个任务时放入队列的标记
+_TASK_DONE = object()
+
+
+def get_batch_files(tool_parameters: dict) -> list | None:
+    """返回 videos 参数中的文件列表（同时提供 video 时排在最前面）；没有 videos 时返回 None，按单文件处理"""
+    videos = tool_parameters.get('videos')
+    if not videos:
+        return None
+    files = list(videos) if isinstance(videos, (list, tuple)) else [videos]
+    if tool_parameters.get('video'):
+        files.insert(0, tool_parameters['video'])
+    return files
+
+
+def plan_batch_concurrency(blob_sizes: list[int], file_memory: int) -> int:
+    """
+    同时处理的文件数：不超过可用 CPU，且所有上传内容（已在内存中）、
+    并发文件的输入副本和 file_memory（单个文件处理时的子进程内存估计）之和不超过插件内存上限。
+    """
+    if not blob_sizes:
+        return 1
+    if BATCH_CONCURRENCY > 0:
+        return max(1, min(BATCH_CONCURRENCY, len(blob_sizes)))
+
+    available_memory = MEMORY_LIMIT_BYTES - BASE_MEMORY_BYTES - sum(blob_sizes)
+    per_file_memory = estimate_input_memory(max(blob_sizes)) + file_memory
+    memory_workers = max(1, available_memory // per_file_memory)
+
+    return max(1, min(available_cpus(), memory_workers, len(blob_sizes)))
+
+
+def run_concurrently(tasks: list, worker: Callable[[object], Generator], concurrency: int) -> Generator[tuple[object, object], None, None]:
+    """
+    在最多 concurrency 个线程中对每个任务运行生成器 worker(task)，按到达顺序产出 (任务, 消息)。
+    worker 抛出的异常作为消息产出；每个任务结束时产出 (任务, None)。
+    调用方提前关闭时不再领取新任务，正在运行的 worker 在产出下一条消息时停止。
+    """
+    pending = deque(tasks)
+    pending_lock = threading.Lock()
+    stopped = threading.Event()
+    # 有界队列：调用方消费较慢时 worker 等待，避免帧数据在内存中堆积
+    results = queue.Queue(maxsize=max(1, concurrency) * 4)
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run_worker() -> None:
+        while not stopped.is_set():
+            with pending_lock:
+                if not pending:
+                    return
+                task = pending.popleft()
+            generator = worker(task)
+            try:
+                for message in generator:
+                    if not put((task, message)):
+                        break
+            except Exception as worker_error:
+                put((task, worker_error))
+            finally:
+                generator.close()
+                put((task, _TASK_DONE))
+
+    threads = [threading.Thread(target=run_worker, daemon=True) for _ in range(max(1, min(concurrency, len(tasks))))]
+    for thread in threads:
+        thread.start()
+
+    remaining = len(tasks)
+    try:
+        while remaining:
+            task, message = results.get()
+            if message is _TASK_DONE:
+                remaining -= 1
+                yield task, None
+            else:
+                yield task, message
+    finally:
+        stopped.set()
+        for thread in threads:
+            thread.join()
+
+
+def invoke_batch(tool, files: list, invoke_file: Callable[[object, Deadline, str], Generator], file_memory: int) -> Generator[ToolInvokeMessage, None, None]:
+    """
+    批量处理多个文件：内容相同的文件只处理一次，其余文件并发运行 invoke_file(文件, 批量预算, 内容哈希)，
+    invoke_file 通过 Deadline.child() 使用同一个时间预算。单个文件的图片消息直接转发（meta 中附带 video_index），
+    文本消息只保留每个文件完成时的一条进度，最后返回一个合并的 JSON，每个文件对应一个结果或错误。
+    """
+    if len(files) > BATCH_MAX_FILES:
+        error_msg = f"Too many videos: {len(files)}. At most {BATCH_MAX_FILES} videos can be processed in one call"
+        yield tool.create_text_message(error_msg)
+        yield tool.create_json_message({
+            "status": "error",
+            "message": error_msg
+        })
+        return
+
+    timer = StageTimer()
+    # 整个批量调用共享的时间预算，每个文件使用它的子预算
+    deadline = Deadline()
+
+    # 按内容分组，重复上传的文件直接复用第一个文件的结果
+    with timer.stage("hash"):
+        video_hashes = [content_hash(video_file.blob) for video_file in files]
+    first_index_by_hash = {}
+    for index, video_hash in enumerate(video_hashes):
+        first_index_by_hash.setdefault(video_hash, index)
+    unique_indexes = sorted(first_index_by_hash.values())
+
+    concurrency = plan_batch_concurrency([len(files[index].blob) for index in unique_indexes], file_memory)
+    yield tool.create_text_message(f"Processing {len(files)} videos ({len(unique_indexes)} unique, {concurrency} at a time)...")
+
+    def process_file(index: int) -> Generator:
+        return invoke_file(files[index], deadline, video_hashes[index])
+
+    file_results = {}
+    completed = 0
+    batch_messages = run_concurrently(unique_indexes, process_file, concurrency)
+    try:
+        for index, message in batch_messages:
+            if message is None:
+                completed += 1
+                file_result = file_results.setdefault(index, {"status": "error", "message": "No result returned"})
+                yield tool.create_text_message(f"[{completed}/{len(unique_indexes)}] {files[index].filename}: {file_result.get('status')}")
+            elif isinstance(message, Exception):
+                file_results[index] = {"status": "error", "message": f"Error processing video file: {str(message)}"}
+            elif message.type == ToolInvokeMessage.MessageType.JSON:
+                file_results[index] = message.message.json_object
+            elif message.type == ToolInvokeMessage.MessageType.BLOB:
+                message.meta = {**(message.meta or {}), "video_index": index, "video_filename": files[index].filename}
+                with timer.stage("message_yield"):
+                    yield message
+    finally:
+        # 先结束所有子进程，再等待工作线程退出
+        deadline.cancel()
+        batch_messages.close()
+
+    results = []
+    for index, video_file in enumerate(files):
+        first_index = first_index_by_hash[video_hashes[index]]
+        result = {**file_results[first_index], "index": index, "filename": video_file.filename}
+        if first_index != index:
+            result["duplicate_of"] = first_index
+        results.append(result)
+
+    succeeded = sum(1 for result in results if result.get("status") == "success")
+    if succeeded == len(results):
+        status = "success"
+    elif succeeded == 0:
+        status = "error"
+    else:
+        status = "partial"
+
+    yield tool.create_json_message({
+        "status": status,
+        "message": f"Processed {len(results)} videos: {succeeded} succeeded, {len(results) - succeeded} failed",
+        "count": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "concurrency": concurrency,
+        "results": results,
+        "timings": timer.to_dict()
+    })
@@ -0,0 +1,122 @@
+from collections import OrderedDict
+import hashlib
+import os
+import tempfile
+import threading
+
+from utils.config import env_str
+
+
+# 可选的磁盘缓存目录，为空时只使用内存缓存
+CACHE_DIR = env_str("FFMPEG_TOOLS_CACHE_DIR")
+
+
+def content_hash(data: bytes) -> str:
+    """按内容计算视频的缓存键"""
+    return hashlib.sha256(data).hexdigest()
+
+
+class LRUCache:
+    """按条目数和总字节数限制的内存 LRU 缓存"""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: bytes) -> None:
+        if self.max_entries <= 0 or len(value) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._total_bytes -= len(previous)
+            self._entries[key] = value
+            self._total_bytes += len(value)
+            while len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= len(evicted)
+
+
+class DiskCache:
+    """按条目数和总字节数限制的磁盘缓存，按文件修改时间淘汰"""
+
+    def __init__(self, directory: str, max_entries: int, max_bytes: int):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def get(self, key: str) -> bytes | None:
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as cache_file:
+                value = cache_file.read()
+            # 更新修改时间，作为最近使用时间
+            os.utime(path)
+            return value
+        except OSError:
+            return None
+
+    def put(self, key: str, value: bytes) -> None:
+        if self.max_entries <= 0 or len(value) > self.max_bytes:
+            return
+        with self._lock:
+            try:
+                # 先写入临时文件再替换，避免读到不完整的数据
+                with tempfile.NamedTemporaryFile(dir=self.directory, delete=False, suffix='.tmp') as temp_file:
+                    temp_file.write(value)
+                os.replace(temp_file.name, self._path(key))
+                self._evict()
+            except OSError:
+                pass
+
+    def _evict(self) -> None:
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        total_bytes = sum(size for _, size, _ in entries)
+        while entries and (len(entries) > self.max_entries or total_bytes > self.max_bytes):
+            _, size, path = entries.pop(0)
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total_bytes -= size
+
+
+class TieredCache:
+    """内存 LRU 缓存，配置了 FFMPEG_TOOLS_CACHE_DIR 时再加一层磁盘缓存"""
+
+    def __init__(self, namespace: str, max_entries: int, max_bytes: int, disk_max_entries: int, disk_max_bytes: int):
+        self.memory = LRUCache(max_entries, max_bytes)
+        self.disk = DiskCache(os.path.join(CACHE_DIR, namespace), disk_max_entries, disk_max_bytes) if CACHE_DIR else None
+
+    def get(self, key: str) -> bytes | None:
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.put(key, value)
+        return value
+
+    def put(self, key: str, value: bytes) -> None:
+        self.memory.put(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
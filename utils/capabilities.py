@@ -0,0 +1,148 @@
+import json
+import os
+import re
+import shutil
+import threading
+
+from utils.cache import TieredCache, content_hash
+from utils.process import ProcessTimeoutError, run_process
+
+
+class CapabilityError(Exception):
+    pass
+
+
+# -filters / -encoders / -decoders 的条目形如: " TSC scale  V->V  ..." 或 " V....D mjpeg  ..."
+_ENTRY_PATTERN = re.compile(r"^ ([A-Z.|]{3,6}) +([\w-]+) ")
+_VERSION_PATTERN = re.compile(r"version\s+n?(\d+)\.(\d+)")
+
+# 能力探测结果缓存，键为二进制文件的路径、修改时间和大小，升级 ffmpeg 后自动失效
+_capability_cache = TieredCache(
+    "capabilities",
+    max_entries=4,
+    max_bytes=4 * 1024 * 1024,
+    disk_max_entries=8,
+    disk_max_bytes=8 * 1024 * 1024,
+)
+# 进程内已解析的结果，避免每次调用都反序列化
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+class FfmpegCapabilities:
+    """已安装的 ffmpeg 支持的滤镜、编码器和解码器"""
+
+    def __init__(self, path: str, version: str, filters: set[str], encoders: set[str], decoders: set[str]):
+        self.path = path
+        self.version = version
+        self.filters = filters
+        self.encoders = encoders
+        self.decoders = decoders
+
+    @property
+    def major_version(self) -> int | None:
+        match = _VERSION_PATTERN.search(self.version)
+        return int(match.group(1)) if match else None
+
+    def has_filter(self, name: str) -> bool:
+        return name in self.filters
+
+    def has_encoder(self, name: str) -> bool:
+        return name in self.encoders
+
+    def has_decoder(self, name: str) -> bool:
+        return name in self.decoders
+
+    def missing(self, filters: list[str] = (), encoders: list[str] = (), decoders: list[str] = ()) -> list[str]:
+        """返回不受支持的滤镜 / 编码器 / 解码器，全部支持时为空列表"""
+        return (
+            [f"filter {name}" for name in filters if name not in self.filters]
+            + [f"encoder {name}" for name in encoders if name not in self.encoders]
+            + [f"decoder {name}" for name in decoders if name not in self.decoders]
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "path": self.path,
+            "version": self.version,
+            "filters": sorted(self.filters),
+            "encoders": sorted(self.encoders),
+            "decoders": sorted(self.decoders),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "FfmpegCapabilities":
+        return cls(data["path"], data["version"], set(data["filters"]), set(data["encoders"]), set(data["decoders"]))
+
+
+def parse_entries(output: str) -> set[str]:
+    names = set()
+    for line in output.splitlines():
+        match = _ENTRY_PATTERN.match(line)
+        if match:
+            names.add(match.group(2))
+    return names
+
+
+def _run_listing(path: str, option: str) -> str:
+    try:
+        result = run_process([path, '-hide_banner', option], timeout=10)
+    except (OSError, ProcessTimeoutError) as run_error:
+        raise CapabilityError(f"Failed to run {os.path.basename(path)} {option}: {str(run_error)}")
+    if result.returncode != 0:
+        raise CapabilityError(result.stderr.decode('utf-8', errors='replace'))
+    return result.stdout.decode('utf-8', errors='replace')
+
+
+def _binary_key(path: str) -> str:
+    binary_stat = os.stat(path)
+    return content_hash(f"{path}\0{binary_stat.st_mtime_ns}\0{binary_stat.st_size}".encode('utf-8'))
+
+
+def get_capabilities(binary: str = 'ffmpeg') -> FfmpegCapabilities:
+    """
+    运行 -version / -filters / -decoders / -encoders 并缓存结果（进程内存和磁盘）。
+    同一个二进制文件只探测一次；找不到或无法运行时抛出 CapabilityError。
+    """
+    located = shutil.which(binary)
+    if located is None:
+        raise CapabilityError(f"{binary} is not installed")
+    path = os.path.realpath(located)
+    cache_key = _binary_key(path)
+
+    # 加锁避免并发的首次调用重复探测
+    with _registry_lock:
+        if cache_key in _registry:
+            return _registry[cache_key]
+
+        cached = _capability_cache.get(cache_key)
+        if cached is not None:
+            _registry[cache_key] = FfmpegCapabilities.from_dict(json.loads(cached))
+            return _registry[cache_key]
+
+        version_output = _run_listing(path, '-version')
+        capabilities = FfmpegCapabilities(
+            path,
+            version_output.splitlines()[0] if version_output else "",
+            parse_entries(_run_listing(path, '-filters')),
+            parse_entries(_run_listing(path, '-encoders')),
+            parse_entries(_run_listing(path, '-decoders')),
+        )
+        _capability_cache.put(cache_key, json.dumps(capabilities.to_dict()).encode('utf-8'))
+        _registry[cache_key] = capabilities
+        return capabilities
+
+
+def check_support(filters: list[str] = (), encoders: list[str] = (), decoders: list[str] = ()) -> None:
+    """在启动解码之前检查所需的滤镜和编解码器，不支持时抛出 CapabilityError"""
+    missing = get_capabilities().missing(filters, encoders, decoders)
+    if missing:
+        raise CapabilityError(f"The installed ffmpeg does not support: {', '.join(missing)}")
+
+
+def warm_capabilities() -> None:
+    """插件启动时探测一次，失败时留给工具调用和凭据校验报告"""
+    try:
+        get_capabilities('ffmpeg')
+    except CapabilityError:
+        pass
@@ -0,0 +1,145 @@
+from utils.capabilities import get_capabilities, CapabilityError
+from utils.config import env_int
+from utils.process import Deadline, deadline_stage, run_process
+from utils.video_input import VideoInput, OutputFile
+
+
+class ClipExtractionError(Exception):
+    pass
+
+
+# 剪辑模式:
+#   copy     - 输入端定位到起点之前的关键帧，直接复制压缩数据（-c copy），耗时取决于复制的字节数，不解码
+#   accurate - 从精确的起点解码并重新编码，起止时间精确到帧
+CLIP_MODE_COPY = "copy"
+CLIP_MODE_ACCURATE = "accurate"
+CLIP_MODES = [CLIP_MODE_COPY, CLIP_MODE_ACCURATE]
+DEFAULT_CLIP_MODE = CLIP_MODE_COPY
+
+# 输出容器，auto 表示 MP4 系列输入输出 MP4，其他输入输出 Matroska（可容纳几乎所有编码）
+CLIP_FORMAT_AUTO = "auto"
+CLIP_FORMAT_MP4 = "mp4"
+CLIP_FORMAT_MKV = "mkv"
+CLIP_FORMATS = [CLIP_FORMAT_AUTO, CLIP_FORMAT_MP4, CLIP_FORMAT_MKV]
+
+_MUXERS = {CLIP_FORMAT_MP4: "mp4", CLIP_FORMAT_MKV: "matroska"}
+_MIME_TYPES = {CLIP_FORMAT_MP4: "video/mp4", CLIP_FORMAT_MKV: "video/x-matroska"}
+
+# 单个片段的最大字节数，超出时在启动 ffmpeg 之前拒绝；ffmpeg 也会在写到该大小时停止
+CLIP_MAX_BYTES = env_int("FFMPEG_TOOLS_CLIP_MAX_BYTES", 64 * 1024 * 1024)
+
+# accurate 模式按顺序选择已安装的第一个视频编码器
+_VIDEO_ENCODER_ARGS = {
+    'libx264': ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '20'],
+    'mpeg4': ['-c:v', 'mpeg4', '-q:v', '3'],
+}
+_AUDIO_ENCODER = 'aac'
+
+
+def resolve_clip_format(clip_format: str, video_metadata: dict) -> str:
+    if clip_format != CLIP_FORMAT_AUTO:
+        return clip_format
+    format_name = video_metadata.get("format", {}).get("format_name", "")
+    return CLIP_FORMAT_MP4 if "mp4" in format_name.split(',') or "mov" in format_name.split(',') else CLIP_FORMAT_MKV
+
+
+def get_clip_mime_type(clip_format: str) -> str:
+    return _MIME_TYPES[clip_format]
+
+
+def select_video_encoder() -> str:
+    """accurate 模式使用的视频编码器，都不支持时抛出 CapabilityError"""
+    capabilities = get_capabilities()
+    for encoder in _VIDEO_ENCODER_ARGS:
+        if capabilities.has_encoder(encoder):
+            return encoder
+    raise CapabilityError(f"The installed ffmpeg does not support: {' or '.join(_VIDEO_ENCODER_ARGS)}")
+
+
+def required_encoders(clip_mode: str) -> list[str]:
+    return [_AUDIO_ENCODER] if clip_mode == CLIP_MODE_ACCURATE else []
+
+
+def estimate_clip_bytes(blob_size: int, duration: float, clip_duration: float) -> int:
+    """按平均码率估计片段大小"""
+    if duration <= 0:
+        return blob_size
+    return min(blob_size, int(blob_size * clip_duration / duration)) + 64 * 1024
+
+
+def find_keyframe_before(video_input: VideoInput, seek_time: float, deadline: Deadline | None = None) -> float | None:
+    """
+    用 ffprobe 定位到 seek_time 并只读取一个视频包，得到不晚于 seek_time 的关键帧时间。
+    ffprobe 失败或定位结果不可信（晚于 seek_time、不是关键帧）时返回 None。
+    """
+    if seek_time <= 0:
+        return 0.0
+    command = [
+        'ffprobe',
+        '-v', 'error',
+        '-read_intervals', f"{seek_time}%+#1",
+        '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags',
+        '-of', 'csv=p=0',
+        video_input.path
+    ]
+    result = run_process(command, deadline=deadline, stage="ffprobe_keyframe", **video_input.run_kwargs())
+    if result.returncode != 0:
+        return None
+    for line in result.stdout.decode('utf-8', errors='replace').splitlines():
+        fields = line.strip().split(',')
+        if len(fields) < 2:
+            continue
+        try:
+            keyframe_time = float(fields[0])
+        except ValueError:
+            return None
+        if not fields[1].startswith('K') or keyframe_time > seek_time:
+            return None
+        return max(0.0, keyframe_time)
+    return None
+
+
+def build_clip_command(input_path: str, start: float, duration: float, clip_mode: str, clip_format: str, output_path: str, video_encoder: str | None = None) -> list[str]:
+    """生成剪辑命令：输入端定位，输出时长 duration，最多使用第一个视频流和所有音频流"""
+    command = ['ffmpeg', '-hide_banner', '-v', 'error', '-y']
+    # 从头开始时不在输入端定位（管道输入无法定位）
+    if start > 0:
+        command += ['-ss', f"{start:.6f}"]
+    command += ['-i', input_path, '-t', f"{duration:.6f}", '-map', '0:v:0?', '-map', '0:a?']
+
+    if clip_mode == CLIP_MODE_COPY:
+        # 起点已对齐到关键帧，直接复制压缩数据；
+        # Matroska 等按 Cluster 定位的容器会从更早的位置开始读取，-copypriorss 0 丢弃起点之前的包
+        command += ['-c', 'copy', '-copypriorss', '0', '-avoid_negative_ts', 'make_zero']
+    else:
+        command += [*_VIDEO_ENCODER_ARGS[video_encoder], '-c:a', _AUDIO_ENCODER]
+
+    if clip_format == CLIP_FORMAT_MP4:
+        # moov 放在文件开头，返回的片段可以边下载边播放
+        command += ['-movflags', '+faststart']
+
+    command += ['-fs', str(CLIP_MAX_BYTES), '-f', _MUXERS[clip_format], output_path]
+    return command
+
+
+def extract_clip(video_input: VideoInput, start: float, duration: float, clip_mode: str, clip_format: str, estimated_bytes: int, deadline: Deadline | None = None) -> bytes:
+    """剪出 [start, start + duration] 的片段并返回容器数据，失败时抛出 ClipExtractionError"""
+    video_encoder = select_video_encoder() if clip_mode == CLIP_MODE_ACCURATE else None
+    output = OutputFile(estimated_bytes, f".{clip_format}", "ffmpeg_tools_clip")
+    try:
+        command = build_clip_command(video_input.path, start, duration, clip_mode, clip_format, output.path, video_encoder)
+        result = run_process(command, deadline=deadline, stage="ffmpeg_clip", **output.run_kwargs(video_input.run_kwargs()))
+        if result.returncode != 0:
+            raise ClipExtractionError(result.stderr.decode('utf-8', errors='replace'))
+
+        with deadline_stage(deadline, "readback"):
+            clip_data = output.read()
+    finally:
+        output.close()
+
+    if not clip_data:
+        raise ClipExtractionError("ffmpeg produced no clip data")
+    if len(clip_data) >= CLIP_MAX_BYTES:
+        raise ClipExtractionError(f"Clip reached the size limit of {CLIP_MAX_BYTES / (1024 * 1024):.1f} MB; choose a shorter range")
+    return clip_data
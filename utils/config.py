@@ -0,0 +1,25 @@
+import os
+
+
+def env_int(name: str, default: int) -> int:
+    """读取整数类型的环境变量，无效值时使用默认值"""
+    value = os.environ.get(name)
+    if value is None or not value.strip():
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+
+def env_str(name: str, default: str = "") -> str:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip()
+
+
+def env_choice(name: str, choices: list[str], default: str) -> str:
+    """读取取值限定在 choices 中的环境变量，忽略大小写，无效值时使用默认值"""
+    value = env_str(name).lower()
+    return value if value in choices else default
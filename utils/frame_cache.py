@@ -0,0 +1,74 @@
+import hashlib
+import json
+import threading
+
+from utils.cache import TieredCache
+from utils.config import env_int
+
+
+# 已编码帧缓存，键为 (视频哈希, 时间点, 定位策略, 编码参数)，编码参数见 utils.image_encoding
+_frame_cache = TieredCache(
+    "frames",
+    max_entries=env_int("FFMPEG_TOOLS_FRAME_CACHE_ENTRIES", 512),
+    max_bytes=env_int("FFMPEG_TOOLS_FRAME_CACHE_BYTES", 32 * 1024 * 1024),
+    disk_max_entries=env_int("FFMPEG_TOOLS_FRAME_DISK_CACHE_ENTRIES", 4096),
+    disk_max_bytes=env_int("FFMPEG_TOOLS_FRAME_DISK_CACHE_BYTES", 256 * 1024 * 1024),
+)
+
+# 实际选出的帧时间与关键帧索引中的时间相差不超过此值（秒）时视为同一关键帧：
+# showinfo 的时间只保留 6 位有效数字，且不含容器的起始时间偏移
+_KEYFRAME_TIME_TOLERANCE = 0.05
+
+_stats_lock = threading.Lock()
+_total_hits = 0
+_total_misses = 0
+
+
+def frame_cache_key(video_hash: str, seek_time: float, seek_mode: str, encode_params: dict) -> str:
+    key_source = f"{video_hash}:{seek_time:.6f}:{seek_mode}:{json.dumps(encode_params, sort_keys=True)}"
+    return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+
+def keyframe_cache_time(selected_time: float, keyframe_index=None) -> float:
+    """
+    fast 模式的缓存条目按实际选出的关键帧的时间（extract_single_frame / iter_frames 返回的 showinfo 时间）保存，
+    各工具查找时使用按各自规则从关键帧索引得到的关键帧时间，同一时间总是对应同一帧。
+    有关键帧索引时把选出的时间对齐到索引中的关键帧时间，否则保留到毫秒。
+    """
+    if keyframe_index is not None and len(keyframe_index) > 0:
+        keyframe_time = keyframe_index.nearest_keyframe(selected_time)
+        if abs(keyframe_time - selected_time) <= _KEYFRAME_TIME_TOLERANCE:
+            return keyframe_time
+    return round(selected_time, 3)
+
+
+class FrameCacheStats:
+    """单次请求的命中统计，同时累计到进程级别的统计"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> bytes | None:
+        global _total_hits, _total_misses
+        frame_data = _frame_cache.get(key)
+        with _stats_lock:
+            if frame_data is None:
+                self.misses += 1
+                _total_misses += 1
+            else:
+                self.hits += 1
+                _total_hits += 1
+        return frame_data
+
+    def put(self, key: str, frame_data: bytes) -> None:
+        _frame_cache.put(key, frame_data)
+
+    def to_dict(self) -> dict:
+        with _stats_lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "total_hits": _total_hits,
+                "total_misses": _total_misses,
+            }
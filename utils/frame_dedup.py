@@ -0,0 +1,82 @@
+import numpy as np
+
+from utils.process import Deadline, run_process
+
+
+class FrameDedupError(Exception):
+    pass
+
+
+# dHash 使用 9x8 灰度缩略图，相邻像素比较得到 64 位哈希
+HASH_WIDTH = 9
+HASH_HEIGHT = 8
+HASH_METHOD = "dhash"
+
+
+def grayscale_thumbnails(frames: list[bytes], pipe_format: str = 'image2pipe', deadline: Deadline | None = None) -> np.ndarray:
+    """
+    用一个 ffmpeg 进程把所有帧解码并缩小为 9x8 灰度图。
+    返回形状为 (帧数, 8, 9) 的 uint8 数组。
+    """
+    command = [
+        'ffmpeg',
+        '-hide_banner',
+        '-v', 'error',
+        '-f', pipe_format,
+        '-i', 'pipe:0',
+        '-vf', f"scale={HASH_WIDTH}:{HASH_HEIGHT}:flags=area,format=gray",
+        '-vsync', 'passthrough',
+        '-f', 'rawvideo',
+        'pipe:1'
+    ]
+
+    result = run_process(command, deadline=deadline, input=b''.join(frames), stage="ffmpeg_dedup")
+
+    if result.returncode != 0:
+        raise FrameDedupError(result.stderr.decode('utf-8', errors='replace'))
+
+    thumbnail_size = HASH_WIDTH * HASH_HEIGHT
+    if len(result.stdout) != thumbnail_size * len(frames):
+        raise FrameDedupError(f"Expected {len(frames)} thumbnails, got {len(result.stdout) / thumbnail_size:.1f}")
+
+    return np.frombuffer(result.stdout, dtype=np.uint8).reshape(len(frames), HASH_HEIGHT, HASH_WIDTH)
+
+
+def dhash(thumbnails: np.ndarray) -> np.ndarray:
+    """对 (N, 8, 9) 灰度图批量计算 dHash，返回 (N, 8) 的 uint8 数组（每行 64 位）"""
+    gradients = thumbnails[:, :, 1:] > thumbnails[:, :, :-1]
+    return np.packbits(gradients.reshape(len(thumbnails), -1), axis=1)
+
+
+def hamming_distance_matrix(hashes: np.ndarray) -> np.ndarray:
+    """两两之间的汉明距离，返回 (N, N) 数组"""
+    return np.unpackbits(np.bitwise_xor(hashes[:, None, :], hashes[None, :, :]), axis=2).sum(axis=2)
+
+
+def deduplicate(hashes: np.ndarray, threshold: int) -> tuple[list[int], list[tuple[int, int, int]]]:
+    """
+    依次与最后保留的帧比较，距离不超过阈值的帧视为重复。
+    返回保留的下标列表和 (被移除下标, 对应保留下标, 距离) 列表。
+    """
+    if len(hashes) == 0:
+        return [], []
+
+    # 帧数不超过 100，一次算出完整的距离矩阵，逐帧比较时只需查表
+    distances = hamming_distance_matrix(hashes)
+    kept_indexes = [0]
+    removed = []
+    for index in range(1, len(hashes)):
+        last_kept = kept_indexes[-1]
+        distance = int(distances[index, last_kept])
+        if distance <= threshold:
+            removed.append((index, last_kept, distance))
+        else:
+            kept_indexes.append(index)
+    return kept_indexes, removed
+
+
+def deduplicate_frames(frames: list[bytes], threshold: int, pipe_format: str = 'image2pipe', deadline: Deadline | None = None) -> tuple[list[int], list[tuple[int, int, int]]]:
+    """对帧数据去重，返回值同 deduplicate()，下标对应 frames"""
+    if len(frames) < 2:
+        return list(range(len(frames))), []
+    return deduplicate(dhash(grayscale_thumbnails(frames, pipe_format, deadline)), threshold)
@@ -0,0 +1,545 @@
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+import math
+import re
+
+from utils.config import env_choice, env_int
+from utils.image_encoding import DEFAULT_ENCODE_PARAMS, build_encode_args, build_scale_filter
+from utils.image_stream import create_stream_splitter, split_image_stream
+from utils.process import Deadline, ProcessStream, deadline_stage, run_process
+from utils.resources import (
+    BASE_MEMORY_BYTES, FRAME_BUFFER_LIMIT_BYTES, MEMORY_LIMIT_BYTES, available_cpus, estimate_decoder_memory, estimate_frame_bytes
+)
+from utils.video_input import VideoInput
+
+
+class FrameExtractionError(Exception):
+    pass
+
+
+# 定位策略:
+#   fast     - 在输入端定位到最近的关键帧，只解码关键帧
+#   accurate - 在输入端定位到关键帧后继续解码到精确的帧
+#   legacy   - 在输出端定位，从头开始解码（旧行为）
+SEEK_MODE_FAST = "fast"
+SEEK_MODE_ACCURATE = "accurate"
+SEEK_MODE_LEGACY = "legacy"
+SEEK_MODES = [SEEK_MODE_FAST, SEEK_MODE_ACCURATE, SEEK_MODE_LEGACY]
+DEFAULT_SEEK_MODE = SEEK_MODE_ACCURATE
+
+
+# 多帧提取策略:
+#   auto     - 默认单次解码，裸流或全帧内编码的视频以及单次解码失败时使用并行提取
+#   single   - 总是单次解码
+#   parallel - 总是把时间点分段交给多个 ffmpeg 进程并行提取
+EXTRACTION_STRATEGY_AUTO = "auto"
+EXTRACTION_STRATEGY_SINGLE = "single"
+EXTRACTION_STRATEGY_PARALLEL = "parallel"
+EXTRACTION_STRATEGIES = [EXTRACTION_STRATEGY_AUTO, EXTRACTION_STRATEGY_SINGLE, EXTRACTION_STRATEGY_PARALLEL]
+# 无法识别的取值按 auto 处理，不会因拼写错误静默地只使用单次解码
+EXTRACTION_STRATEGY = env_choice("FFMPEG_TOOLS_EXTRACTION_STRATEGY", EXTRACTION_STRATEGIES, EXTRACTION_STRATEGY_AUTO)
+
+# 并行提取的进程数，0 表示根据 CPU 和内存上限自动计算
+EXTRACTION_WORKERS = env_int("FFMPEG_TOOLS_EXTRACTION_WORKERS", 0)
+
+# 没有可靠时间戳的裸流格式，select 滤镜无法按时间选帧
+_RAW_STREAM_FORMATS = {'h264', 'hevc', 'mpegvideo', 'm4v', 'mjpeg', 'rawvideo', 'image2', 'image2pipe'}
+# 全帧内编码，每帧都是关键帧，逐段定位比完整解码更快
+_INTRA_ONLY_CODECS = {'mjpeg', 'prores', 'dnxhd', 'ffv1', 'rawvideo', 'png', 'huffyuv', 'utvideo'}
+
+
+# 选帧方式:
+#   interval  - 按 gap_time / count 计算的固定时间点
+#   keyframes - 只取关键帧（I 帧），按包标志在解复用阶段丢弃非关键帧，不做完整解码
+#   scene     - 使用 scene 滤镜的场景变化分数选帧
+SELECTION_MODE_INTERVAL = "interval"
+SELECTION_MODE_KEYFRAMES = "keyframes"
+SELECTION_MODE_SCENE = "scene"
+SELECTION_MODES = [SELECTION_MODE_INTERVAL, SELECTION_MODE_KEYFRAMES, SELECTION_MODE_SCENE]
+DEFAULT_SCENE_THRESHOLD = 0.3
+
+
+# 输出方式:
+#   frames        - 每帧一张图片
+#   contact_sheet - 用 tile 滤镜把多帧拼成网格图
+OUTPUT_MODE_FRAMES = "frames"
+OUTPUT_MODE_CONTACT_SHEET = "contact_sheet"
+OUTPUT_MODES = [OUTPUT_MODE_FRAMES, OUTPUT_MODE_CONTACT_SHEET]
+
+
+# showinfo 输出形如: [Parsed_showinfo_1 @ 0x...] n:   0 pts:  25600 pts_time:1 ...
+_SHOWINFO_PATTERN = re.compile(r"Parsed_showinfo.*?\bn:\s*(\d+).*?\bpts_time:\s*(-?[\d.]+)")
+
+
+def required_filters(selection_mode: str, output_mode: str, encode_params: dict = DEFAULT_ENCODE_PARAMS) -> list[str]:
+    """给定选帧方式和输出方式需要的 ffmpeg 滤镜，用于在解码前检查能力"""
+    filters = ['select', 'showinfo']
+    if output_mode == OUTPUT_MODE_CONTACT_SHEET:
+        filters += ['scale', 'tile']
+    elif build_scale_filter(encode_params):
+        filters.append('scale')
+    return filters
+
+
+def build_input_args(input_path: str, seek_time: float, seek_mode: str) -> list[str]:
+    """根据定位策略生成 -ss / -i 参数"""
+    if seek_mode == SEEK_MODE_LEGACY:
+        return ['-i', input_path, '-ss', str(seek_time)]
+    # 从头开始时不在输入端定位：管道输入无法定位，MP4 解复用器在 stdin 上执行 -ss 0 会读到截断的数据
+    if seek_time <= 0:
+        return ['-i', input_path]
+    if seek_mode == SEEK_MODE_FAST:
+        return ['-ss', str(seek_time), '-noaccurate_seek', '-i', input_path]
+    return ['-ss', str(seek_time), '-i', input_path]
+
+
+def build_output_args(encode_params: dict = DEFAULT_ENCODE_PARAMS) -> list[str]:
+    """帧编码后写到 stdout，不经过中间文件"""
+    return build_encode_args(encode_params)
+
+
+def build_filter_chain(filters: list[str], encode_params: dict = DEFAULT_ENCODE_PARAMS) -> str:
+    """在选帧滤镜之后追加缩放滤镜，只对选中的帧缩放"""
+    scale_filter = build_scale_filter(encode_params)
+    if scale_filter:
+        filters = [*filters, scale_filter]
+    return ','.join(filters)
+
+
+def build_select_expression(seek_times: list[float], include_first: bool = False) -> str:
+    """为每个时间点选出第一帧 t >= seek_time 的画面"""
+    terms = [
+        f"gte(t,{seek_time:.6f})*(isnan(prev_pts)+lt(prev_pts*TB,{seek_time:.6f}))"
+        for seek_time in sorted(set(seek_times))
+    ]
+    if include_first:
+        terms.append("isnan(prev_pts)")
+    return f"gt({'+'.join(terms)},0)"
+
+
+def parse_selected_times(ffmpeg_stderr: str) -> list[float]:
+    selected_times = []
+    for line in ffmpeg_stderr.splitlines():
+        match = _SHOWINFO_PATTERN.search(line)
+        if match:
+            selected_times.append(float(match.group(2)))
+    return selected_times
+
+
+def _showinfo_collector(selected_times: list[float], frame_count_target):
+    """返回供 ProcessStream.wait_for_stderr 使用的判断函数，增量解析 showinfo 行直到时间点数量达到目标"""
+    line_cursor = 0
+
+    def collect(stderr_lines: list[str]) -> bool:
+        nonlocal line_cursor
+        for line in stderr_lines[line_cursor:]:
+            match = _SHOWINFO_PATTERN.search(line)
+            if match:
+                selected_times.append(float(match.group(2)))
+        line_cursor = len(stderr_lines)
+        return len(selected_times) >= frame_count_target()
+
+    return collect
+
+
+def iter_stream_frames(stream: ProcessStream, output_format: str) -> Iterator[tuple[float, bytes]]:
+    """
+    逐块读取 ffmpeg 的 stdout，每帧完整后立即产出 (showinfo 中的时间点, 图片数据)。
+    showinfo 在帧进入编码器之前输出，等待对应的 stderr 行只需很短的时间。
+    """
+    splitter = create_stream_splitter(output_format)
+    selected_times = []
+    frame_count = 0
+    collect = _showinfo_collector(selected_times, lambda: frame_count)
+    for chunk in stream.chunks():
+        for frame_data in splitter.feed(chunk):
+            frame_count += 1
+            if not stream.wait_for_stderr(collect):
+                return
+            yield selected_times[frame_count - 1], frame_data
+
+
+def map_seek_times(seek_times: list[float], selected_times: list[float], nearest: bool = False) -> list[int | None]:
+    """把每个请求的时间点映射到已选出帧的下标，找不到时为 None"""
+    mapping = []
+    for seek_time in seek_times:
+        if nearest:
+            # 关键帧模式下取距离最近的帧
+            if selected_times:
+                mapping.append(min(range(len(selected_times)), key=lambda index: abs(selected_times[index] - seek_time)))
+            else:
+                mapping.append(None)
+            continue
+        frame_index = None
+        for index, selected_time in enumerate(selected_times):
+            # 允许少量浮点误差
+            if selected_time >= seek_time - 1e-3:
+                frame_index = index
+                break
+        mapping.append(frame_index)
+    return mapping
+
+
+def build_interval_selection(video_input: VideoInput, seek_times: list[float], seek_mode: str) -> tuple[list[str], str, float]:
+    """
+    按时间点选帧时的输入参数和 select 表达式。
+    legacy 从头解码；其余模式先在输入端定位到第一个时间点，滤镜中的时间相应平移。
+    返回 (输入参数, select 表达式, 平移的起始时间)。
+    """
+    start_time = 0 if seek_mode == SEEK_MODE_LEGACY else min(seek_times)
+    relative_seek_times = [seek_time - start_time for seek_time in seek_times]
+
+    if seek_mode == SEEK_MODE_LEGACY:
+        input_args = ['-i', video_input.path]
+    elif seek_mode == SEEK_MODE_FAST:
+        # 只解码关键帧
+        input_args = ['-skip_frame', 'nokey', '-ss', str(start_time), '-noaccurate_seek', '-i', video_input.path]
+    else:
+        input_args = ['-ss', str(start_time), '-i', video_input.path]
+
+    select_expression = build_select_expression(relative_seek_times, include_first=seek_mode == SEEK_MODE_FAST)
+    return input_args, select_expression, start_time
+
+
+def interval_frame_limit(seek_times: list[float], seek_mode: str) -> int:
+    """按时间点选帧时输出的最大帧数：每个时间点一帧，快速模式另选第一帧"""
+    return len(set(seek_times)) + (1 if seek_mode == SEEK_MODE_FAST else 0)
+
+
+def build_mode_selection(video_input: VideoInput, selection_mode: str, max_count: int, duration: float, scene_threshold: float) -> tuple[list[str], str]:
+    """按关键帧或场景变化选帧时的输入参数和 select 表达式"""
+    if selection_mode == SELECTION_MODE_KEYFRAMES:
+        # 关键帧之间至少间隔 duration / max_count，使结果均匀分布在整个视频中
+        min_gap = duration / max_count if duration > 0 else 0
+        input_args = ['-discard', 'nokey', '-skip_frame', 'nokey', '-i', video_input.path]
+        select_expression = f"isnan(prev_selected_t)+gte(t-prev_selected_t,{min_gap:.6f})"
+    elif selection_mode == SELECTION_MODE_SCENE:
+        # 第一帧总是保留，其后只保留场景变化分数超过阈值的帧
+        input_args = ['-i', video_input.path]
+        select_expression = f"isnan(prev_selected_t)+gt(scene,{scene_threshold:.6f})"
+    else:
+        raise FrameExtractionError(f"Unsupported selection mode: {selection_mode}")
+    return input_args, select_expression
+
+
+def extract_frames(video_input: VideoInput, seek_times: list[float], seek_mode: str = DEFAULT_SEEK_MODE, encode_params: dict = DEFAULT_ENCODE_PARAMS, deadline: Deadline | None = None) -> list[tuple[float, bytes] | None]:
+    """
+    在一次 ffmpeg 解码过程中提取所有时间点的帧。
+    返回与 seek_times 顺序一致的 (选出的帧的时间点, 图片数据) 列表，未能提取的时间点为 None。
+    """
+    if not seek_times:
+        return []
+
+    input_args, select_expression, start_time = build_interval_selection(video_input, seek_times, seek_mode)
+    relative_seek_times = [seek_time - start_time for seek_time in seek_times]
+
+    command = [
+        'ffmpeg',
+        '-hide_banner',
+        *input_args,
+        '-vf', build_filter_chain([f"select='{select_expression}'", 'showinfo'], encode_params),
+        # passthrough：fast 模式下定位点之前的关键帧时间为负，vfr 会在输出端丢弃它，图片与 showinfo 的时间不再一一对应
+        '-vsync', 'passthrough',
+        '-frames:v', str(interval_frame_limit(seek_times, seek_mode)),
+        *build_output_args(encode_params)
+    ]
+
+    result = run_process(command, deadline=deadline, stage="ffmpeg_extract", **video_input.run_kwargs())
+    ffmpeg_stderr = result.stderr.decode('utf-8', errors='replace')
+
+    if result.returncode != 0:
+        raise FrameExtractionError(ffmpeg_stderr)
+
+    # 按图片格式的结构切分 stdout 中的连续帧
+    with deadline_stage(deadline, "readback"):
+        frame_buffers = split_image_stream(result.stdout, encode_params["format"])
+        selected_times = parse_selected_times(ffmpeg_stderr)
+    frame_mapping = map_seek_times(relative_seek_times, selected_times, nearest=seek_mode == SEEK_MODE_FAST)
+
+    return [
+        (start_time + selected_times[frame_index], frame_buffers[frame_index]) if frame_index is not None and frame_index < len(frame_buffers) else None
+        for frame_index in frame_mapping
+    ]
+
+
+def map_stream_frames(seek_times: list[float], frames: Iterator[tuple[float, bytes]], nearest: bool = False) -> Iterator[tuple[float, bytes] | None]:
+    """
+    把按时间顺序到达的 (时间点, 图片数据) 对应到升序的 seek_times，按 seek_times 顺序逐个产出对应的 (时间点, 图片数据)。
+    与 map_seek_times 的规则一致：取第一帧 t >= seek_time；nearest 时取距离最近的帧。
+    frames 结束后仍未对应到帧的时间点为 None，nearest 时为最后一帧。
+    """
+    # 下一个尚未对应到帧的时间点
+    pending = 0
+    previous_frame = None
+    for selected_time, frame_data in frames:
+        while pending < len(seek_times) and seek_times[pending] <= selected_time + 1e-3:
+            seek_time = seek_times[pending]
+            if nearest and previous_frame is not None and abs(seek_time - previous_frame[0]) <= abs(seek_time - selected_time):
+                yield previous_frame
+            else:
+                yield selected_time, frame_data
+            pending += 1
+        previous_frame = (selected_time, frame_data)
+
+    # 视频结束后仍未对应到帧的时间点
+    for _ in range(pending, len(seek_times)):
+        yield previous_frame if nearest else None
+
+
+def _iter_command_frames(command: list[str], stage: str, video_input: VideoInput, encode_params: dict, deadline: Deadline | None) -> Iterator[tuple[float, bytes]]:
+    """运行 ffmpeg 并逐帧产出 (showinfo 中的时间点, 图片数据)；ffmpeg 失败时在已产出的帧之后抛出 FrameExtractionError"""
+    with ProcessStream(command, deadline=deadline, stage=stage, **video_input.run_kwargs()) as stream:
+        yield from iter_stream_frames(stream, encode_params["format"])
+
+        result = stream.finish()
+        if result.returncode != 0:
+            raise FrameExtractionError(result.stderr.decode('utf-8', errors='replace'))
+
+
+def iter_extract_frames(video_input: VideoInput, seek_times: list[float], seek_mode: str = DEFAULT_SEEK_MODE, encode_params: dict = DEFAULT_ENCODE_PARAMS, deadline: Deadline | None = None) -> Iterator[tuple[float, bytes] | None]:
+    """
+    与 extract_frames 相同的单次解码，但边解码边产出：
+    每个时间点对应的帧一旦完整即按 seek_times 顺序产出，无需等待整个视频解码完成。
+    seek_times 需按升序排列；ffmpeg 失败时在已产出的结果之后抛出 FrameExtractionError。
+    """
+    if not seek_times:
+        return
+
+    input_args, select_expression, start_time = build_interval_selection(video_input, seek_times, seek_mode)
+    relative_seek_times = [seek_time - start_time for seek_time in seek_times]
+
+    command = [
+        'ffmpeg',
+        '-hide_banner',
+        *input_args,
+        '-vf', build_filter_chain([f"select='{select_expression}'", 'showinfo'], encode_params),
+        # passthrough：fast 模式下定位点之前的关键帧时间为负，vfr 会在输出端丢弃它，图片与 showinfo 的时间不再一一对应
+        '-vsync', 'passthrough',
+        '-frames:v', str(interval_frame_limit(seek_times, seek_mode)),
+        *build_output_args(encode_params)
+    ]
+
+    frames = _iter_command_frames(command, "ffmpeg_extract", video_input, encode_params, deadline)
+    try:
+        for frame in map_stream_frames(relative_seek_times, frames, nearest=seek_mode == SEEK_MODE_FAST):
+            # showinfo 的时间从定位点开始，换算回请求的时间轴
+            yield (start_time + frame[0], frame[1]) if frame is not None else None
+    finally:
+        # 调用方提前结束时立即结束 ffmpeg
+        frames.close()
+
+
+def iter_selected_frames(video_input: VideoInput, selection_mode: str, max_count: int, duration: float, scene_threshold: float = DEFAULT_SCENE_THRESHOLD, encode_params: dict = DEFAULT_ENCODE_PARAMS, deadline: Deadline | None = None) -> Iterator[tuple[float, bytes]]:
+    """
+    一次遍历文件，按关键帧或场景变化选帧，最多产出 max_count 帧。
+    每帧编码完成后立即产出 (时间点, 图片数据)；ffmpeg 失败时抛出 FrameExtractionError。
+    """
+    input_args, select_expression = build_mode_selection(video_input, selection_mode, max_count, duration, scene_threshold)
+
+    command = [
+        'ffmpeg',
+        '-hide_banner',
+        *input_args,
+        '-vf', build_filter_chain([f"select='{select_expression}'", 'showinfo'], encode_params),
+        '-vsync', 'vfr',
+        '-frames:v', str(max_count),
+        *build_output_args(encode_params)
+    ]
+
+    yield from _iter_command_frames(command, "ffmpeg_select", video_input, encode_params, deadline)
+
+
+def extract_contact_sheets(video_input: VideoInput, input_args: list[str], select_expression: str, columns: int, rows: int, thumbnail_width: int, max_frames: int, encode_params: dict = DEFAULT_ENCODE_PARAMS, deadline: Deadline | None = None) -> tuple[list[bytes], list[float]]:
+    """
+    在同一次解码中把选中的帧缩小并用 tile 滤镜拼成网格图，网格图的尺寸由格子宽度决定。
+    返回 (网格图数据列表, 每个格子对应的时间点列表)，格子按行优先顺序排列。
+    """
+    # 用 selected_n 限制格子总数，最后一张未填满的网格图在输入结束时输出；
+    # -frames:v 在最后一张网格图填满时结束 ffmpeg，不再解码到文件结尾
+    command = [
+        'ffmpeg',
+        '-hide_banner',
+        *input_args,
+        '-vf', f"select='({select_expression})*lt(selected_n,{max_frames})',showinfo,scale={thumbnail_width}:-2,tile={columns}x{rows}:padding=2:color=black",
+        # passthrough：第一个格子是 fast 模式下定位点之前的关键帧时，网格图的时间为负，vfr 会丢弃整张网格图
+        '-vsync', 'passthrough',
+        '-frames:v', str(math.ceil(max_frames / (columns * rows))),
+        *build_output_args(encode_params)
+    ]
+
+    result = run_process(command, deadline=deadline, stage="ffmpeg_contact_sheet", **video_input.run_kwargs())
+    ffmpeg_stderr = result.stderr.decode('utf-8', errors='replace')
+
+    if result.returncode != 0:
+        raise FrameExtractionError(ffmpeg_stderr)
+
+    with deadline_stage(deadline, "readback"):
+        return split_image_stream(result.stdout, encode_params["format"]), parse_selected_times(ffmpeg_stderr)
+
+
+def build_sheet_index(cell_times: list[float], columns: int, rows: int, time_offset: float = 0) -> list[list[dict]]:
+    """按网格图分组，给出每个格子的行、列和时间点"""
+    cells_per_sheet = columns * rows
+    sheets = []
+    for cell_index, cell_time in enumerate(cell_times):
+        position = cell_index % cells_per_sheet
+        if position == 0:
+            sheets.append([])
+        sheets[-1].append({
+            "row": position // columns,
+            "column": position % columns,
+            "timestamp": cell_time + time_offset
+        })
+    return sheets
+
+
+def extract_single_frame(video_input: VideoInput, seek_time: float, seek_mode: str = DEFAULT_SEEK_MODE, encode_params: dict = DEFAULT_ENCODE_PARAMS, deadline: Deadline | None = None) -> tuple[float | None, bytes]:
+    """
+    提取单帧，返回 (选出的帧的时间点, 图片数据)，失败时抛出 FrameExtractionError。
+    只有 fast 模式报告时间点（定位到的关键帧），其余模式选出的就是请求的时间点，时间点为 None。
+    """
+    scale_filter = build_scale_filter(encode_params)
+    filters = [scale_filter] if scale_filter else []
+    if seek_mode == SEEK_MODE_FAST:
+        filters = ['showinfo', *filters]
+    command = [
+        'ffmpeg',
+        '-hide_banner',
+        *build_input_args(video_input.path, seek_time, seek_mode),
+        *(['-vf', ','.join(filters)] if filters else []),
+        '-frames:v', '1',
+        *build_output_args(encode_params)
+    ]
+
+    result = run_process(command, deadline=deadline, stage="ffmpeg_extract", **video_input.run_kwargs())
+
+    if result.returncode != 0:
+        raise FrameExtractionError(result.stderr.decode('utf-8', errors='replace'))
+
+    if not result.stdout:
+        raise FrameExtractionError("ffmpeg produced no frame data")
+
+    selected_time = None
+    if seek_mode == SEEK_MODE_FAST:
+        selected_times = parse_selected_times(result.stderr.decode('utf-8', errors='replace'))
+        if selected_times:
+            # 在输入端定位时 showinfo 的时间从定位点开始，从头开始时不定位
+            selected_time = max(seek_time, 0) + selected_times[0]
+    return selected_time, result.stdout
+
+
+def get_video_stream(video_metadata: dict) -> dict | None:
+    for stream_metadata in video_metadata.get("streams", []):
+        if stream_metadata.get("codec_type") == "video":
+            return stream_metadata
+    return None
+
+
+def prefers_parallel_extraction(video_metadata: dict) -> bool:
+    """单次解码的滤镜图不适用时返回 True"""
+    format_names = set(video_metadata.get("format", {}).get("format_name", "").split(','))
+    if format_names & _RAW_STREAM_FORMATS:
+        return True
+    video_stream = get_video_stream(video_metadata)
+    return bool(video_stream and video_stream.get("codec_name") in _INTRA_ONLY_CODECS)
+
+
+def plan_worker_count(video_metadata: dict, seek_count: int, blob_size: int) -> int:
+    """根据可用 CPU、插件内存上限和单个解码进程的内存估计计算并行进程数"""
+    if EXTRACTION_WORKERS > 0:
+        return max(1, min(EXTRACTION_WORKERS, seek_count))
+
+    video_stream = get_video_stream(video_metadata) or {}
+    worker_memory = estimate_decoder_memory(video_stream.get("width") or 0, video_stream.get("height") or 0)
+    # 插件基础内存、上传内容本身、输入副本和在途帧数据也占用内存
+    available_memory = MEMORY_LIMIT_BYTES - BASE_MEMORY_BYTES - blob_size * 2 - FRAME_BUFFER_LIMIT_BYTES
+    memory_workers = max(1, available_memory // worker_memory)
+
+    return max(1, min(available_cpus(), memory_workers, seek_count))
+
+
+def _split_contiguous(items: list, parts: int) -> list[list]:
+    chunk_size, remainder = divmod(len(items), parts)
+    chunks = []
+    start = 0
+    for part in range(parts):
+        end = start + chunk_size + (1 if part < remainder else 0)
+        if end > start:
+            chunks.append(items[start:end])
+        start = end
+    return chunks
+
+
+def _extract_frames_or_none(video_input: VideoInput, seek_times: list[float], seek_mode: str, encode_params: dict, deadline: Deadline | None) -> list[tuple[float, bytes] | None]:
+    try:
+        return extract_frames(video_input, seek_times, seek_mode, encode_params, deadline)
+    except FrameExtractionError:
+        return [None] * len(seek_times)
+
+
+def extract_frames_parallel(video_input: VideoInput, seek_times: list[float], seek_mode: str, workers: int, encode_params: dict = DEFAULT_ENCODE_PARAMS, deadline: Deadline | None = None, frame_bytes: int = 0) -> Iterator[tuple[float, bytes] | None]:
+    """
+    把时间点按顺序分成连续的区间，每个区间由一个 ffmpeg 进程提取。
+    按时间点顺序逐个产出结果，前面的区间完成后即可产出，无需等待全部完成。
+    frame_bytes 为单帧大小估计，用于把已完成但尚未产出的帧限制在 FRAME_BUFFER_LIMIT_BYTES 以内。
+    """
+    chunks = _split_contiguous(seek_times, max(1, min(workers, len(seek_times))))
+    executor = ThreadPoolExecutor(max_workers=len(chunks), thread_name_prefix="ffmpeg_frames")
+    try:
+        # 按顺序提交区间：在途帧数据超出上限时，等前面的区间产出后再提交，至少保持一个区间在运行
+        pending = deque()
+        buffered_bytes = 0
+        next_chunk = 0
+        while pending or next_chunk < len(chunks):
+            while next_chunk < len(chunks):
+                chunk_bytes = frame_bytes * len(chunks[next_chunk])
+                if pending and buffered_bytes + chunk_bytes > FRAME_BUFFER_LIMIT_BYTES:
+                    break
+                future = executor.submit(_extract_frames_or_none, video_input, chunks[next_chunk], seek_mode, encode_params, deadline)
+                pending.append((future, chunk_bytes))
+                buffered_bytes += chunk_bytes
+                next_chunk += 1
+            future, chunk_bytes = pending.popleft()
+            yield from future.result()
+            buffered_bytes -= chunk_bytes
+    finally:
+        # 调用方提前结束时取消尚未开始的区间，正在运行的进程由 Deadline.cancel() 结束
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_frames(video_input: VideoInput, seek_times: list[float], seek_mode: str, video_metadata: dict, blob_size: int, encode_params: dict = DEFAULT_ENCODE_PARAMS, deadline: Deadline | None = None) -> Iterator[tuple[float, bytes] | None]:
+    """
+    按 seek_times 顺序产出 (选出的帧的时间点, 图片数据)，未能提取的时间点为 None，根据提取策略选择单次解码或并行提取。
+    fast 模式下时间点是实际选出的关键帧的时间，可能与请求的时间点不同。
+    """
+    strategy = EXTRACTION_STRATEGY
+    if strategy == EXTRACTION_STRATEGY_AUTO and prefers_parallel_extraction(video_metadata):
+        strategy = EXTRACTION_STRATEGY_PARALLEL
+
+    workers = plan_worker_count(video_metadata, len(seek_times), blob_size)
+    video_stream = get_video_stream(video_metadata) or {}
+    frame_bytes = estimate_frame_bytes(video_stream.get("width") or 0, video_stream.get("height") or 0, encode_params)
+
+    if strategy == EXTRACTION_STRATEGY_PARALLEL and workers > 1:
+        yield from extract_frames_parallel(video_input, seek_times, seek_mode, workers, encode_params, deadline, frame_bytes)
+        return
+
+    if seek_times != sorted(seek_times):
+        yield from extract_frames(video_input, seek_times, seek_mode, encode_params, deadline)
+        return
+
+    # 单次解码边解码边产出，第一帧无需等待整个视频解码完成
+    produced_count = 0
+    try:
+        for frame in iter_extract_frames(video_input, seek_times, seek_mode, encode_params, deadline):
+            produced_count += 1
+            yield frame
+    except FrameExtractionError:
+        if strategy == EXTRACTION_STRATEGY_SINGLE or workers <= 1:
+            raise
+        # 单次解码失败时，对尚未产出的时间点回退到分段并行提取
+        remaining_seek_times = seek_times[produced_count:]
+        if not remaining_seek_times:
+            return
+        yield from extract_frames_parallel(video_input, remaining_seek_times, seek_mode, plan_worker_count(video_metadata, len(remaining_seek_times), blob_size), encode_params, deadline, frame_bytes)
@@ -0,0 +1,491 @@
+import struct
+from fractions import Fraction
+
+from utils.video_input import mp4_moov_before_mdat
+
+
+class HeaderParseError(Exception):
+    pass
+
+
+# 与 ffprobe 的 format_name 保持一致，结果可以与 ffprobe 的输出互换
+MP4_FORMAT_NAME = "mov,mp4,m4a,3gp,3g2,mj2"
+MATROSKA_FORMAT_NAME = "matroska,webm"
+
+# MP4 sample entry 类型 -> ffprobe codec_name，mp4a 需要再看 esds 中的 objectTypeIndication
+_MP4_CODECS = {
+    b'avc1': "h264", b'avc3': "h264",
+    b'hvc1': "hevc", b'hev1': "hevc",
+    b'mp4v': "mpeg4",
+    b'av01': "av1",
+    b'vp08': "vp8", b'vp09': "vp9",
+    b'jpeg': "mjpeg", b'mjpa': "mjpeg",
+    b'apcn': "prores", b'apch': "prores", b'apcs': "prores", b'apco': "prores", b'ap4h': "prores",
+    b's263': "h263", b'h263': "h263",
+    b'Opus': "opus",
+    b'fLaC': "flac",
+    b'ac-3': "ac3", b'ec-3': "eac3",
+    b'.mp3': "mp3",
+    b'alac': "alac",
+    b'sowt': "pcm_s16le", b'twos': "pcm_s16be",
+    b'tx3g': "mov_text",
+    b'wvtt': "webvtt",
+}
+# esds 中的 objectTypeIndication -> codec_name
+_MP4_OBJECT_TYPES = {0x40: "aac", 0x66: "aac", 0x67: "aac", 0x68: "aac", 0x69: "mp3", 0x6B: "mp3", 0x20: "mpeg4", 0x6C: "mjpeg"}
+_MP4_HANDLER_TYPES = {b'vide': "video", b'soun': "audio", b'text': "subtitle", b'sbtl': "subtitle", b'subt': "subtitle"}
+
+# Matroska CodecID -> codec_name
+_MATROSKA_CODECS = {
+    "V_MPEG4/ISO/AVC": "h264",
+    "V_MPEGH/ISO/HEVC": "hevc",
+    "V_MPEG4/ISO/SP": "mpeg4", "V_MPEG4/ISO/ASP": "mpeg4", "V_MPEG4/ISO/AP": "mpeg4",
+    "V_VP8": "vp8", "V_VP9": "vp9", "V_AV1": "av1",
+    "V_MJPEG": "mjpeg",
+    "V_PRORES": "prores",
+    "A_OPUS": "opus",
+    "A_VORBIS": "vorbis",
+    "A_FLAC": "flac",
+    "A_MPEG/L3": "mp3",
+    "A_AC3": "ac3", "A_EAC3": "eac3",
+    "A_PCM/INT/LIT": "pcm_s16le",
+    "S_TEXT/UTF8": "subrip",
+    "S_TEXT/ASS": "ass", "S_TEXT/SSA": "ass",
+    "S_TEXT/WEBVTT": "webvtt",
+}
+_MATROSKA_TRACK_TYPES = {1: "video", 2: "audio", 17: "subtitle"}
+
+_CHANNEL_LAYOUTS = {1: "mono", 2: "stereo", 6: "5.1"}
+
+# Matroska 元素 ID
+_EBML = 0x1A45DFA3
+_EBML_DOC_TYPE = 0x4282
+_SEGMENT = 0x18538067
+_INFO = 0x1549A966
+_TIMECODE_SCALE = 0x2AD7B1
+_DURATION = 0x4489
+_TRACKS = 0x1654AE6B
+_TRACK_ENTRY = 0xAE
+_TRACK_TYPE = 0x83
+_CODEC_ID = 0x86
+_DEFAULT_DURATION = 0x23E383
+_VIDEO = 0xE0
+_PIXEL_WIDTH = 0xB0
+_PIXEL_HEIGHT = 0xBA
+_DISPLAY_WIDTH = 0x54B0
+_DISPLAY_HEIGHT = 0x54BA
+_AUDIO = 0xE1
+_SAMPLING_FREQUENCY = 0xB5
+_CHANNELS = 0x9F
+_CLUSTER = 0x1F43B675
+# 只下载了一部分的文件中可以被截断的元素，其余元素（头部字段）被截断时读到的值不可信
+_TRUNCATABLE_ELEMENTS = {_SEGMENT, _CLUSTER}
+
+
+def probe_header(data: bytes) -> dict | None:
+    """
+    只读取容器头部（MP4 的 moov、Matroska 的 Info / Tracks）得到与 ffprobe -show_format -show_streams
+    结构相同的信息，不写磁盘也不启动进程。
+    不认识的容器、损坏的头部或缺少时长 / 分辨率 / 编码 / 帧率等信息时返回 None，由调用方回退到 ffprobe。
+    """
+    try:
+        if data[:4] == b'\x1a\x45\xdf\xa3':
+            return _probe_matroska(data)
+        if mp4_moov_before_mdat(data) is not None:
+            return _probe_mp4(data)
+    except (HeaderParseError, struct.error, IndexError, ValueError, ZeroDivisionError):
+        return None
+    return None
+
+
+def _format_duration(seconds: float) -> str:
+    return f"{seconds:.6f}"
+
+
+def _format_rate(rate: Fraction) -> str:
+    return f"{rate.numerator}/{rate.denominator}"
+
+
+def _aspect_ratio(width: int, height: int) -> str:
+    ratio = Fraction(width, height)
+    return f"{ratio.numerator}:{ratio.denominator}"
+
+
+def _build_stream(index: int, codec_type: str, codec_name: str | None, duration: float | None, video: dict | None = None, audio: dict | None = None) -> dict:
+    """按 ffprobe 的字段名生成一个流的信息，缺少必要字段时抛出 HeaderParseError"""
+    if codec_type in ("video", "audio") and codec_name is None:
+        raise HeaderParseError(f"Unknown {codec_type} codec")
+
+    stream = {"index": index, "codec_type": codec_type}
+    if codec_name is not None:
+        stream["codec_name"] = codec_name
+    if duration:
+        stream["duration"] = _format_duration(duration)
+
+    if codec_type == "video":
+        if not video or not video.get("width") or not video.get("height") or not video.get("frame_rate"):
+            raise HeaderParseError("Missing video dimensions or frame rate")
+        stream.update({
+            "width": video["width"],
+            "height": video["height"],
+            "r_frame_rate": _format_rate(video["frame_rate"]),
+            "avg_frame_rate": _format_rate(video["frame_rate"]),
+            "display_aspect_ratio": _aspect_ratio(video.get("display_width") or video["width"], video.get("display_height") or video["height"]),
+        })
+    else:
+        stream["r_frame_rate"] = "0/0"
+
+    if codec_type == "audio":
+        if not audio or not audio.get("sample_rate") or not audio.get("channels"):
+            raise HeaderParseError("Missing audio sample rate or channels")
+        stream.update({
+            "sample_rate": str(int(audio["sample_rate"])),
+            "channels": audio["channels"],
+        })
+        if audio["channels"] in _CHANNEL_LAYOUTS:
+            stream["channel_layout"] = _CHANNEL_LAYOUTS[audio["channels"]]
+    return stream
+
+
+def _build_metadata(format_name: str, duration: float, size: int, streams: list[dict]) -> dict:
+    if duration <= 0:
+        raise HeaderParseError("Missing duration")
+    if not any(stream["codec_type"] == "video" for stream in streams):
+        raise HeaderParseError("No video stream")
+    return {
+        "format": {
+            "format_name": format_name,
+            "duration": _format_duration(duration),
+            "size": str(size),
+            "bit_rate": str(int(size * 8 / duration)),
+            "nb_streams": len(streams),
+        },
+        "streams": streams,
+    }
+
+
+# ---------------------------------------------------------------- MP4 / MOV
+
+def _iter_boxes(data: bytes, start: int, end: int):
+    """遍历 [start, end) 范围内的 box，产出 (类型, 内容起点, 内容终点)"""
+    offset = start
+    while offset + 8 <= end:
+        box_size, box_type = struct.unpack_from('>I4s', data, offset)
+        header_size = 8
+        if box_size == 1:
+            if offset + 16 > end:
+                raise HeaderParseError("Truncated box header")
+            box_size = struct.unpack_from('>Q', data, offset + 8)[0]
+            header_size = 16
+        elif box_size == 0:
+            box_size = end - offset
+        if box_size < header_size or offset + box_size > end:
+            raise HeaderParseError(f"Invalid size for box {box_type!r}")
+        yield box_type, offset + header_size, offset + box_size
+        offset += box_size
+
+
+def _find_box(data: bytes, start: int, end: int, path: list[bytes]) -> tuple[int, int] | None:
+    """按路径查找嵌套的 box，返回内容范围"""
+    for box_type, content_start, content_end in _iter_boxes(data, start, end):
+        if box_type == path[0]:
+            if len(path) == 1:
+                return content_start, content_end
+            return _find_box(data, content_start, content_end, path[1:])
+    return None
+
+
+def _read_media_header(data: bytes, start: int) -> tuple[int, int]:
+    """mvhd / mdhd 的 (timescale, duration)"""
+    version = data[start]
+    if version == 1:
+        return struct.unpack_from('>IQ', data, start + 20)
+    return struct.unpack_from('>II', data, start + 12)
+
+
+def _read_display_size(data: bytes, start: int) -> tuple[int, int]:
+    """tkhd 中的显示宽高（16.16 定点数）"""
+    version = data[start]
+    offset = start + (88 if version == 1 else 76)
+    width, height = struct.unpack_from('>II', data, offset)
+    return width >> 16, height >> 16
+
+
+def _read_descriptor_length(data: bytes, offset: int) -> tuple[int, int]:
+    length = 0
+    for _ in range(4):
+        byte = data[offset]
+        offset += 1
+        length = (length << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            break
+    return length, offset
+
+
+def _read_object_type(data: bytes, start: int, end: int) -> int | None:
+    """从 esds 的 ES_Descriptor / DecoderConfigDescriptor 中读取 objectTypeIndication"""
+    offset = start + 4
+    if offset >= end or data[offset] != 0x03:
+        return None
+    _, offset = _read_descriptor_length(data, offset + 1)
+    es_flags = data[offset + 2]
+    offset += 3
+    if es_flags & 0x80:
+        offset += 2
+    if es_flags & 0x40:
+        offset += 1 + data[offset]
+    if es_flags & 0x20:
+        offset += 2
+    if offset >= end or data[offset] != 0x04:
+        return None
+    _, offset = _read_descriptor_length(data, offset + 1)
+    return data[offset]
+
+
+def _read_sample_entry(data: bytes, stsd: tuple[int, int], codec_type: str, media_timescale: int) -> tuple[str | None, dict]:
+    """读取 stsd 中第一个 sample entry 的编码和尺寸 / 声道信息"""
+    start, end = stsd
+    entry_count = struct.unpack_from('>I', data, start + 4)[0]
+    if entry_count < 1:
+        raise HeaderParseError("Empty sample description")
+    entry_size, entry_type = struct.unpack_from('>I4s', data, start + 8)
+    entry_start = start + 8
+    entry_end = entry_start + entry_size
+    if entry_end > end:
+        raise HeaderParseError("Truncated sample description")
+    body = entry_start + 16
+
+    codec_name = _MP4_CODECS.get(entry_type)
+    details = {}
+    if codec_type == "video":
+        details["width"], details["height"] = struct.unpack_from('>HH', data, body + 16)
+        # 像素宽高比（pasp）位于 70 字节的 VisualSampleEntry 字段之后
+        pasp = _find_box(data, body + 70, entry_end, [b'pasp'])
+        if pasp is not None:
+            horizontal_spacing, vertical_spacing = struct.unpack_from('>II', data, pasp[0])
+            if horizontal_spacing and vertical_spacing:
+                details["display_width"] = details["width"] * horizontal_spacing
+                details["display_height"] = details["height"] * vertical_spacing
+    elif codec_type == "audio":
+        version = struct.unpack_from('>H', data, body)[0]
+        channels, _, _, _, sample_rate = struct.unpack_from('>HHHHI', data, body + 8)
+        children_start = body + 20
+        if version == 1:
+            children_start += 16
+        elif version == 2:
+            # QuickTime v2 把采样率（float64）和声道数放在扩展字段中
+            sample_rate_value, channels = struct.unpack_from('>dI', data, body + 24)
+            sample_rate = int(sample_rate_value) << 16
+            children_start += 36
+        details["channels"] = channels
+        # 16.16 定点数，超过 65535 Hz 时以媒体时间刻度为准
+        details["sample_rate"] = (sample_rate >> 16) or media_timescale
+        if entry_type == b'mp4a':
+            esds = _find_box(data, children_start, entry_end, [b'esds'])
+            object_type = _read_object_type(data, *esds) if esds else None
+            codec_name = _MP4_OBJECT_TYPES.get(object_type)
+    return codec_name, details
+
+
+def _read_frame_rate(data: bytes, stts: tuple[int, int], media_timescale: int) -> Fraction | None:
+    """按 stts 中覆盖样本最多的帧间隔计算帧率，可变帧率时与 ffprobe 的 r_frame_rate 一样取主要帧率"""
+    start, end = stts
+    entry_count = struct.unpack_from('>I', data, start + 4)[0]
+    # 损坏的条目数可能远大于 box 本身，不能按它遍历整个文件
+    if start + 8 + entry_count * 8 > end:
+        raise HeaderParseError("Truncated time-to-sample table")
+    sample_counts = {}
+    for index in range(entry_count):
+        sample_count, sample_delta = struct.unpack_from('>II', data, start + 8 + index * 8)
+        if sample_delta:
+            sample_counts[sample_delta] = sample_counts.get(sample_delta, 0) + sample_count
+    if not sample_counts or not media_timescale:
+        return None
+    dominant_delta = max(sample_counts, key=sample_counts.get)
+    return Fraction(media_timescale, dominant_delta)
+
+
+def _probe_mp4(data: bytes) -> dict | None:
+    moov = _find_box(data, 0, len(data), [b'moov'])
+    if moov is None:
+        return None
+    moov_start, moov_end = moov
+
+    mvhd = _find_box(data, moov_start, moov_end, [b'mvhd'])
+    if mvhd is None:
+        raise HeaderParseError("Missing mvhd")
+    movie_timescale, movie_duration = _read_media_header(data, mvhd[0])
+
+    streams = []
+    stream_durations = []
+    for box_type, trak_start, trak_end in _iter_boxes(data, moov_start, moov_end):
+        if box_type != b'trak':
+            continue
+        mdhd = _find_box(data, trak_start, trak_end, [b'mdia', b'mdhd'])
+        hdlr = _find_box(data, trak_start, trak_end, [b'mdia', b'hdlr'])
+        stsd = _find_box(data, trak_start, trak_end, [b'mdia', b'minf', b'stbl', b'stsd'])
+        if mdhd is None or hdlr is None or stsd is None:
+            raise HeaderParseError("Incomplete track")
+        media_timescale, media_duration = _read_media_header(data, mdhd[0])
+        codec_type = _MP4_HANDLER_TYPES.get(data[hdlr[0] + 8:hdlr[0] + 12], "data")
+        duration = media_duration / media_timescale if media_timescale else 0
+        stream_durations.append(duration)
+
+        codec_name, details = _read_sample_entry(data, stsd, codec_type, media_timescale)
+        video = audio = None
+        if codec_type == "video":
+            tkhd = _find_box(data, trak_start, trak_end, [b'tkhd'])
+            stts = _find_box(data, trak_start, trak_end, [b'mdia', b'minf', b'stbl', b'stts'])
+            display_width, display_height = _read_display_size(data, tkhd[0]) if tkhd else (0, 0)
+            # 没有 pasp 时与 ffprobe 一样按 tkhd 中的显示尺寸计算宽高比
+            video = {
+                "display_width": display_width,
+                "display_height": display_height,
+                **details,
+                "frame_rate": _read_frame_rate(data, stts, media_timescale) if stts else None,
+            }
+        elif codec_type == "audio":
+            audio = details
+        streams.append(_build_stream(len(streams), codec_type, codec_name, duration, video, audio))
+
+    duration = movie_duration / movie_timescale if movie_timescale else 0
+    return _build_metadata(MP4_FORMAT_NAME, duration or max(stream_durations, default=0), len(data), streams)
+
+
+# ---------------------------------------------------------------- Matroska / WebM
+
+def _read_vint(data: bytes, offset: int, keep_marker: bool) -> tuple[int | None, int]:
+    """读取 EBML 变长整数，返回 (值, 新位置)；keep_marker 为 True 时保留长度标记位（元素 ID）。长度为全 1 时值为 None（未知大小）"""
+    first = data[offset]
+    if first == 0:
+        raise HeaderParseError("Invalid EBML variable-length integer")
+    length = 1
+    while not first & (0x80 >> (length - 1)):
+        length += 1
+    value = first if keep_marker else first & (0xFF >> length)
+    for index in range(1, length):
+        value = (value << 8) | data[offset + index]
+    if not keep_marker and value == (1 << (7 * length)) - 1:
+        return None, offset + length
+    return value, offset + length
+
+
+def _iter_elements(data: bytes, start: int, end: int):
+    """遍历 [start, end) 范围内的 EBML 元素，产出 (ID, 内容起点, 内容终点)，未知大小的元素延伸到 end"""
+    offset = start
+    while offset < end:
+        element_id, offset = _read_vint(data, offset, keep_marker=True)
+        size, offset = _read_vint(data, offset, keep_marker=False)
+        content_end = end if size is None else offset + size
+        if content_end > end:
+            if element_id not in _TRUNCATABLE_ELEMENTS:
+                raise HeaderParseError(f"Truncated element {element_id:#x}")
+            # 只下载了一部分的文件：Segment / Cluster 被截断
+            content_end = end
+        yield element_id, offset, content_end
+        offset = content_end
+
+
+def _read_uint(data: bytes, start: int, end: int) -> int:
+    return int.from_bytes(data[start:end], 'big')
+
+
+def _read_float(data: bytes, start: int, end: int) -> float:
+    if end - start == 4:
+        return struct.unpack_from('>f', data, start)[0]
+    if end - start == 8:
+        return struct.unpack_from('>d', data, start)[0]
+    raise HeaderParseError("Invalid EBML float size")
+
+
+def _read_matroska_track(data: bytes, start: int, end: int) -> dict:
+    track = {}
+    for element_id, content_start, content_end in _iter_elements(data, start, end):
+        if element_id == _TRACK_TYPE:
+            track["type"] = _read_uint(data, content_start, content_end)
+        elif element_id == _CODEC_ID:
+            track["codec_id"] = data[content_start:content_end].rstrip(b'\x00').decode('ascii', errors='replace')
+        elif element_id == _DEFAULT_DURATION:
+            track["default_duration"] = _read_uint(data, content_start, content_end)
+        elif element_id == _VIDEO:
+            for video_id, video_start, video_end in _iter_elements(data, content_start, content_end):
+                if video_id == _PIXEL_WIDTH:
+                    track["width"] = _read_uint(data, video_start, video_end)
+                elif video_id == _PIXEL_HEIGHT:
+                    track["height"] = _read_uint(data, video_start, video_end)
+                elif video_id == _DISPLAY_WIDTH:
+                    track["display_width"] = _read_uint(data, video_start, video_end)
+                elif video_id == _DISPLAY_HEIGHT:
+                    track["display_height"] = _read_uint(data, video_start, video_end)
+        elif element_id == _AUDIO:
+            for audio_id, audio_start, audio_end in _iter_elements(data, content_start, content_end):
+                if audio_id == _SAMPLING_FREQUENCY:
+                    track["sample_rate"] = _read_float(data, audio_start, audio_end)
+                elif audio_id == _CHANNELS:
+                    track["channels"] = _read_uint(data, audio_start, audio_end)
+    return track
+
+
+def _matroska_codec_name(codec_id: str) -> str | None:
+    if codec_id.startswith("A_AAC"):
+        return "aac"
+    return _MATROSKA_CODECS.get(codec_id)
+
+
+def _probe_matroska(data: bytes) -> dict | None:
+    doc_type = None
+    segment = None
+    for element_id, content_start, content_end in _iter_elements(data, 0, len(data)):
+        if element_id == _EBML:
+            for header_id, header_start, header_end in _iter_elements(data, content_start, content_end):
+                if header_id == _EBML_DOC_TYPE:
+                    doc_type = data[header_start:header_end].rstrip(b'\x00')
+        elif element_id == _SEGMENT:
+            segment = (content_start, content_end)
+            break
+    if doc_type not in (b'matroska', b'webm') or segment is None:
+        return None
+
+    timecode_scale = 1000000
+    duration = None
+    tracks = None
+    for element_id, content_start, content_end in _iter_elements(data, *segment):
+        if element_id == _INFO:
+            for info_id, info_start, info_end in _iter_elements(data, content_start, content_end):
+                if info_id == _TIMECODE_SCALE:
+                    timecode_scale = _read_uint(data, info_start, info_end)
+                elif info_id == _DURATION:
+                    duration = _read_float(data, info_start, info_end)
+        elif element_id == _TRACKS:
+            tracks = [
+                _read_matroska_track(data, track_start, track_end)
+                for track_id, track_start, track_end in _iter_elements(data, content_start, content_end)
+                if track_id == _TRACK_ENTRY
+            ]
+        elif element_id == _CLUSTER:
+            # Info 和 Tracks 位于第一个 Cluster 之前，之后都是媒体数据
+            break
+    if duration is None or tracks is None:
+        # 直播录制的 WebM 通常没有时长，交给 ffprobe
+        return None
+
+    streams = []
+    for track in tracks:
+        codec_type = _MATROSKA_TRACK_TYPES.get(track.get("type"), "data")
+        codec_name = _matroska_codec_name(track.get("codec_id", ""))
+        video = audio = None
+        if codec_type == "video":
+            default_duration = track.get("default_duration")
+            video = {
+                "width": track.get("width"),
+                "height": track.get("height"),
+                "display_width": track.get("display_width"),
+                "display_height": track.get("display_height"),
+                # DefaultDuration 以纳秒为单位，取整误差在 1001 以内的分母上还原（如 30000/1001）
+                "frame_rate": Fraction(1000000000, default_duration).limit_denominator(1001) if default_duration else None,
+            }
+        elif codec_type == "audio":
+            audio = {"sample_rate": track.get("sample_rate"), "channels": track.get("channels")}
+        streams.append(_build_stream(len(streams), codec_type, codec_name, None, video, audio))
+
+    return _build_metadata(MATROSKA_FORMAT_NAME, duration * timecode_scale / 1e9, len(data), streams)
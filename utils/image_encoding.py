@@ -0,0 +1,153 @@
+from utils.process import Deadline, ProcessTimeoutError, run_process
+
+
+class ImageEncodingError(Exception):
+    pass
+
+
+# 支持的输出格式
+OUTPUT_FORMATS = {
+    "jpeg": {"encoder": "mjpeg", "mime_type": "image/jpeg", "extension": "jpg", "pipe_format": "jpeg_pipe"},
+    "webp": {"encoder": "libwebp", "mime_type": "image/webp", "extension": "webp", "pipe_format": "webp_pipe"},
+    "png": {"encoder": "png", "mime_type": "image/png", "extension": "png", "pipe_format": "png_pipe"},
+}
+DEFAULT_OUTPUT_FORMAT = "jpeg"
+
+# 默认参数与旧行为一致：原始分辨率，JPEG -q:v 2
+DEFAULT_ENCODE_PARAMS = {
+    "format": DEFAULT_OUTPUT_FORMAT,
+    "quality": None,
+    "max_width": 0,
+    "max_height": 0,
+}
+
+# 超出字节预算时逐步降低质量和分辨率，最多重新编码的次数
+MAX_BUDGET_ATTEMPTS = 4
+
+
+def _parse_int(value, name: str, minimum: int, maximum: int) -> int:
+    try:
+        number = int(value)
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid {name} parameter. Must be an integer")
+    if number < minimum or number > maximum:
+        raise ValueError(f"{name.capitalize()} must be between {minimum} and {maximum}")
+    return number
+
+
+def parse_encode_params(tool_parameters: dict) -> tuple[dict, int]:
+    """
+    从工具参数中解析输出格式、质量和最大尺寸。
+    返回 (编码参数, 字节预算)，字节预算为 0 表示不限制；参数无效时抛出 ValueError。
+    """
+    output_format = tool_parameters.get('output_format') or DEFAULT_OUTPUT_FORMAT
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format: {output_format}. Supported formats are: {', '.join(OUTPUT_FORMATS)}")
+
+    quality = tool_parameters.get('quality')
+    quality = _parse_int(quality, "quality", 1, 100) if quality not in (None, '') else None
+    max_width = _parse_int(tool_parameters.get('max_width') or 0, "max width", 0, 8192)
+    max_height = _parse_int(tool_parameters.get('max_height') or 0, "max height", 0, 8192)
+    max_bytes = _parse_int(tool_parameters.get('max_bytes') or 0, "max bytes", 0, 50 * 1024 * 1024)
+
+    encode_params = {
+        "format": output_format,
+        "quality": quality,
+        "max_width": max_width,
+        "max_height": max_height,
+    }
+    return encode_params, max_bytes
+
+
+def build_scale_filter(encode_params: dict) -> str | None:
+    """限制最大宽高，保持宽高比，只缩小不放大；使用 fast_bilinear 以降低缩放开销"""
+    max_width = encode_params.get("max_width") or 0
+    max_height = encode_params.get("max_height") or 0
+    if not max_width and not max_height:
+        return None
+    width = f"min(iw,{max_width})" if max_width else "iw"
+    height = f"min(ih,{max_height})" if max_height else "ih"
+    return f"scale=w='{width}':h='{height}':force_original_aspect_ratio=decrease:flags=fast_bilinear"
+
+
+def build_encode_args(encode_params: dict) -> list[str]:
+    """编码器参数，输出到 stdout"""
+    output_format = encode_params.get("format") or DEFAULT_OUTPUT_FORMAT
+    quality = encode_params.get("quality")
+
+    if output_format == "webp":
+        codec_args = ['-c:v', 'libwebp', '-quality', str(quality if quality is not None else 90)]
+    elif output_format == "png":
+        # PNG 为无损格式，不使用质量参数
+        codec_args = ['-c:v', 'png']
+    else:
+        # 质量 1-100 映射到 mjpeg 的 -q:v 31-2，未指定时使用 2（高质量）
+        qscale = 2 if quality is None else round(31 - (quality - 1) * 29 / 99)
+        codec_args = ['-c:v', 'mjpeg', '-q:v', str(qscale)]
+
+    return ['-f', 'image2pipe', *codec_args, 'pipe:1']
+
+
+def get_encoder(encode_params: dict) -> str:
+    return OUTPUT_FORMATS[encode_params.get("format") or DEFAULT_OUTPUT_FORMAT]["encoder"]
+
+
+def get_mime_type(encode_params: dict) -> str:
+    return OUTPUT_FORMATS[encode_params.get("format") or DEFAULT_OUTPUT_FORMAT]["mime_type"]
+
+
+def get_extension(encode_params: dict) -> str:
+    return OUTPUT_FORMATS[encode_params.get("format") or DEFAULT_OUTPUT_FORMAT]["extension"]
+
+
+def get_pipe_format(encode_params: dict) -> str:
+    return OUTPUT_FORMATS[encode_params.get("format") or DEFAULT_OUTPUT_FORMAT]["pipe_format"]
+
+
+def reencode_image(image_data: bytes, encode_params: dict, scale_factor: float, deadline: Deadline | None = None) -> bytes:
+    """把已编码的图片按比例缩小并用给定参数重新编码"""
+    command = [
+        'ffmpeg',
+        '-hide_banner',
+        '-v', 'error',
+        '-f', get_pipe_format(encode_params),
+        '-i', 'pipe:0',
+        '-vf', f"scale=w='max(16,trunc(iw*{scale_factor:.4f}))':h=-2:flags=fast_bilinear",
+        '-frames:v', '1',
+        *build_encode_args(encode_params)
+    ]
+
+    result = run_process(command, deadline=deadline, input=image_data, stage="ffmpeg_reencode")
+
+    if result.returncode != 0 or not result.stdout:
+        raise ImageEncodingError(result.stderr.decode('utf-8', errors='replace'))
+
+    return result.stdout
+
+
+def fit_byte_budget(image_data: bytes, encode_params: dict, max_bytes: int, deadline: Deadline | None = None) -> tuple[bytes, bool]:
+    """
+    图片超过字节预算时，先降低质量再缩小分辨率重新编码。
+    返回 (图片数据, 是否重新编码过)；多次尝试后仍超出预算或超时时返回最小的结果。
+    """
+    if not max_bytes or len(image_data) <= max_bytes:
+        return image_data, False
+
+    best_data = image_data
+    quality = encode_params.get("quality") or 90
+    scale_factor = 1.0
+    for _ in range(MAX_BUDGET_ATTEMPTS):
+        if encode_params.get("format") != "png" and quality > 40:
+            quality = max(40, quality - 20)
+        else:
+            scale_factor *= 0.75
+        try:
+            candidate = reencode_image(image_data, {**encode_params, "quality": quality}, scale_factor, deadline)
+        except (ImageEncodingError, ProcessTimeoutError):
+            break
+        if len(candidate) < len(best_data):
+            best_data = candidate
+        if len(candidate) <= max_bytes:
+            break
+
+    return best_data, True
@@ -0,0 +1,164 @@
+class JpegStreamSplitter:
+    """
+    把 image2pipe 输出的连续 JPEG 字节流切分成单帧。
+    先按段长度跳过 SOS 之前的头部，再在熵编码数据中查找 EOI，
+    避免量化表等头部数据中偶然出现的 FF D9 被误判为帧结束。
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        # 当前帧中已确认扫描过的位置
+        self._position = 0
+        self._in_scan = False
+
+    def feed(self, chunk: bytes) -> list[bytes]:
+        self._buffer.extend(chunk)
+        frames = []
+        while True:
+            frame = self._next_frame()
+            if frame is None:
+                break
+            frames.append(frame)
+        return frames
+
+    def remaining(self) -> bytes:
+        return bytes(self._buffer)
+
+    def _next_frame(self) -> bytes | None:
+        buffer = self._buffer
+
+        if self._position == 0:
+            start = buffer.find(b'\xff\xd8')
+            if start < 0:
+                # 保留最后一个字节，可能是被截断的 SOI
+                del buffer[:max(0, len(buffer) - 1)]
+                return None
+            del buffer[:start]
+            self._position = 2
+            self._in_scan = False
+
+        while not self._in_scan:
+            if self._position + 4 > len(buffer):
+                return None
+            if buffer[self._position] != 0xff:
+                # 头部结构异常，重新查找下一个 SOI
+                del buffer[:1]
+                self._position = 0
+                return self._next_frame()
+            marker = buffer[self._position + 1]
+            if marker == 0xff:
+                # 填充字节
+                self._position += 1
+                continue
+            segment_length = (buffer[self._position + 2] << 8) | buffer[self._position + 3]
+            self._position += 2 + segment_length
+            if marker == 0xda:
+                self._in_scan = True
+
+        while True:
+            end = buffer.find(b'\xff', self._position)
+            if end < 0 or end + 1 >= len(buffer):
+                self._position = max(self._position, len(buffer) - 1)
+                return None
+            marker = buffer[end + 1]
+            if marker == 0xd9:
+                frame = bytes(buffer[:end + 2])
+                del buffer[:end + 2]
+                self._position = 0
+                self._in_scan = False
+                return frame
+            # FF 00 为转义字节，FF D0-D7 为重启标记，其余标记（如渐进式的下一个 SOS）继续扫描
+            self._position = end + 2
+
+
+class PngStreamSplitter:
+    """按 PNG chunk 结构切分连续的 PNG 字节流，遇到 IEND 即为一帧结束"""
+
+    _SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._position = 0
+
+    def feed(self, chunk: bytes) -> list[bytes]:
+        self._buffer.extend(chunk)
+        frames = []
+        while True:
+            frame = self._next_frame()
+            if frame is None:
+                break
+            frames.append(frame)
+        return frames
+
+    def remaining(self) -> bytes:
+        return bytes(self._buffer)
+
+    def _next_frame(self) -> bytes | None:
+        buffer = self._buffer
+        if self._position == 0:
+            start = buffer.find(self._SIGNATURE)
+            if start < 0:
+                del buffer[:max(0, len(buffer) - len(self._SIGNATURE) + 1)]
+                return None
+            del buffer[:start]
+            self._position = len(self._SIGNATURE)
+
+        while self._position + 8 <= len(buffer):
+            chunk_length = int.from_bytes(buffer[self._position:self._position + 4], 'big')
+            chunk_type = bytes(buffer[self._position + 4:self._position + 8])
+            # 长度 + 类型 + 数据 + CRC
+            chunk_end = self._position + 12 + chunk_length
+            if chunk_end > len(buffer):
+                return None
+            self._position = chunk_end
+            if chunk_type == b'IEND':
+                frame = bytes(buffer[:chunk_end])
+                del buffer[:chunk_end]
+                self._position = 0
+                return frame
+        return None
+
+
+class WebpStreamSplitter:
+    """按 RIFF 头中的长度切分连续的 WebP 字节流"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, chunk: bytes) -> list[bytes]:
+        self._buffer.extend(chunk)
+        frames = []
+        while True:
+            start = self._buffer.find(b'RIFF')
+            if start < 0:
+                del self._buffer[:max(0, len(self._buffer) - 3)]
+                break
+            del self._buffer[:start]
+            if len(self._buffer) < 8:
+                break
+            # RIFF 长度不包含开头的 8 个字节，奇数长度需要补齐一个字节
+            riff_size = int.from_bytes(self._buffer[4:8], 'little')
+            frame_end = 8 + riff_size + (riff_size & 1)
+            if len(self._buffer) < frame_end:
+                break
+            frames.append(bytes(self._buffer[:frame_end]))
+            del self._buffer[:frame_end]
+        return frames
+
+    def remaining(self) -> bytes:
+        return bytes(self._buffer)
+
+
+_SPLITTERS = {
+    "jpeg": JpegStreamSplitter,
+    "png": PngStreamSplitter,
+    "webp": WebpStreamSplitter,
+}
+
+
+def create_stream_splitter(output_format: str):
+    return _SPLITTERS.get(output_format, JpegStreamSplitter)()
+
+
+def split_image_stream(data: bytes, output_format: str = "jpeg") -> list[bytes]:
+    return create_stream_splitter(output_format).feed(data)
@@ -0,0 +1,335 @@
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections.abc import Callable, Generator
+from concurrent.futures import ThreadPoolExecutor
+
+from dify_plugin.entities.tool import ToolInvokeMessage
+
+from utils.config import env_int, env_str
+from utils.process import Deadline
+
+
+class JobError(Exception):
+    pass
+
+
+# 任务状态和结果的保存目录。插件存储（manifest.yaml 中的 storage 权限）只能在工具调用的会话中使用且容量很小，
+# 后台任务在调用返回后仍在写入，因此使用本地目录
+JOB_DIR = env_str("FFMPEG_TOOLS_JOB_DIR") or os.path.join(tempfile.gettempdir(), "ffmpeg_tools_jobs")
+# 任务完成后结果保留的时间（秒），过期的任务在之后的提交或查询时删除
+JOB_TTL_SECONDS = env_int("FFMPEG_TOOLS_JOB_TTL", 3600)
+# 同时运行的任务数，每个任务与普通调用一样受进程调度器限制
+JOB_WORKERS = env_int("FFMPEG_TOOLS_JOB_WORKERS", 1)
+# 排队和运行中的任务数上限，超出时拒绝提交
+JOB_MAX_PENDING = env_int("FFMPEG_TOOLS_JOB_MAX_PENDING", 16)
+# 单个任务的时间预算（秒），同时作为任务中单个 ffmpeg 进程的超时
+JOB_TIMEOUT = env_int("FFMPEG_TOOLS_JOB_TIMEOUT", 1800)
+
+# 查询结果分页
+DEFAULT_PAGE_SIZE = 10
+MAX_PAGE_SIZE = 50
+
+JOB_STATUS_QUEUED = "queued"
+JOB_STATUS_RUNNING = "running"
+JOB_STATUS_SUCCEEDED = "succeeded"
+JOB_STATUS_FAILED = "failed"
+_FINISHED_STATUSES = (JOB_STATUS_SUCCEEDED, JOB_STATUS_FAILED)
+
+_JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+_STATE_FILE = "state.json"
+_FRAMES_DIR = "frames"
+_INPUT_FILE = "input"
+# 两次清理过期任务之间的最短间隔（秒）
+_CLEANUP_INTERVAL_SECONDS = 60
+
+# 运行任务的进程每隔 _HEARTBEAT_INTERVAL_SECONDS 秒更新一次排队和运行中任务的状态文件修改时间。
+# 查询可能落在插件的其他进程上，因此按状态文件是否停止更新而不是按进程判断任务是否已随插件重启中断
+_HEARTBEAT_INTERVAL_SECONDS = 10
+_HEARTBEAT_TIMEOUT_SECONDS = 60
+
+_lock = threading.Lock()
+_executor = None
+_heartbeat_thread = None
+# 本进程中排队和运行中的任务
+_active_jobs = set()
+_pending = 0
+_last_cleanup = 0.0
+
+
+class StoredVideoFile:
+    """从任务目录读回的上传文件，提供工具使用的 blob / filename / extension"""
+
+    def __init__(self, blob: bytes, filename: str, extension: str | None):
+        self.blob = blob
+        self.filename = filename
+        self.extension = extension
+
+
+def _job_path(job_id: str, *parts: str) -> str:
+    if not _JOB_ID_PATTERN.match(job_id or ''):
+        raise JobError(f"Invalid job id: {job_id}")
+    return os.path.join(JOB_DIR, job_id, *parts)
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    # 先写入临时文件再替换，查询时不会读到不完整的状态
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            temp_file.write(data)
+        os.replace(temp_path, path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+
+def _save_state(state: dict) -> None:
+    state["updated_at"] = time.time()
+    _write_atomic(_job_path(state["job_id"], _STATE_FILE), json.dumps(state, default=str).encode('utf-8'))
+
+
+def _read_state(job_id: str) -> dict | None:
+    try:
+        with open(_job_path(job_id, _STATE_FILE), 'rb') as state_file:
+            return json.loads(state_file.read())
+    except (OSError, ValueError):
+        return None
+
+
+def _is_stale(job_id: str) -> bool:
+    with _lock:
+        if job_id in _active_jobs:
+            return False
+    try:
+        return os.stat(_job_path(job_id, _STATE_FILE)).st_mtime + _HEARTBEAT_TIMEOUT_SECONDS < time.time()
+    except OSError:
+        return False
+
+
+def load_job(job_id: str) -> dict | None:
+    """读取任务状态，不存在或已过期时返回 None；状态文件超过 _HEARTBEAT_TIMEOUT_SECONDS 秒未更新的未完成任务标记为失败"""
+    state = _read_state(job_id)
+    if state is None or state.get("expires_at", 0) < time.time():
+        return None
+    if state["status"] not in _FINISHED_STATUSES and _is_stale(job_id):
+        state["status"] = JOB_STATUS_FAILED
+        state["error"] = "Job stopped responding, the plugin was probably restarted"
+        state["finished_at"] = time.time()
+        try:
+            _save_state(state)
+        except OSError:
+            pass
+    return state
+
+
+def read_job_frame(job_id: str, frame: dict) -> bytes | None:
+    try:
+        with open(_job_path(job_id, _FRAMES_DIR, frame["file"]), 'rb') as frame_file:
+            return frame_file.read()
+    except OSError:
+        return None
+
+
+def cleanup_expired_jobs(force: bool = False) -> int:
+    """删除过期的任务目录，返回删除的任务数；未强制时最多每 _CLEANUP_INTERVAL_SECONDS 秒执行一次"""
+    global _last_cleanup
+    now = time.time()
+    with _lock:
+        if not force and now - _last_cleanup < _CLEANUP_INTERVAL_SECONDS:
+            return 0
+        _last_cleanup = now
+
+    removed = 0
+    try:
+        entries = list(os.scandir(JOB_DIR))
+    except OSError:
+        return 0
+    for entry in entries:
+        if not entry.is_dir() or not _JOB_ID_PATTERN.match(entry.name):
+            continue
+        state = _read_state(entry.name)
+        if state is not None:
+            expired = state.get("expires_at", 0) < now
+        else:
+            # 状态文件缺失或损坏（如提交时写入失败）的目录按修改时间过期
+            try:
+                expired = entry.stat().st_mtime + JOB_TTL_SECONDS < now
+            except OSError:
+                continue
+        if expired:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed += 1
+    return removed
+
+
+def _heartbeat() -> None:
+    while True:
+        time.sleep(_HEARTBEAT_INTERVAL_SECONDS)
+        with _lock:
+            job_ids = list(_active_jobs)
+        for job_id in job_ids:
+            try:
+                os.utime(_job_path(job_id, _STATE_FILE))
+            except OSError:
+                pass
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor, _heartbeat_thread
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=max(1, JOB_WORKERS), thread_name_prefix="ffmpeg_tools_job")
+    if _heartbeat_thread is None:
+        _heartbeat_thread = threading.Thread(target=_heartbeat, name="ffmpeg_tools_job_heartbeat", daemon=True)
+        _heartbeat_thread.start()
+    return _executor
+
+
+def submit_job(tool_name: str, video_file, tool_parameters: dict, run: Callable[[StoredVideoFile, Deadline], Generator[ToolInvokeMessage, None, None]]) -> dict:
+    """
+    把上传的视频写入任务目录并排队，返回任务状态。后台线程运行 run(文件, 任务预算)，
+    产出的图片逐个写入任务目录，JSON 作为任务结果。排队的任务超出 JOB_MAX_PENDING 或写入失败时抛出 JobError。
+    """
+    global _pending
+    cleanup_expired_jobs()
+
+    with _lock:
+        if _pending >= JOB_MAX_PENDING:
+            raise JobError(f"Too many pending jobs: {_pending}. Try again after some jobs finish")
+        _pending += 1
+
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    state = {
+        "job_id": job_id,
+        "tool": tool_name,
+        "status": JOB_STATUS_QUEUED,
+        "filename": video_file.filename,
+        "extension": video_file.extension,
+        "video_size": len(video_file.blob),
+        "parameters": tool_parameters,
+        "created_at": now,
+        "started_at": None,
+        "finished_at": None,
+        # 未完成的任务在任务预算之后再保留 TTL
+        "expires_at": now + JOB_TIMEOUT + JOB_TTL_SECONDS,
+        "progress": {"completed_frames": 0, "expected_frames": None},
+        "message": None,
+        "frames": [],
+        "result": None,
+        "error": None,
+    }
+    try:
+        os.makedirs(_job_path(job_id, _FRAMES_DIR))
+        _write_atomic(_job_path(job_id, _INPUT_FILE), video_file.blob)
+        _save_state(state)
+        with _lock:
+            _active_jobs.add(job_id)
+        _get_executor().submit(_run_job, job_id, run)
+    except (OSError, RuntimeError) as submit_error:
+        with _lock:
+            _pending -= 1
+            _active_jobs.discard(job_id)
+        shutil.rmtree(os.path.join(JOB_DIR, job_id), ignore_errors=True)
+        raise JobError(f"Failed to submit job: {str(submit_error)}")
+    return state
+
+
+def _store_frame(state: dict, message: ToolInvokeMessage) -> None:
+    meta = message.meta or {}
+    frame_number = meta.get("frame_number") or len(state["frames"]) + 1
+    filename = meta.get("filename") or f"frame_{frame_number:03d}"
+    stored_name = f"{frame_number:04d}{os.path.splitext(filename)[1]}"
+    _write_atomic(_job_path(state["job_id"], _FRAMES_DIR, stored_name), message.message.blob)
+    state["frames"].append({
+        "frame_number": frame_number,
+        "filename": filename,
+        "mime_type": meta.get("mime_type"),
+        "seek_time": meta.get("seek_time"),
+        "frame_size": len(message.message.blob),
+        "file": stored_name,
+    })
+    state["progress"] = {
+        "completed_frames": len(state["frames"]),
+        "expected_frames": meta.get("frame_count", state["progress"].get("expected_frames")),
+    }
+
+
+def _run_job(job_id: str, run: Callable[[StoredVideoFile, Deadline], Generator[ToolInvokeMessage, None, None]]) -> None:
+    global _pending
+    state = None
+    try:
+        state = _read_state(job_id)
+        if state is None:
+            return
+        state["status"] = JOB_STATUS_RUNNING
+        state["started_at"] = time.time()
+        _save_state(state)
+
+        with open(_job_path(job_id, _INPUT_FILE), 'rb') as input_file:
+            video_file = StoredVideoFile(input_file.read(), state["filename"], state["extension"])
+
+        deadline = Deadline(JOB_TIMEOUT, process_timeout=JOB_TIMEOUT)
+        messages = run(video_file, deadline)
+        try:
+            for message in messages:
+                if message.type == ToolInvokeMessage.MessageType.BLOB:
+                    _store_frame(state, message)
+                elif message.type == ToolInvokeMessage.MessageType.JSON:
+                    # 帧列表已逐个记录在 frames 中
+                    state["result"] = {key: value for key, value in message.message.json_object.items() if key != "frames"}
+                elif message.type == ToolInvokeMessage.MessageType.TEXT:
+                    state["message"] = message.message.text
+                _save_state(state)
+        finally:
+            messages.close()
+            deadline.cancel()
+
+        result = state["result"] or {}
+        if result.get("status") == "success":
+            state["status"] = JOB_STATUS_SUCCEEDED
+        else:
+            state["status"] = JOB_STATUS_FAILED
+            state["error"] = result.get("message") or "No result returned"
+    except Exception as job_error:
+        if state is not None:
+            state["status"] = JOB_STATUS_FAILED
+            state["error"] = f"Error processing job: {str(job_error)}"
+    finally:
+        with _lock:
+            _pending -= 1
+            _active_jobs.discard(job_id)
+        if state is not None:
+            try:
+                os.unlink(_job_path(job_id, _INPUT_FILE))
+            except OSError:
+                pass
+            state["finished_at"] = time.time()
+            state["expires_at"] = state["finished_at"] + JOB_TTL_SECONDS
+            try:
+                _save_state(state)
+            except OSError:
+                # 任务目录已被清理
+                pass
+
+
+def job_summary(state: dict) -> dict:
+    """查询结果中的任务信息，不含内部字段和帧列表"""
+    return {
+        "job_id": state["job_id"],
+        "job_status": state["status"],
+        "progress": state["progress"],
+        "filename": state["filename"],
+        "created_at": state["created_at"],
+        "started_at": state["started_at"],
+        "finished_at": state["finished_at"],
+        "expires_at": state["expires_at"],
+        "last_message": state["message"],
+        "error": state["error"],
+    }
@@ -0,0 +1,240 @@
+import json
+import struct
+from array import array
+from bisect import bisect_right
+
+from utils.cache import TieredCache
+from utils.config import env_int
+from utils.process import Deadline, ProcessStream
+from utils.video_input import VideoInput
+
+
+class KeyframeIndexError(Exception):
+    pass
+
+
+# get_video_info 的 JSON 中最多列出的关键帧数，完整索引只保存在缓存中
+MAX_LISTED_KEYFRAMES = env_int("FFMPEG_TOOLS_KEYFRAME_LIST_LIMIT", 1000)
+
+# 关键帧索引缓存，键为视频内容哈希，get_video_info 写入，抽帧工具在 fast 模式下读取
+_keyframe_cache = TieredCache(
+    "keyframes",
+    max_entries=env_int("FFMPEG_TOOLS_KEYFRAME_CACHE_ENTRIES", 64),
+    max_bytes=env_int("FFMPEG_TOOLS_KEYFRAME_CACHE_BYTES", 16 * 1024 * 1024),
+    disk_max_entries=env_int("FFMPEG_TOOLS_KEYFRAME_DISK_CACHE_ENTRIES", 1024),
+    disk_max_bytes=env_int("FFMPEG_TOOLS_KEYFRAME_DISK_CACHE_BYTES", 128 * 1024 * 1024),
+)
+
+# ffprobe 按内部顺序输出字段，与 -show_entries 中的顺序无关:
+# codec_type, stream_index, pts_time, dts_time, duration_time, size, pos, flags
+_PACKET_ENTRIES = "packet=codec_type,stream_index,pts_time,dts_time,duration_time,size,pos,flags"
+_PACKET_FIELD_COUNT = 8
+
+# 序列化格式: 4 字节头部长度 + JSON 头部 + 时间数组 + 偏移数组
+_HEADER_LENGTH = struct.Struct('>I')
+
+
+def _parse_float(value: str) -> float | None:
+    try:
+        return float(value)
+    except ValueError:
+        # N/A
+        return None
+
+
+class KeyframeIndex:
+    """
+    主视频流的关键帧时间（秒）和字节偏移，分别保存在 array('d') 和 array('q') 中，
+    另附每个流的包数、字节数、时长和码率统计。
+    """
+
+    def __init__(self, stream_index: int | None, times: array, offsets: array, streams: list[dict]):
+        self.stream_index = stream_index
+        self.times = times
+        self.offsets = offsets
+        self.streams = streams
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def keyframe_before(self, seek_time: float) -> float | None:
+        """不晚于 seek_time 的最后一个关键帧时间（与 -noaccurate_seek 的定位结果一致），没有时返回 None"""
+        position = bisect_right(self.times, seek_time + 1e-6)
+        if position == 0:
+            return None
+        return self.times[position - 1]
+
+    def nearest_keyframe(self, seek_time: float) -> float | None:
+        """离 seek_time 最近的关键帧时间（与 fast 模式下多帧抽取的对应规则一致），索引为空时返回 None"""
+        if not self.times:
+            return None
+        position = bisect_right(self.times, seek_time)
+        candidates = self.times[max(0, position - 1):position + 1]
+        return min(candidates, key=lambda keyframe_time: abs(keyframe_time - seek_time))
+
+    def gop_stats(self) -> dict:
+        """关键帧间隔（GOP）统计"""
+        intervals = [self.times[i + 1] - self.times[i] for i in range(len(self.times) - 1)]
+        frame_count = next((stream.get("frame_count", 0) for stream in self.streams if stream["index"] == self.stream_index), 0)
+        return {
+            "keyframe_count": len(self.times),
+            "min_seconds": round(min(intervals), 6) if intervals else None,
+            "avg_seconds": round(sum(intervals) / len(intervals), 6) if intervals else None,
+            "max_seconds": round(max(intervals), 6) if intervals else None,
+            "avg_frames": round(frame_count / len(self.times), 2) if self.times else None,
+        }
+
+    def to_dict(self, max_keyframes: int = MAX_LISTED_KEYFRAMES) -> dict:
+        """JSON 响应中使用的紧凑形式，时间和偏移为两个并列的列表，超过 max_keyframes 时截断"""
+        listed = min(len(self.times), max(0, max_keyframes))
+        return {
+            "stream_index": self.stream_index,
+            "keyframe_count": len(self.times),
+            "times": [round(keyframe_time, 6) for keyframe_time in self.times[:listed]],
+            # 字节偏移，-1 表示未知（例如通过管道读取）
+            "offsets": list(self.offsets[:listed]),
+            "truncated": listed < len(self.times),
+            "gop": self.gop_stats(),
+        }
+
+    def to_bytes(self) -> bytes:
+        header = json.dumps({
+            "stream_index": self.stream_index,
+            "count": len(self.times),
+            "streams": self.streams,
+        }).encode('utf-8')
+        return _HEADER_LENGTH.pack(len(header)) + header + self.times.tobytes() + self.offsets.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "KeyframeIndex":
+        (header_length,) = _HEADER_LENGTH.unpack_from(data)
+        header_end = _HEADER_LENGTH.size + header_length
+        header = json.loads(data[_HEADER_LENGTH.size:header_end])
+        times = array('d')
+        offsets = array('q')
+        times_end = header_end + header["count"] * times.itemsize
+        times.frombytes(data[header_end:times_end])
+        offsets.frombytes(data[times_end:times_end + header["count"] * offsets.itemsize])
+        return cls(header["stream_index"], times, offsets, header["streams"])
+
+
+class _StreamStats:
+    """单个流的包统计，边读 ffprobe 输出边累计"""
+
+    def __init__(self, index: int, codec_type: str):
+        self.index = index
+        self.codec_type = codec_type
+        self.packet_count = 0
+        self.keyframe_count = 0
+        self.total_bytes = 0
+        self.start_time = None
+        self.end_time = None
+        self.keyframe_times = array('d')
+        self.keyframe_offsets = array('q')
+
+    def add(self, timestamp: float | None, duration: float | None, size: int, position: int, is_keyframe: bool) -> None:
+        self.packet_count += 1
+        self.total_bytes += size
+        if timestamp is not None:
+            packet_end = timestamp + (duration or 0)
+            self.start_time = timestamp if self.start_time is None else min(self.start_time, timestamp)
+            self.end_time = packet_end if self.end_time is None else max(self.end_time, packet_end)
+        if is_keyframe:
+            self.keyframe_count += 1
+            if self.codec_type == "video" and timestamp is not None:
+                self.keyframe_times.append(timestamp)
+                self.keyframe_offsets.append(position)
+
+    def to_dict(self) -> dict:
+        duration = (self.end_time - self.start_time) if self.start_time is not None else 0
+        stats = {
+            "index": self.index,
+            "codec_type": self.codec_type,
+            "packet_count": self.packet_count,
+            "keyframe_count": self.keyframe_count,
+            "total_bytes": self.total_bytes,
+            "duration": round(duration, 6),
+            "bit_rate": int(self.total_bytes * 8 / duration) if duration > 0 else 0,
+        }
+        if self.codec_type == "video":
+            # 视频流一个包对应一帧
+            stats["frame_count"] = self.packet_count
+        return stats
+
+
+def _parse_packet_line(line: str, streams: dict[int, _StreamStats]) -> None:
+    fields = line.split(',')
+    if len(fields) < _PACKET_FIELD_COUNT:
+        return
+    codec_type, stream_index, pts_time, dts_time, duration_time, size, pos, flags = fields[:_PACKET_FIELD_COUNT]
+    try:
+        stream_index = int(stream_index)
+        size = int(size)
+    except ValueError:
+        return
+    stream = streams.get(stream_index)
+    if stream is None:
+        stream = streams[stream_index] = _StreamStats(stream_index, codec_type)
+    timestamp = _parse_float(pts_time)
+    if timestamp is None:
+        timestamp = _parse_float(dts_time)
+    position = int(pos) if pos.isdigit() else -1
+    stream.add(timestamp, _parse_float(duration_time), size, position, flags.startswith('K'))
+
+
+def build_keyframe_index(video_input: VideoInput, deadline: Deadline | None = None) -> KeyframeIndex:
+    """
+    用一次 ffprobe -show_packets 读取所有包（只解复用，不解码），得到主视频流的关键帧索引和每个流的统计。
+    输出按行流式解析，不在内存中保留完整的包列表。失败时抛出 KeyframeIndexError。
+    """
+    command = [
+        'ffprobe',
+        '-v', 'error',
+        '-show_entries', _PACKET_ENTRIES,
+        '-of', 'csv=p=0',
+        video_input.path
+    ]
+
+    streams: dict[int, _StreamStats] = {}
+    pending = b''
+    with ProcessStream(command, deadline=deadline, stage="ffprobe_packets", **video_input.run_kwargs()) as stream:
+        for chunk in stream.chunks():
+            lines = (pending + chunk).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                _parse_packet_line(line.decode('utf-8', errors='replace').strip(), streams)
+        if pending:
+            _parse_packet_line(pending.decode('utf-8', errors='replace').strip(), streams)
+        result = stream.finish()
+
+    if result.returncode != 0:
+        raise KeyframeIndexError(result.stderr.decode('utf-8', errors='replace'))
+
+    # 附加封面图等只有一个包的视频流不作为主视频流
+    video_streams = [stats for stats in streams.values() if stats.codec_type == "video"]
+    primary = max(video_streams, key=lambda stats: stats.packet_count, default=None)
+    if primary is None:
+        return KeyframeIndex(None, array('d'), array('q'), [stats.to_dict() for stats in streams.values()])
+
+    # 解码顺序与显示顺序不同时关键帧时间可能乱序，按时间排序
+    order = sorted(range(len(primary.keyframe_times)), key=primary.keyframe_times.__getitem__)
+    times = array('d', (primary.keyframe_times[i] for i in order))
+    offsets = array('q', (primary.keyframe_offsets[i] for i in order))
+    return KeyframeIndex(primary.index, times, offsets, [streams[index].to_dict() for index in sorted(streams)])
+
+
+def get_cached_keyframe_index(video_hash: str) -> KeyframeIndex | None:
+    cached = _keyframe_cache.get(video_hash)
+    if cached is None:
+        return None
+    return KeyframeIndex.from_bytes(cached)
+
+
+def get_keyframe_index(video_input: VideoInput, video_hash: str, deadline: Deadline | None = None) -> KeyframeIndex:
+    """返回关键帧索引，优先使用缓存，构建后按内容哈希缓存，供抽帧工具在 fast 模式下对齐关键帧"""
+    keyframe_index = get_cached_keyframe_index(video_hash)
+    if keyframe_index is not None:
+        return keyframe_index
+    keyframe_index = build_keyframe_index(video_input, deadline)
+    _keyframe_cache.put(video_hash, keyframe_index.to_bytes())
+    return keyframe_index
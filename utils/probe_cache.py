@@ -0,0 +1,88 @@
+import json
+
+from utils.cache import TieredCache
+from utils.config import env_int
+from utils.header_probe import probe_header
+from utils.process import Deadline, run_process
+from utils.video_input import VideoInput
+
+
+class ProbeError(Exception):
+    pass
+
+
+# 是否先尝试只解析容器头部（MP4 moov / Matroska），0 表示总是使用 ffprobe
+HEADER_PROBE_ENABLED = env_int("FFMPEG_TOOLS_HEADER_PROBE", 1)
+
+# 视频信息的来源
+PROBE_METHOD_CACHE = "cache"
+PROBE_METHOD_HEADER = "header"
+PROBE_METHOD_FFPROBE = "ffprobe"
+
+
+# ffprobe 结果缓存，三个工具共享，键为视频内容哈希
+_probe_cache = TieredCache(
+    "probe",
+    max_entries=env_int("FFMPEG_TOOLS_PROBE_CACHE_ENTRIES", 128),
+    max_bytes=env_int("FFMPEG_TOOLS_PROBE_CACHE_BYTES", 8 * 1024 * 1024),
+    disk_max_entries=env_int("FFMPEG_TOOLS_PROBE_DISK_CACHE_ENTRIES", 1024),
+    disk_max_bytes=env_int("FFMPEG_TOOLS_PROBE_DISK_CACHE_BYTES", 64 * 1024 * 1024),
+)
+
+
+def get_cached_probe(video_hash: str) -> dict | None:
+    cached = _probe_cache.get(video_hash)
+    if cached is None:
+        return None
+    return json.loads(cached)
+
+
+def probe_video_header(data: bytes, video_hash: str) -> dict | None:
+    """直接从内存中的容器头部读取视频信息并缓存，不认识或损坏的容器返回 None，由调用方回退到 probe_video()"""
+    if not HEADER_PROBE_ENABLED:
+        return None
+    video_metadata = probe_header(data)
+    if video_metadata is not None:
+        _probe_cache.put(video_hash, json.dumps(video_metadata).encode('utf-8'))
+    return video_metadata
+
+
+def probe_video(video_input: VideoInput, video_hash: str, deadline: Deadline | None = None) -> dict:
+    """
+    返回 ffprobe 解析后的 format / streams 信息，优先使用缓存。
+    失败时抛出 ProbeError，超时时抛出 ProcessTimeoutError。
+    """
+    cached = get_cached_probe(video_hash)
+    if cached is not None:
+        return cached
+
+    ffprobe_command = [
+        'ffprobe',
+        '-v', 'error',
+        '-print_format', 'json',
+        '-show_format',
+        '-show_streams',
+        video_input.path
+    ]
+
+    ffprobe_result = run_process(ffprobe_command, deadline=deadline, stage="ffprobe", **video_input.run_kwargs())
+    ffprobe_stdout = ffprobe_result.stdout.decode('utf-8', errors='replace')
+
+    if ffprobe_result.returncode != 0:
+        raise ProbeError(ffprobe_result.stderr.decode('utf-8', errors='replace'))
+
+    # 验证 ffprobe 输出是否为有效 JSON
+    if not ffprobe_stdout.strip():
+        raise ProbeError("ffprobe returned empty output")
+
+    try:
+        video_metadata = json.loads(ffprobe_stdout)
+    except json.JSONDecodeError as json_error:
+        raise ProbeError(f"Failed to parse ffprobe output as JSON: {str(json_error)}. Output: {ffprobe_stdout[:200]}...")
+
+    _probe_cache.put(video_hash, json.dumps(video_metadata).encode('utf-8'))
+    return video_metadata
+
+
+def get_duration(video_metadata: dict) -> float:
+    return float(video_metadata.get("format", {}).get("duration", 0))
@@ -0,0 +1,347 @@
+import os
+import signal
+import subprocess
+import threading
+import time
+import weakref
+
+from utils.config import env_int
+from utils.timing import StageTimer, timed
+from utils.scheduler import ProcessSlot, get_scheduler
+
+
+# 单个 ffmpeg / ffprobe 进程的超时（秒），默认 0 不单独限制，进程只受请求预算剩余时间的限制，
+# 单次解码整个长视频的进程也能用完整个预算
+PROCESS_TIMEOUT = env_int("FFMPEG_TOOLS_PROCESS_TIMEOUT", 0)
+# 单次工具调用内所有子进程共享的时间预算（秒），需小于 main.py 中的 MAX_REQUEST_TIMEOUT
+REQUEST_TIMEOUT = env_int("FFMPEG_TOOLS_REQUEST_TIMEOUT", 110)
+
+# 超时原因:
+#   timeout   - 超过单个进程的超时
+#   deadline  - 超过整个请求的时间预算
+#   cancelled - 调用方提前关闭了工具的生成器
+TIMEOUT_REASON_PROCESS = "timeout"
+TIMEOUT_REASON_DEADLINE = "deadline"
+TIMEOUT_REASON_CANCELLED = "cancelled"
+
+
+class ProcessTimeoutError(Exception):
+    """子进程超时或被取消，整个进程组已被结束"""
+
+    def __init__(self, command: list[str], reason: str, timeout: float | None, elapsed: float, stderr: bytes = b''):
+        self.program = os.path.basename(command[0]) if command else "unknown"
+        self.reason = reason
+        self.timeout = timeout
+        self.elapsed = elapsed
+        self.stderr = stderr.decode('utf-8', errors='replace') if stderr else ""
+        if reason == TIMEOUT_REASON_CANCELLED:
+            message = f"{self.program} was cancelled after {elapsed:.1f}s"
+        elif reason == TIMEOUT_REASON_DEADLINE:
+            message = f"{self.program} exceeded the request time budget after {elapsed:.1f}s"
+        else:
+            message = f"{self.program} timed out after {elapsed:.1f}s (limit {timeout:.1f}s)"
+        super().__init__(message)
+
+    def to_dict(self) -> dict:
+        return {
+            "type": self.reason,
+            "program": self.program,
+            "timeout_seconds": round(self.timeout, 3) if self.timeout is not None else None,
+            "elapsed_seconds": round(self.elapsed, 3),
+        }
+
+
+class Deadline:
+    """
+    一次工具调用的时间预算。记录正在运行的子进程，
+    cancel() 会结束所有进程组，之后的 run_process() 调用直接失败。
+    """
+
+    def __init__(self, budget: float = REQUEST_TIMEOUT, timer: StageTimer | None = None, process_timeout: float | None = None):
+        self.budget = budget
+        # 可选的阶段计时，run_process / ProcessStream 按 stage 名称记录每次运行的耗时
+        self.timer = timer
+        # 可选的单个进程超时，代替 PROCESS_TIMEOUT（如后台任务中较长的解码）
+        self.process_timeout = process_timeout
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + budget if budget > 0 else None
+        self.cancelled = False
+        # 进程调度按根预算区分调用，批量调用中每个文件的子预算属于同一个调用
+        self.root = self
+        self._lock = threading.Lock()
+        self._processes = set()
+        self._children = weakref.WeakSet()
+
+    def remaining(self) -> float | None:
+        if self.expires_at is None:
+            return None
+        return self.expires_at - time.monotonic()
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.cancelled = True
+            processes = list(self._processes)
+            children = list(self._children)
+        for process in processes:
+            kill_process_group(process)
+        for child in children:
+            child.cancel()
+
+    def child(self, timer: StageTimer | None = None) -> "Deadline":
+        """
+        共享同一到期时间的子预算，批量调用中每个文件使用一个。
+        取消本预算时子预算一并取消；子预算的 cancel() 不影响本预算和其他子预算。
+        """
+        child = Deadline(0, timer, self.process_timeout)
+        child.started_at = self.started_at
+        child.expires_at = self.expires_at
+        child.root = self.root
+        with self._lock:
+            self._children.add(child)
+            cancelled = self.cancelled
+        if cancelled:
+            child.cancel()
+        return child
+
+    def _register(self, process: subprocess.Popen) -> None:
+        with self._lock:
+            self._processes.add(process)
+            cancelled = self.cancelled
+        # 注册前已被取消时立即结束
+        if cancelled:
+            kill_process_group(process)
+
+    def _unregister(self, process: subprocess.Popen) -> None:
+        with self._lock:
+            self._processes.discard(process)
+
+
+def deadline_stage(deadline: Deadline | None, name: str):
+    """在 deadline 附带的计时器中记录一个阶段，没有计时器时不做任何记录"""
+    return timed(deadline.timer if deadline is not None else None, name)
+
+
+def kill_process_group(process: subprocess.Popen) -> None:
+    """结束子进程所在的整个进程组，包括 ffmpeg 派生的子进程"""
+    if process.poll() is not None:
+        return
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def _effective_timeout(timeout: float | None, deadline: Deadline | None) -> tuple[float | None, str]:
+    if deadline is not None and deadline.process_timeout is not None:
+        timeout = deadline.process_timeout
+    effective_timeout = timeout if timeout and timeout > 0 else None
+    reason = TIMEOUT_REASON_PROCESS
+    remaining = deadline.remaining() if deadline is not None else None
+    if remaining is not None and (effective_timeout is None or remaining < effective_timeout):
+        effective_timeout = remaining
+        reason = TIMEOUT_REASON_DEADLINE
+    return effective_timeout, reason
+
+
+def _acquire_slot(command: list[str], timeout: float | None, deadline: Deadline | None) -> ProcessSlot:
+    """
+    向进程调度器申请一个名额，排队时间计入请求预算（阶段 admission_wait），不计入单个进程的超时。
+    排队时预算用完或被取消时抛出 ProcessTimeoutError。
+    """
+    started_at = time.monotonic()
+    remaining = deadline.remaining() if deadline is not None else None
+    slot = get_scheduler().acquire(
+        deadline.root if deadline is not None else object(),
+        (lambda: deadline.cancelled) if deadline is not None else None,
+        remaining
+    )
+    if slot is None:
+        if deadline is not None and deadline.cancelled:
+            raise ProcessTimeoutError(command, TIMEOUT_REASON_CANCELLED, timeout, time.monotonic() - started_at)
+        raise ProcessTimeoutError(command, TIMEOUT_REASON_DEADLINE, remaining, time.monotonic() - started_at)
+    if slot.wait_seconds > 0 and deadline is not None and deadline.timer is not None:
+        deadline.timer.add("admission_wait", slot.wait_seconds)
+    return slot
+
+
+def run_process(command: list[str], timeout: float | None = PROCESS_TIMEOUT, deadline: Deadline | None = None, input: bytes | None = None, stage: str | None = None, **popen_kwargs) -> subprocess.CompletedProcess:
+    """
+    运行子进程并读取 stdout / stderr，用法与 subprocess.run 相同。
+    子进程在独立的进程组中启动；超过 timeout 或请求预算时结束整个进程组并抛出 ProcessTimeoutError。
+    启动前在进程调度器中排队，ffmpeg 的线程数由调度器决定。
+    stage 为计时使用的阶段名，默认使用程序名。
+    """
+    if deadline is not None and deadline.cancelled:
+        raise ProcessTimeoutError(command, TIMEOUT_REASON_CANCELLED, timeout, 0)
+    slot = _acquire_slot(command, timeout, deadline)
+    try:
+        with deadline_stage(deadline, stage or os.path.basename(command[0])):
+            return _run_process(slot.apply(command), timeout, deadline, input, **popen_kwargs)
+    finally:
+        slot.release()
+
+
+def _run_process(command: list[str], timeout: float | None, deadline: Deadline | None, input: bytes | None, **popen_kwargs) -> subprocess.CompletedProcess:
+    if deadline is not None and deadline.cancelled:
+        raise ProcessTimeoutError(command, TIMEOUT_REASON_CANCELLED, timeout, 0)
+
+    effective_timeout, reason = _effective_timeout(timeout, deadline)
+    if effective_timeout is not None and effective_timeout <= 0:
+        raise ProcessTimeoutError(command, reason, timeout, 0)
+
+    if input is not None:
+        popen_kwargs["stdin"] = subprocess.PIPE
+
+    started_at = time.monotonic()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True, **popen_kwargs)
+    if deadline is not None:
+        deadline._register(process)
+    try:
+        try:
+            stdout, stderr = process.communicate(input, timeout=effective_timeout)
+        except subprocess.TimeoutExpired:
+            kill_process_group(process)
+            _, stderr = process.communicate()
+            raise ProcessTimeoutError(command, reason, effective_timeout, time.monotonic() - started_at, stderr)
+        except BaseException:
+            kill_process_group(process)
+            process.wait()
+            raise
+    finally:
+        if deadline is not None:
+            deadline._unregister(process)
+
+    if deadline is not None and deadline.cancelled:
+        raise ProcessTimeoutError(command, TIMEOUT_REASON_CANCELLED, effective_timeout, time.monotonic() - started_at, stderr)
+
+    return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+
+
+class ProcessStream:
+    """
+    运行子进程并逐块读取 stdout，stderr 在后台线程中按行收集。
+    与 run_process 使用相同的进程组、超时和取消规则；需要在 with 语句中使用，退出时结束仍在运行的进程。
+    """
+
+    def __init__(self, command: list[str], timeout: float | None = PROCESS_TIMEOUT, deadline: Deadline | None = None, input: bytes | None = None, stage: str | None = None, **popen_kwargs):
+        self.command = command
+        self.stage = stage or os.path.basename(command[0])
+        self.deadline = deadline
+        self.stderr_lines = []
+        self._stderr_closed = False
+        self._condition = threading.Condition()
+        self._timed_out = False
+
+        if deadline is not None and deadline.cancelled:
+            raise ProcessTimeoutError(command, TIMEOUT_REASON_CANCELLED, timeout, 0)
+        self._timeout, self._reason = _effective_timeout(timeout, deadline)
+        if self._timeout is not None and self._timeout <= 0:
+            raise ProcessTimeoutError(command, self._reason, timeout, 0)
+
+        if input is not None:
+            popen_kwargs["stdin"] = subprocess.PIPE
+
+        # 名额在 close() 中进程结束后归还
+        self._slot = _acquire_slot(command, timeout, deadline)
+        self._timeout, self._reason = _effective_timeout(timeout, deadline)
+        self._started_at = time.monotonic()
+        try:
+            self.process = subprocess.Popen(self._slot.apply(command), stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True, **popen_kwargs)
+        except BaseException:
+            self._slot.release()
+            raise
+        if deadline is not None:
+            deadline._register(self.process)
+
+        self._threads = [threading.Thread(target=self._read_stderr, daemon=True)]
+        if input is not None:
+            self._threads.append(threading.Thread(target=self._write_stdin, args=(input,), daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+        self._timer = None
+        if self._timeout is not None:
+            self._timer = threading.Timer(self._timeout, self._expire)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _read_stderr(self) -> None:
+        for line in iter(self.process.stderr.readline, b''):
+            with self._condition:
+                self.stderr_lines.append(line.decode('utf-8', errors='replace'))
+                self._condition.notify_all()
+        with self._condition:
+            self._stderr_closed = True
+            self._condition.notify_all()
+
+    def _write_stdin(self, data: bytes) -> None:
+        try:
+            self.process.stdin.write(data)
+        except (BrokenPipeError, OSError):
+            pass
+        finally:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+
+    def _expire(self) -> None:
+        self._timed_out = True
+        kill_process_group(self.process)
+
+    def _raise_if_stopped(self) -> None:
+        elapsed = time.monotonic() - self._started_at
+        if self._timed_out:
+            raise ProcessTimeoutError(self.command, self._reason, self._timeout, elapsed, ''.join(self.stderr_lines).encode('utf-8'))
+        if self.deadline is not None and self.deadline.cancelled:
+            raise ProcessTimeoutError(self.command, TIMEOUT_REASON_CANCELLED, self._timeout, elapsed)
+
+    def chunks(self, chunk_size: int = 65536):
+        """产出 stdout 中已到达的数据，进程输出结束时停止"""
+        while True:
+            # read1 只做一次底层读取，有数据即返回；在 gevent 环境下也会让出执行权
+            chunk = self.process.stdout.read1(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+        self._raise_if_stopped()
+
+    def wait_for_stderr(self, predicate) -> bool:
+        """等待直到 predicate(stderr_lines) 为真或 stderr 结束，返回 predicate 的最终结果"""
+        with self._condition:
+            while True:
+                if predicate(self.stderr_lines):
+                    return True
+                if self._stderr_closed:
+                    return False
+                self._condition.wait()
+
+    def finish(self) -> subprocess.CompletedProcess:
+        """等待进程结束，返回与 run_process 相同的结果"""
+        returncode = self.process.wait()
+        for thread in self._threads:
+            thread.join()
+        self._raise_if_stopped()
+        return subprocess.CompletedProcess(self.command, returncode, None, ''.join(self.stderr_lines).encode('utf-8'))
+
+    def close(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        # 流式读取时记录的是进程从启动到结束的总时长，包含调用方处理已产出帧的时间
+        if self.deadline is not None and self.deadline.timer is not None:
+            self.deadline.timer.add(self.stage, time.monotonic() - self._started_at)
+        kill_process_group(self.process)
+        self.process.wait()
+        for thread in self._threads:
+            thread.join()
+        self.process.stdout.close()
+        self.process.stderr.close()
+        if self.deadline is not None:
+            self.deadline._unregister(self.process)
+        self._slot.release()
@@ -0,0 +1,160 @@
+import os
+import resource
+
+from utils.config import env_int
+
+
+# 插件内存上限，与 manifest.yaml 中 resource.memory 保持一致
+MEMORY_LIMIT_BYTES = env_int("FFMPEG_TOOLS_MEMORY_LIMIT", 268435456)
+
+
+def available_cpus() -> int:
+    """可用 CPU 数，考虑进程亲和性和 cgroup v2 的 cpu.max 配额"""
+    if hasattr(os, 'sched_getaffinity'):
+        cpu_count = len(os.sched_getaffinity(0))
+    else:
+        cpu_count = os.cpu_count() or 1
+
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as cpu_max_file:
+            quota, period = cpu_max_file.read().split()
+        if quota != 'max':
+            cpu_count = min(cpu_count, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+
+    return max(1, cpu_count)
+
+
+def estimate_decoder_memory(width: int, height: int) -> int:
+    """粗略估计单个 ffmpeg 解码进程的内存占用：参考帧和线程缓冲区按 20 帧 YUV420 计算"""
+    frame_bytes = max(width, 1) * max(height, 1) * 3 // 2
+    return max(32 * 1024 * 1024, frame_bytes * 20)
+
+
+class MemoryBudgetError(Exception):
+    pass
+
+
+# 插件进程本身（解释器、依赖和内存缓存）占用的基础内存
+BASE_MEMORY_BYTES = env_int("FFMPEG_TOOLS_BASE_MEMORY", 64 * 1024 * 1024)
+# 并行提取时已完成但尚未产出的帧数据上限
+FRAME_BUFFER_LIMIT_BYTES = env_int("FFMPEG_TOOLS_FRAME_BUFFER_LIMIT", 32 * 1024 * 1024)
+
+# 各输出格式每像素的编码大小估计，取偏大的值
+_BYTES_PER_PIXEL = {"jpeg": 0.5, "webp": 0.35, "png": 3.0}
+# 降级时缩小分辨率的下限
+_MIN_DEGRADED_WIDTH = 320
+
+
+def output_dimensions(width: int, height: int, encode_params: dict) -> tuple[int, int]:
+    """按 max_width / max_height 等比缩小后的输出尺寸"""
+    width, height = max(width, 1), max(height, 1)
+    scale = 1.0
+    if encode_params.get("max_width"):
+        scale = min(scale, encode_params["max_width"] / width)
+    if encode_params.get("max_height"):
+        scale = min(scale, encode_params["max_height"] / height)
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def estimate_frame_bytes(width: int, height: int, encode_params: dict) -> int:
+    """单帧编码后的大小估计"""
+    output_width, output_height = output_dimensions(width, height, encode_params)
+    bytes_per_pixel = _BYTES_PER_PIXEL.get(encode_params.get("format"), 0.5)
+    return max(16 * 1024, int(output_width * output_height * bytes_per_pixel))
+
+
+def estimate_peak_memory(blob_size: int, input_copy_bytes: int, width: int, height: int, workers: int, frames_in_memory: int, encode_params: dict) -> int:
+    """
+    估计一次提取的内存峰值：基础内存 + 上传内容 + 输入副本（memfd）
+    + 解码进程（与插件共享同一内存上限）+ 同时保存在内存中的帧数据。
+    """
+    return (
+        BASE_MEMORY_BYTES
+        + blob_size
+        + input_copy_bytes
+        + estimate_decoder_memory(width, height) * max(1, workers)
+        + estimate_frame_bytes(width, height, encode_params) * frames_in_memory
+    )
+
+
+class MemoryPlan:
+    """plan_memory() 的结果：可能降低分辨率或减少帧数后的参数，以及估计的内存峰值"""
+
+    def __init__(self, encode_params: dict, frame_count: int, estimated_peak_bytes: int, degraded: list[str]):
+        self.encode_params = encode_params
+        self.frame_count = frame_count
+        self.estimated_peak_bytes = estimated_peak_bytes
+        self.degraded = degraded
+
+    def to_dict(self) -> dict:
+        return {
+            "limit_bytes": MEMORY_LIMIT_BYTES,
+            "estimated_peak_bytes": self.estimated_peak_bytes,
+            "degraded": self.degraded,
+            **peak_rss(),
+        }
+
+
+def plan_memory(blob_size: int, input_copy_bytes: int, width: int, height: int, frame_count: int, workers: int, encode_params: dict, hold_all_frames: bool) -> MemoryPlan:
+    """
+    估计内存峰值，超出 MEMORY_LIMIT_BYTES 时依次降低输出分辨率、减少帧数；
+    仍然超出时抛出 MemoryBudgetError，在启动 ffmpeg 之前拒绝请求。
+    hold_all_frames 为 True 时（如去重）所有帧同时保存在内存中，否则逐帧产出。
+    """
+    degraded = []
+
+    def estimate(params: dict, count: int) -> int:
+        frames_in_memory = count if hold_all_frames else min(count, 1)
+        return estimate_peak_memory(blob_size, input_copy_bytes, width, height, workers, frames_in_memory, params)
+
+    peak = estimate(encode_params, frame_count)
+    if peak > MEMORY_LIMIT_BYTES and frame_count > 0:
+        output_width, _ = output_dimensions(width, height, encode_params)
+        resolution_reduced = False
+        while peak > MEMORY_LIMIT_BYTES and output_width // 2 >= _MIN_DEGRADED_WIDTH:
+            output_width //= 2
+            encode_params = {**encode_params, "max_width": output_width}
+            peak = estimate(encode_params, frame_count)
+            resolution_reduced = True
+        if resolution_reduced:
+            degraded.append(f"resolution reduced to max width {output_width}")
+
+    if peak > MEMORY_LIMIT_BYTES and hold_all_frames and frame_count > 1:
+        original_count = frame_count
+        while peak > MEMORY_LIMIT_BYTES and frame_count > 1:
+            frame_count = max(1, frame_count // 2)
+            peak = estimate(encode_params, frame_count)
+        degraded.append(f"frame count reduced from {original_count} to {frame_count}")
+
+    if peak > MEMORY_LIMIT_BYTES:
+        raise MemoryBudgetError(
+            f"Estimated peak memory {peak / (1024 * 1024):.1f} MB exceeds the plugin limit of "
+            f"{MEMORY_LIMIT_BYTES / (1024 * 1024):.1f} MB; try a smaller video"
+        )
+
+    return MemoryPlan(encode_params, frame_count, peak, degraded)
+
+
+def plan_output_memory(blob_size: int, input_copy_bytes: int, process_memory: int, output_bytes: int, output_copy_bytes: int) -> MemoryPlan:
+    """
+    估计输出单个文件（视频片段、音频）时的内存峰值：基础内存 + 上传内容 + 输入副本 + ffmpeg 进程
+    + 返回的输出数据和 memfd 中的副本。超出 MEMORY_LIMIT_BYTES 时抛出 MemoryBudgetError。
+    """
+    peak = BASE_MEMORY_BYTES + blob_size + input_copy_bytes + process_memory + output_bytes + output_copy_bytes
+    if peak > MEMORY_LIMIT_BYTES:
+        raise MemoryBudgetError(
+            f"Estimated peak memory {peak / (1024 * 1024):.1f} MB exceeds the plugin limit of "
+            f"{MEMORY_LIMIT_BYTES / (1024 * 1024):.1f} MB; try a smaller video or a smaller output"
+        )
+    return MemoryPlan({}, 1, peak, [])
+
+
+def peak_rss() -> dict:
+    """插件进程和已结束子进程（ffmpeg / ffprobe）中最大的常驻内存峰值，均为进程生命周期内的值"""
+    # Linux 上 ru_maxrss 的单位是 KB
+    return {
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "child_peak_rss_bytes": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024,
+    }
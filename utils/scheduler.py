@@ -0,0 +1,191 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from collections.abc import Callable
+
+from utils.config import env_int
+from utils.resources import available_cpus
+
+
+# 同时运行的 ffmpeg / ffprobe 进程数上限，0 表示按可用 CPU 计算（至少 2 个）
+MAX_PROCESSES = env_int("FFMPEG_TOOLS_MAX_PROCESSES", 0)
+# 每个 ffmpeg 进程的解码和滤镜线程数，0 表示按放行时正在运行的进程数平分可用 CPU
+PROCESS_THREADS = env_int("FFMPEG_TOOLS_PROCESS_THREADS", 0)
+
+# 排队时检查取消和时间预算的间隔（秒）
+_WAIT_INTERVAL = 0.1
+
+
+class _Ticket:
+    """一个排队中的进程"""
+
+    def __init__(self):
+        self.granted = False
+        self.threads = 1
+
+
+class ProcessSlot:
+    """放行的一个进程名额，进程结束后调用 release()"""
+
+    def __init__(self, scheduler: "ProcessScheduler", thread_id: int, threads: int, wait_seconds: float):
+        self.threads = threads
+        self.wait_seconds = wait_seconds
+        self._scheduler = scheduler
+        self._thread_id = thread_id
+        self._released = False
+
+    def apply(self, command: list[str]) -> list[str]:
+        """
+        为 ffmpeg 命令加上线程数限制：-filter_threads 为全局选项，-threads 放在第一个 -i 之前限制解码线程。
+        ffprobe、没有输入文件的命令和已经指定线程数的命令保持不变。
+        """
+        if os.path.basename(command[0]) != 'ffmpeg' or '-i' not in command or '-threads' in command:
+            return command
+        input_index = command.index('-i')
+        return [
+            command[0], '-filter_threads', str(self.threads),
+            *command[1:input_index], '-threads', str(self.threads),
+            *command[input_index:]
+        ]
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._scheduler._release(self._thread_id)
+
+
+class ProcessScheduler:
+    """
+    进程级的子进程准入控制：同时运行的 ffmpeg / ffprobe 不超过 max_processes。
+    等待的进程按调用（根 Deadline，批量调用的所有文件算一个调用）轮流放行，
+    一个启动大量进程的调用不会让其他调用一直排在后面。
+    已经持有名额的线程再启动进程（如流式解码时重新编码图片）直接放行，避免互相等待。
+    """
+
+    def __init__(self, max_processes: int, threads: int = 0):
+        self.max_processes = max(1, max_processes)
+        self._threads = threads
+        self._cpus = available_cpus()
+        self._condition = threading.Condition()
+        self._running = 0
+        # 调用 -> 该调用排队中的 _Ticket，按轮转顺序排列
+        self._queues = OrderedDict()
+        # 线程 -> 该线程持有的名额数
+        self._held = {}
+        self._admitted_total = 0
+        self._queued_total = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def acquire(self, invocation: object, should_stop: Callable[[], bool] | None = None, timeout: float | None = None) -> ProcessSlot | None:
+        """
+        等待一个进程名额。should_stop() 为真或超过 timeout 秒仍未放行时返回 None。
+        """
+        thread_id = threading.get_ident()
+        started_at = time.monotonic()
+        with self._condition:
+            if self._held.get(thread_id) or (not self._queues and self._running < self.max_processes):
+                return self._admit(thread_id, self._thread_count(self._running + 1), 0.0)
+
+            ticket = _Ticket()
+            self._queues.setdefault(invocation, deque()).append(ticket)
+            self._queued_total += 1
+            admitted = False
+            try:
+                while not ticket.granted:
+                    if should_stop is not None and should_stop():
+                        return None
+                    wait_seconds = _WAIT_INTERVAL
+                    if timeout is not None:
+                        remaining = timeout - (time.monotonic() - started_at)
+                        if remaining <= 0:
+                            return None
+                        wait_seconds = min(wait_seconds, remaining)
+                    self._condition.wait(wait_seconds)
+
+                # _dispatch() 放行时已计入 _running
+                wait_seconds = time.monotonic() - started_at
+                self._wait_total += wait_seconds
+                self._wait_max = max(self._wait_max, wait_seconds)
+                slot = self._admit(thread_id, ticket.threads, wait_seconds, counted=True)
+                admitted = True
+                return slot
+            finally:
+                if not ticket.granted:
+                    self._remove(invocation, ticket)
+                elif not admitted:
+                    # 放行后等待被中断（如 greenlet 被结束），归还名额
+                    self._running -= 1
+                    self._dispatch()
+
+    def _admit(self, thread_id: int, threads: int, wait_seconds: float, counted: bool = False) -> ProcessSlot:
+        if not counted:
+            self._running += 1
+        self._held[thread_id] = self._held.get(thread_id, 0) + 1
+        self._admitted_total += 1
+        return ProcessSlot(self, thread_id, threads, wait_seconds)
+
+    def _release(self, thread_id: int) -> None:
+        with self._condition:
+            self._running -= 1
+            held = self._held.get(thread_id, 0) - 1
+            if held > 0:
+                self._held[thread_id] = held
+            else:
+                self._held.pop(thread_id, None)
+            self._dispatch()
+
+    def _remove(self, invocation: object, ticket: _Ticket) -> None:
+        queue = self._queues.get(invocation)
+        if queue is None:
+            return
+        try:
+            queue.remove(ticket)
+        except ValueError:
+            pass
+        if not queue:
+            del self._queues[invocation]
+
+    def _dispatch(self) -> None:
+        """按轮转顺序放行：每次放行队首调用的第一个进程，然后把该调用移到队尾"""
+        granted = False
+        while self._queues and self._running < self.max_processes:
+            invocation, queue = next(iter(self._queues.items()))
+            ticket = queue.popleft()
+            if queue:
+                self._queues.move_to_end(invocation)
+            else:
+                del self._queues[invocation]
+            self._running += 1
+            ticket.threads = self._thread_count(self._running)
+            ticket.granted = True
+            granted = True
+        if granted:
+            self._condition.notify_all()
+
+    def _thread_count(self, running: int) -> int:
+        if self._threads > 0:
+            return self._threads
+        return max(1, self._cpus // max(1, running))
+
+    def to_dict(self) -> dict:
+        with self._condition:
+            return {
+                "max_processes": self.max_processes,
+                "running": self._running,
+                # 当前排队的进程数和调用数
+                "queued": sum(len(queue) for queue in self._queues.values()),
+                "queued_invocations": len(self._queues),
+                "admitted_total": self._admitted_total,
+                "queued_total": self._queued_total,
+                "wait_total_ms": round(self._wait_total * 1000, 3),
+                "wait_max_ms": round(self._wait_max * 1000, 3),
+            }
+
+
+_scheduler = ProcessScheduler(MAX_PROCESSES if MAX_PROCESSES > 0 else max(2, available_cpus()), PROCESS_THREADS)
+
+
+def get_scheduler() -> ProcessScheduler:
+    return _scheduler
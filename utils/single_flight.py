@@ -0,0 +1,208 @@
+import hashlib
+import json
+import threading
+from collections.abc import Callable, Generator
+
+from dify_plugin.entities.tool import ToolInvokeMessage
+
+from utils.cache import content_hash
+from utils.config import env_int
+from utils.process import Deadline
+from utils.timing import StageTimer, record_metrics
+
+
+# 是否合并内容和参数都相同的并发调用，0 表示关闭
+COALESCE_ENABLED = env_int("FFMPEG_TOOLS_COALESCE", 1) > 0
+# 第一个调用为等待者保存的消息（主要是图片和视频数据）的最大字节数，超出时不再保存，等待者各自处理
+COALESCE_MAX_BYTES = env_int("FFMPEG_TOOLS_COALESCE_MAX_BYTES", 32 * 1024 * 1024)
+
+# 不参与键计算的参数：文件对象由内容哈希代替
+_FILE_PARAMETERS = ('video', 'videos')
+# 等待第一个调用时检查取消的间隔（秒）
+_WAIT_INTERVAL = 0.1
+
+_flights_lock = threading.Lock()
+# 键 -> 正在处理的 _Flight
+_flights = {}
+_total_coalesced = 0
+
+
+class _Flight:
+    """一次正在处理的调用：第一个调用产出的消息，以及等待它的调用数"""
+
+    def __init__(self):
+        self.messages = []
+        self.recorded_bytes = 0
+        self.waiters = 0
+        self.done = threading.Event()
+        # 完成后为 True 表示等待者可以直接复用 messages
+        self.shared = False
+
+
+def normalize_parameters(tool_parameters: dict) -> str:
+    """
+    参与键计算的参数：去掉文件参数和空值，数字字符串按数值比较（"5" 与 5 相同），按名称排序后序列化。
+    """
+    normalized = {}
+    for name, value in tool_parameters.items():
+        if name in _FILE_PARAMETERS or value is None or value == '':
+            continue
+        if isinstance(value, str):
+            try:
+                value = float(value)
+            except ValueError:
+                pass
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = float(value)
+        normalized[name] = value
+    return json.dumps(normalized, sort_keys=True, default=str)
+
+
+def coalesce_key(tool_name: str, video_hash: str, filename: str, tool_parameters: dict) -> str:
+    # 文件名会出现在输出的文件名和 JSON 中，也参与键计算
+    key_source = f"{tool_name}:{video_hash}:{filename}:{normalize_parameters(tool_parameters)}"
+    return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+
+def _message_bytes(message: ToolInvokeMessage) -> int:
+    if message.type == ToolInvokeMessage.MessageType.BLOB:
+        return len(message.message.blob)
+    return 0
+
+
+def _is_timeout_result(message: ToolInvokeMessage) -> bool:
+    # 超时取决于第一个调用自己的时间预算（批量调用时与其他文件共享），不复用给等待者
+    return message.type == ToolInvokeMessage.MessageType.JSON and "timeout" in message.message.json_object
+
+
+def _coalescing_info(flight: _Flight, coalesced: bool, wait_seconds: float | None = None) -> dict:
+    info = {
+        "coalesced": coalesced,
+        # 产出结果时等待同一结果的调用数
+        "waiters": flight.waiters,
+        "total_coalesced": _total_coalesced,
+    }
+    if wait_seconds is not None:
+        info["wait_ms"] = round(wait_seconds * 1000, 2)
+    return info
+
+
+def _stop_sharing(key: str, flight: _Flight) -> None:
+    """
+    调用方持有 _flights_lock。不再为等待者保存消息，已保存的消息立即释放；
+    之后到达的相同调用重新处理，已在等待的调用不必等第一个调用结束，立即各自处理。
+    """
+    flight.messages = None
+    if _flights.get(key) is flight:
+        del _flights[key]
+    flight.done.set()
+
+
+def _lead(tool, key: str, flight: _Flight, messages: Generator[ToolInvokeMessage, None, None]) -> Generator[ToolInvokeMessage, None, None]:
+    """
+    第一个调用：正常产出消息，同时保存副本给等待者；JSON 中附带 coalescing。
+    在完成之前保持登记，ffmpeg 运行期间到达的相同调用也可以等待它；保存的消息受 COALESCE_MAX_BYTES 限制。
+    """
+    global _total_coalesced
+    completed = False
+    timed_out = False
+    try:
+        for message in messages:
+            if flight.messages is not None:
+                flight.recorded_bytes += _message_bytes(message)
+                if flight.recorded_bytes > COALESCE_MAX_BYTES:
+                    # 结果太大，不再为等待者保存
+                    with _flights_lock:
+                        _stop_sharing(key, flight)
+                else:
+                    # 浅拷贝：批量调用会替换转发的消息的 meta，数据本身共享
+                    flight.messages.append(message.model_copy())
+            if message.type == ToolInvokeMessage.MessageType.JSON:
+                timed_out = timed_out or _is_timeout_result(message)
+                yield tool.create_json_message({**message.message.json_object, "coalescing": _coalescing_info(flight, False)})
+            else:
+                yield message
+        completed = True
+    finally:
+        messages.close()
+        with _flights_lock:
+            if _flights.get(key) is flight:
+                del _flights[key]
+            flight.shared = completed and not timed_out and flight.messages is not None
+            if flight.shared:
+                _total_coalesced += flight.waiters
+        # 之后到达的相同调用重新处理，已在等待的调用复用结果或各自处理
+        flight.done.set()
+
+
+def _wait_for_flight(flight: _Flight, deadline: Deadline) -> bool:
+    """等待第一个调用完成，返回 True；调用被取消或时间预算用完时不再等待，返回 False"""
+    while True:
+        wait_seconds = _WAIT_INTERVAL
+        remaining = deadline.remaining()
+        if remaining is not None:
+            wait_seconds = max(0.0, min(wait_seconds, remaining))
+        if flight.done.wait(wait_seconds):
+            return True
+        if deadline.cancelled or (remaining is not None and remaining <= wait_seconds):
+            with _flights_lock:
+                flight.waiters -= 1
+            return False
+
+
+def coalesce_invocation(
+    tool,
+    tool_name: str,
+    tool_parameters: dict,
+    video_hash: str | None,
+    parent_deadline: Deadline | None,
+    invoke: Callable[[str | None, StageTimer, Deadline], Generator[ToolInvokeMessage, None, None]]
+) -> Generator[ToolInvokeMessage, None, None]:
+    """
+    合并内容和参数都相同的并发调用（如工作流并行分支对同一上传文件做相同的处理）：
+    第一个调用运行 invoke(内容哈希, 计时器, 时间预算)，其余调用等待它完成后产出同样的消息（同一份数据），不再各自启动 ffmpeg。
+    第一个调用未完成（被关闭、出错）、超时或结果超出 COALESCE_MAX_BYTES 时，等待者各自运行 invoke。
+    时间预算在等待之前创建（批量调用时为 parent_deadline），等待的时间和之后各自处理的时间共用这一个预算。
+    """
+    video_file = tool_parameters.get('video')
+    timer = StageTimer()
+    deadline = parent_deadline if parent_deadline is not None else Deadline(timer=timer)
+    if not COALESCE_ENABLED or not video_file:
+        yield from invoke(video_hash, timer, deadline)
+        return
+
+    # 批量调用时内容哈希已由 invoke_batch 计算
+    if video_hash is None:
+        with timer.stage("hash"):
+            video_hash = content_hash(video_file.blob)
+    key = coalesce_key(tool_name, video_hash, video_file.filename, tool_parameters)
+
+    with _flights_lock:
+        flight = _flights.get(key)
+        if flight is None:
+            flight = _flights[key] = _Flight()
+            leader = True
+        else:
+            flight.waiters += 1
+            leader = False
+
+    if leader:
+        yield from _lead(tool, key, flight, invoke(video_hash, timer, deadline))
+        return
+
+    # 批量调用被取消时直接结束；预算用完时由 invoke 按超时返回错误
+    with timer.stage("coalesce_wait"):
+        finished = _wait_for_flight(flight, deadline)
+    if deadline.cancelled:
+        return
+    if not finished or not flight.shared:
+        yield from invoke(video_hash, timer, deadline)
+        return
+
+    wait_seconds = timer.stage_totals().get("coalesce_wait", 0.0)
+    for message in flight.messages:
+        if message.type == ToolInvokeMessage.MessageType.JSON:
+            yield tool.create_json_message({**message.message.json_object, "coalescing": _coalescing_info(flight, True, wait_seconds)})
+        else:
+            yield message.model_copy()
+    record_metrics(tool_name, timer)
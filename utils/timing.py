@@ -0,0 +1,130 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from utils.config import env_str
+
+
+# 可选的指标文件：jsonl 每次调用追加一行，prometheus 以 textfile 格式覆盖写入累计的直方图
+METRICS_FILE = env_str("FFMPEG_TOOLS_METRICS_FILE")
+METRICS_FORMAT_JSONL = "jsonl"
+METRICS_FORMAT_PROMETHEUS = "prometheus"
+METRICS_FORMAT = env_str("FFMPEG_TOOLS_METRICS_FORMAT", METRICS_FORMAT_JSONL) or METRICS_FORMAT_JSONL
+
+# 直方图的桶（秒），用于估计各阶段的 p50 / p99
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_metrics_lock = threading.Lock()
+# (工具名, 阶段) -> [各桶计数..., 总次数, 总耗时]
+_histograms = {}
+
+
+class StageTimer:
+    """记录一次工具调用中各阶段的耗时，同一阶段多次执行时累计次数、总耗时和最大耗时"""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            stage = self._stages.setdefault(name, [0, 0.0, 0.0])
+            stage[0] += 1
+            stage[1] += seconds
+            stage[2] = max(stage[2], seconds)
+
+    @contextmanager
+    def stage(self, name: str):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started_at)
+
+    def stage_totals(self) -> dict[str, float]:
+        with self._lock:
+            return {name: stage[1] for name, stage in self._stages.items()}
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            stages = {
+                name: {
+                    "count": count,
+                    "total_ms": round(total * 1000, 3),
+                    "max_ms": round(longest * 1000, 3),
+                }
+                for name, (count, total, longest) in self._stages.items()
+            }
+        return {
+            "total_ms": round((time.perf_counter() - self.started_at) * 1000, 3),
+            "stages": stages,
+        }
+
+
+@contextmanager
+def timed(timer: StageTimer | None, name: str):
+    """timer 为 None 时不做任何记录"""
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
+
+
+def _write_atomic(path: str, content: str) -> None:
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".metrics_")
+    try:
+        with os.fdopen(fd, 'w') as metrics_file:
+            metrics_file.write(content)
+        os.replace(temp_path, path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+
+def _render_prometheus() -> str:
+    lines = [
+        "# HELP ffmpeg_tools_stage_seconds Time spent in each stage of a tool call.",
+        "# TYPE ffmpeg_tools_stage_seconds histogram",
+    ]
+    for (tool_name, stage_name), values in sorted(_histograms.items()):
+        labels = f'tool="{tool_name}",stage="{stage_name}"'
+        bucket_counts, count, total = values[:-2], values[-2], values[-1]
+        for bucket, bucket_count in zip(HISTOGRAM_BUCKETS, bucket_counts):
+            lines.append(f'ffmpeg_tools_stage_seconds_bucket{{{labels},le="{bucket}"}} {bucket_count}')
+        lines.append(f'ffmpeg_tools_stage_seconds_bucket{{{labels},le="+Inf"}} {count}')
+        lines.append(f'ffmpeg_tools_stage_seconds_sum{{{labels}}} {total:.6f}')
+        lines.append(f'ffmpeg_tools_stage_seconds_count{{{labels}}} {count}')
+    return "\n".join(lines) + "\n"
+
+
+def record_metrics(tool_name: str, timer: StageTimer) -> None:
+    """把一次调用的阶段耗时写入 FFMPEG_TOOLS_METRICS_FILE，未配置时不做任何事；写入失败不影响工具调用"""
+    if not METRICS_FILE:
+        return
+
+    timings = timer.to_dict()
+    stage_seconds = {**timer.stage_totals(), "total": timings["total_ms"] / 1000}
+
+    try:
+        with _metrics_lock:
+            if METRICS_FORMAT == METRICS_FORMAT_PROMETHEUS:
+                for stage_name, seconds in stage_seconds.items():
+                    values = _histograms.setdefault((tool_name, stage_name), [0] * (len(HISTOGRAM_BUCKETS) + 2))
+                    for index, bucket in enumerate(HISTOGRAM_BUCKETS):
+                        if seconds <= bucket:
+                            values[index] += 1
+                    values[-2] += 1
+                    values[-1] += seconds
+                _write_atomic(METRICS_FILE, _render_prometheus())
+            else:
+                with open(METRICS_FILE, 'a') as metrics_file:
+                    metrics_file.write(json.dumps({"timestamp": time.time(), "tool": tool_name, **timings}) + "\n")
+    except OSError:
+        pass
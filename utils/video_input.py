@@ -0,0 +1,207 @@
+import os
+import struct
+import subprocess
+import tempfile
+
+from utils.config import env_int, env_str
+from utils.timing import StageTimer, timed
+
+
+# 输入方式:
+#   memfd    - 写入匿名内存文件，通过 /proc/self/fd/N 传给子进程，可随机访问
+#   pipe     - 通过 stdin (pipe:0) 传给子进程，不可随机访问
+#   tempfile - 写入临时文件（旧行为）
+INPUT_MODE_MEMFD = "memfd"
+INPUT_MODE_PIPE = "pipe"
+INPUT_MODE_TEMPFILE = "tempfile"
+INPUT_MODE_AUTO = "auto"
+
+INPUT_MODE = env_str("FFMPEG_TOOLS_INPUT_MODE", INPUT_MODE_AUTO) or INPUT_MODE_AUTO
+
+# memfd 与上传内容各占一份内存，auto 模式下超过该大小的视频不使用 memfd
+MEMFD_MAX_BYTES = env_int("FFMPEG_TOOLS_MEMFD_MAX_BYTES", 32 * 1024 * 1024)
+# 写入 memfd / 临时文件时每次写入的大小
+SPOOL_CHUNK_BYTES = 1024 * 1024
+
+_MATROSKA_MAGIC = b'\x1a\x45\xdf\xa3'
+
+
+def mp4_moov_before_mdat(data: bytes) -> bool | None:
+    """
+    遍历 MP4/MOV 顶层 box，判断 moov 是否位于 mdat 之前。
+    不是 MP4 结构或无法判断时返回 None。
+    """
+    offset = 0
+    data_length = len(data)
+    while offset + 8 <= data_length:
+        box_size, box_type = struct.unpack('>I4s', data[offset:offset + 8])
+        if offset == 0 and box_type not in (b'ftyp', b'moov', b'mdat', b'free', b'wide', b'skip'):
+            return None
+        if box_type == b'moov':
+            return True
+        if box_type == b'mdat':
+            return False
+        if box_size == 1:
+            if offset + 16 > data_length:
+                return None
+            box_size = struct.unpack('>Q', data[offset + 8:offset + 16])[0]
+        elif box_size == 0:
+            return None
+        if box_size < 8:
+            return None
+        offset += box_size
+    return None
+
+
+def is_streamable(data: bytes) -> bool:
+    """判断容器是否可以不随机访问地从管道中读取"""
+    if data[:4] == _MATROSKA_MAGIC:
+        return True
+    return mp4_moov_before_mdat(data) is True
+
+
+class VideoInput:
+    """传给 ffmpeg/ffprobe 的视频输入，使用 run_kwargs() 得到 subprocess 所需的参数"""
+
+    def __init__(self, mode: str, path: str, stdin_data: bytes | None = None, fd: int | None = None):
+        self.mode = mode
+        self.path = path
+        self.stdin_data = stdin_data
+        self.fd = fd
+
+    @property
+    def memory_bytes(self) -> int:
+        """输入方式额外占用的内存：memfd 中的副本"""
+        if self.mode == INPUT_MODE_MEMFD and self.fd is not None:
+            return os.fstat(self.fd).st_size
+        return 0
+
+    def run_kwargs(self) -> dict:
+        if self.mode == INPUT_MODE_PIPE:
+            return {"input": self.stdin_data}
+        kwargs = {"stdin": subprocess.DEVNULL}
+        if self.fd is not None:
+            kwargs["pass_fds"] = (self.fd,)
+        return kwargs
+
+    def close(self) -> None:
+        if self.mode == INPUT_MODE_MEMFD and self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        elif self.mode == INPUT_MODE_TEMPFILE and os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def _write_chunked(fd: int, data: bytes) -> None:
+    """分块写入文件描述符，不创建上传内容的切片副本"""
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view[:SPOOL_CHUNK_BYTES])
+        view = view[written:]
+
+
+def write_temp_video(video_file) -> str:
+    """把上传的视频写入临时文件，返回文件路径，由调用方负责删除"""
+    input_file_extension = video_file.extension if video_file.extension else '.mp4'
+    with tempfile.NamedTemporaryFile(delete=False, suffix=input_file_extension) as in_temp_file:
+        try:
+            _write_chunked(in_temp_file.fileno(), video_file.blob)
+        except OSError:
+            in_temp_file.close()
+            os.unlink(in_temp_file.name)
+            raise
+        return in_temp_file.name
+
+
+def _open_memfd(data: bytes) -> VideoInput | None:
+    if not hasattr(os, 'memfd_create'):
+        return None
+    try:
+        fd = os.memfd_create("ffmpeg_tools_video", os.MFD_CLOEXEC)
+    except OSError:
+        return None
+    try:
+        _write_chunked(fd, data)
+    except OSError:
+        os.close(fd)
+        return None
+    return VideoInput(INPUT_MODE_MEMFD, f"/proc/self/fd/{fd}", fd=fd)
+
+
+def estimate_input_memory(blob_size: int) -> int:
+    """open_video_input() 在上传内容之外额外占用的内存估计"""
+    if INPUT_MODE == INPUT_MODE_MEMFD or (INPUT_MODE == INPUT_MODE_AUTO and blob_size <= MEMFD_MAX_BYTES):
+        return blob_size
+    return 0
+
+
+def open_video_input(video_file, needs_seek: bool = True, timer: StageTimer | None = None) -> VideoInput:
+    """
+    为上传的视频选择输入方式，调用方用完后需要调用 close()。
+    auto 模式下较小的视频优先使用 memfd；不需要定位且容器可流式读取时使用管道；否则回退到临时文件。
+    """
+    with timed(timer, "spool"):
+        return _open_video_input(video_file, needs_seek)
+
+
+def _open_video_input(video_file, needs_seek: bool) -> VideoInput:
+    data = video_file.blob
+
+    if INPUT_MODE == INPUT_MODE_MEMFD or (INPUT_MODE == INPUT_MODE_AUTO and len(data) <= MEMFD_MAX_BYTES):
+        video_input = _open_memfd(data)
+        if video_input is not None:
+            return video_input
+
+    if INPUT_MODE in (INPUT_MODE_AUTO, INPUT_MODE_PIPE) and not needs_seek and is_streamable(data):
+        return VideoInput(INPUT_MODE_PIPE, 'pipe:0', stdin_data=data)
+
+    return VideoInput(INPUT_MODE_TEMPFILE, write_temp_video(video_file))
+
+
+def uses_memfd_output(estimated_bytes: int) -> bool:
+    """OutputFile 是否写入 memfd（在返回的数据之外额外占用内存）"""
+    return hasattr(os, 'memfd_create') and estimated_bytes <= MEMFD_MAX_BYTES
+
+
+class OutputFile:
+    """ffmpeg 输出文件：预计不超过 MEMFD_MAX_BYTES 时写入 memfd（可随机访问，MP4 / WAV 需要回写头部），否则写入临时文件"""
+
+    def __init__(self, estimated_bytes: int, suffix: str, name: str = "ffmpeg_tools_output"):
+        self.fd = None
+        self.temp_path = None
+        if uses_memfd_output(estimated_bytes):
+            try:
+                self.fd = os.memfd_create(name, os.MFD_CLOEXEC)
+            except OSError:
+                self.fd = None
+        if self.fd is not None:
+            self.path = f"/proc/self/fd/{self.fd}"
+        else:
+            self.fd, self.temp_path = tempfile.mkstemp(suffix=suffix)
+            self.path = self.temp_path
+
+    def run_kwargs(self, input_kwargs: dict) -> dict:
+        """在输入的 VideoInput.run_kwargs() 中加入输出 memfd；临时文件由 ffmpeg 按路径打开"""
+        if self.temp_path is not None:
+            return input_kwargs
+        return {**input_kwargs, "pass_fds": tuple(input_kwargs.get("pass_fds", ())) + (self.fd,)}
+
+    def read(self) -> bytes:
+        """子进程结束后读取写入的全部数据"""
+        size = os.fstat(self.fd).st_size
+        chunks = []
+        offset = 0
+        while offset < size:
+            chunk = os.pread(self.fd, min(size - offset, 16 * 1024 * 1024), offset)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            offset += len(chunk)
+        return b''.join(chunks)
+
+    def close(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        if self.temp_path is not None and os.path.exists(self.temp_path):
+            os.unlink(self.temp_path)